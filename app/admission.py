@@ -0,0 +1,192 @@
+import asyncio
+import functools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from .metrics import register_metrics
+
+# Global in-flight budget for the whole process
+ADMISSION_MAX_REQUESTS = int(os.getenv("ADMISSION_MAX_REQUESTS", 32))
+ADMISSION_MAX_BYTES = int(os.getenv("ADMISSION_MAX_BYTES", 64 * 1024 * 1024))
+# Longest a request may wait for admission before it is answered with the busy clip
+ADMISSION_MAX_QUEUE_WAIT = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT", 3.0))
+# Starting guess of a pipeline run, refined by a moving average of real runs
+ADMISSION_INITIAL_SERVICE_TIME = float(os.getenv("ADMISSION_INITIAL_SERVICE_TIME", 5.0))
+
+# Default concurrent calls per upstream provider, override with e.g. AZURE_TTS_MAX_CONCURRENCY
+PROVIDER_MAX_CONCURRENCY = int(os.getenv("PROVIDER_MAX_CONCURRENCY", 16))
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of being queued."""
+
+class AdmissionController:
+    """
+    Bound the number and size of requests in flight.
+
+    Requests that do not fit wait in a FIFO queue. A request is shed right away when
+    the estimated queue wait exceeds the allowed wait, or when its wait runs out.
+    """
+
+    def __init__(self, max_requests=ADMISSION_MAX_REQUESTS, max_bytes=ADMISSION_MAX_BYTES,
+                 max_queue_wait=ADMISSION_MAX_QUEUE_WAIT, initial_service_time=ADMISSION_INITIAL_SERVICE_TIME):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.max_queue_wait = max_queue_wait
+        self.service_time = initial_service_time
+        self.in_flight_requests = 0
+        self.in_flight_bytes = 0
+        self.admitted = 0
+        self.shed = 0
+        self._waiters = deque()
+        self._loop = None
+
+    @asynccontextmanager
+    async def admit(self, num_bytes, max_wait=None):
+        """
+        Hold an admission slot for the duration of the block.
+
+        :param num_bytes: Size of the request payload counted against the bytes budget
+        :param max_wait: Longest queue wait for this request, defaults to max_queue_wait
+        :raises Overloaded: When the request is shed
+        """
+        await self._acquire(num_bytes, self.max_queue_wait if max_wait is None else max_wait)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(num_bytes, time.monotonic() - start)
+
+    def estimated_wait(self, position):
+        """Estimated queue wait of a request at `position` (0 is the head of the queue)."""
+        return (position + 1) * self.service_time / self.max_requests
+
+    def stats(self):
+        return {
+            "in_flight_requests": self.in_flight_requests,
+            "in_flight_bytes": self.in_flight_bytes,
+            "queue_depth": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "service_time": round(self.service_time, 3),
+        }
+
+    async def _acquire(self, num_bytes, max_wait):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Lambda runs every invocation on a fresh loop, waiters of an old loop are gone
+            self._loop = loop
+            self._waiters.clear()
+
+        if not self._waiters and self._fits(num_bytes):
+            self._take(num_bytes)
+            return
+
+        if self.estimated_wait(len(self._waiters)) > max_wait:
+            self.shed += 1
+            raise Overloaded("Estimated queue wait exceeds the latency budget")
+
+        future = loop.create_future()
+        entry = (future, num_bytes)
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max_wait)
+        except asyncio.TimeoutError:
+            if future.done():
+                return  # The slot was granted just as the wait ran out
+            future.cancel()
+            self._waiters.remove(entry)
+            self.shed += 1
+            raise Overloaded("Queue wait exceeded the latency budget")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(num_bytes, None)
+            else:
+                future.cancel()
+                self._waiters.remove(entry)
+            raise
+
+    def _fits(self, num_bytes):
+        if self.in_flight_requests == 0:
+            return True  # Always let one request through, however large
+        return (self.in_flight_requests < self.max_requests
+                and self.in_flight_bytes + num_bytes <= self.max_bytes)
+
+    def _take(self, num_bytes):
+        self.in_flight_requests += 1
+        self.in_flight_bytes += num_bytes
+        self.admitted += 1
+
+    def _release(self, num_bytes, elapsed):
+        self.in_flight_requests -= 1
+        self.in_flight_bytes -= num_bytes
+        if elapsed is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+
+        # Hand the freed capacity to the head of the queue
+        while self._waiters:
+            future, waiting_bytes = self._waiters[0]
+            if future.cancelled():
+                self._waiters.popleft()
+                continue
+            if not self._fits(waiting_bytes):
+                break
+            self._waiters.popleft()
+            self._take(waiting_bytes)
+            future.set_result(True)
+
+class ProviderLimiter:
+    """Per-provider semaphores bounding concurrent upstream calls."""
+
+    def __init__(self, default_limit=PROVIDER_MAX_CONCURRENCY):
+        self.default_limit = default_limit
+        self._semaphores = {}
+        self._stats = {}
+
+    def limit(self, provider):
+        return int(os.getenv(f"{provider.upper()}_MAX_CONCURRENCY", self.default_limit))
+
+    @asynccontextmanager
+    async def slot(self, provider):
+        stats = self._stats.setdefault(provider, {"in_flight": 0, "waiting": 0, "calls": 0})
+        semaphore = self._semaphore(provider)
+        stats["waiting"] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            stats["waiting"] -= 1
+        stats["in_flight"] += 1
+        stats["calls"] += 1
+        try:
+            yield
+        finally:
+            stats["in_flight"] -= 1
+            semaphore.release()
+
+    def stats(self):
+        return {provider: dict(stats) for provider, stats in self._stats.items()}
+
+    def _semaphore(self, provider):
+        loop = asyncio.get_running_loop()
+        entry = self._semaphores.get(provider)
+        # Semaphores are bound to the loop that first waits on them
+        if entry is None or entry[0] is not loop:
+            entry = (loop, asyncio.Semaphore(self.limit(provider)))
+            self._semaphores[provider] = entry
+        return entry[1]
+
+admission_controller = AdmissionController()
+provider_limiter = ProviderLimiter()
+
+register_metrics("admission", admission_controller.stats)
+register_metrics("providers", provider_limiter.stats)
+
+def provider_limit(provider):
+    """Decorator bounding the concurrent calls of an async provider request function."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with provider_limiter.slot(provider):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
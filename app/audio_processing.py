@@ -1,6 +1,57 @@
 import io
 import wave
+import os
 import subprocess
+from functools import lru_cache
+from math import gcd
+import numpy as np
+
+# Encoding of the replies sent to the device
+REPLY_AMPLIFY_FACTOR = 3
+REPLY_SAMPLE_RATE = 24000
+REPLY_BITRATE = '32k'
+# Sample rate of the PCM returned by the TTS provider
+TTS_SAMPLE_RATE = 24000
+
+# Reply codecs
+MP3_CODEC = 'mp3'
+
+# Joining separately synthesized TTS segments: silence below the threshold is trimmed
+# down to the margin, edges fade in/out and segments are separated by a fixed pause
+SEGMENT_SILENCE_THRESHOLD = 300
+SEGMENT_SILENCE_MARGIN_SECONDS = 0.02
+SEGMENT_FADE_SECONDS = 0.005
+SEGMENT_PAUSE_SECONDS = 0.15
+
+# Format assumed for uploads that do not declare one (the format of the deployed devices)
+DEFAULT_INPUT_SAMPLE_RATE = 15000
+DEFAULT_INPUT_CHANNELS = 1
+DEFAULT_INPUT_BITS_PER_SAMPLE = 16
+# Canonical stream sent to the STT provider
+STT_SAMPLE_RATE = int(os.getenv("STT_SAMPLE_RATE", 16000))
+# Declared upload rates accepted, the upper bound keeps the resampler filters small
+MIN_INPUT_SAMPLE_RATE = 8000
+MAX_INPUT_SAMPLE_RATE = 48000
+# Filter length of the resampler, in taps per input/output sample period
+RESAMPLER_TAPS = 32
+RESAMPLER_KAISER_BETA = 8.6
+RESAMPLER_CHUNK_SIZE = 16384
+
+# Upload codecs the device may declare in `audio_codec`
+PCM_CODEC = 'pcm_s16le'
+MULAW_CODEC = 'mulaw'
+IMA_ADPCM_CODEC = 'ima_adpcm'
+DEFAULT_ADPCM_BLOCK_ALIGN = 256
+
+IMA_STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767
+], dtype=np.int32)
+IMA_INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
 
 def calculate_audio_length(raw_audio_data, sample_rate=16000, num_channels=1, sample_width=2):
     """
@@ -37,11 +88,305 @@ def amplify_pcm_audio(pcm_data, factor=3):
     return bytes(audio)
 
 
-def compress_to_mp3(pcm_data, sample_rate=24000, num_channels=1, bitrate='32k'):
+def compress_to_mp3(pcm_data, sample_rate=24000, num_channels=1, bitrate='32k', output_sample_rate=None):
+    # ffmpeg resamples on the way when the MP3 should use another rate than the input
+    output_args = []
+    if output_sample_rate and output_sample_rate != sample_rate:
+        output_args = ['-ar', str(output_sample_rate)]
     process = subprocess.Popen([
         'ffmpeg', '-y', '-f', 's16le', '-ar', str(sample_rate), '-ac', str(num_channels), 
-        '-i', 'pipe:0', '-b:a', bitrate, '-f', 'mp3', 'pipe:1'
+        '-i', 'pipe:0', *output_args, '-b:a', bitrate, '-f', 'mp3', 'pipe:1'
     ], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
     
     mp3_data, _ = process.communicate(input=pcm_data)
-    return mp3_data
\ No newline at end of file
+    return mp3_data
+
+def decode_mp3_to_pcm(mp3_data, sample_rate=REPLY_SAMPLE_RATE):
+    """Decode an MP3 clip to mono 16-bit PCM at `sample_rate`."""
+    process = subprocess.Popen([
+        'ffmpeg', '-y', '-f', 'mp3', '-i', 'pipe:0',
+        '-f', 's16le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1'
+    ], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    pcm_data, _ = process.communicate(input=mp3_data)
+    return pcm_data
+
+def encode_reply_audio(tts_pcm_data, amplify=True, codec=MP3_CODEC, sample_rate=REPLY_SAMPLE_RATE,
+                       bitrate=REPLY_BITRATE, source_rate=TTS_SAMPLE_RATE):
+    """Amplify the TTS PCM and encode it as the reply played by the device (MP3 unless asked otherwise)."""
+    if amplify:
+        tts_pcm_data = amplify_pcm_audio(tts_pcm_data, factor=REPLY_AMPLIFY_FACTOR)
+    return encode_pcm_audio(tts_pcm_data, codec=codec, sample_rate=sample_rate, bitrate=bitrate, source_rate=source_rate)
+
+def encode_pcm_audio(pcm_data, codec=MP3_CODEC, sample_rate=REPLY_SAMPLE_RATE, bitrate=REPLY_BITRATE,
+                     source_rate=TTS_SAMPLE_RATE):
+    """Encode mono 16-bit PCM at `source_rate` with the given reply codec and sample rate."""
+    if codec == MP3_CODEC:
+        return compress_to_mp3(pcm_data, sample_rate=source_rate, bitrate=bitrate, output_sample_rate=sample_rate)
+    if codec == IMA_ADPCM_CODEC:
+        return encode_ima_adpcm(resample_pcm(pcm_data, source_rate, sample_rate))
+    if codec == PCM_CODEC:
+        return resample_pcm(pcm_data, source_rate, sample_rate)
+    raise ValueError(f"Unsupported reply codec: {codec}")
+
+def _build_mulaw_table():
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(codes & 0x80, -magnitude, magnitude).astype('<i2')
+
+# G.711 mu-law code to 16-bit sample, decoding is a single table lookup
+MULAW_DECODE_TABLE = _build_mulaw_table()
+
+def decode_mulaw(mulaw_data):
+    """Decode 8-bit G.711 mu-law to 16-bit little endian PCM."""
+    codes = np.frombuffer(mulaw_data, dtype=np.uint8)
+    return MULAW_DECODE_TABLE[codes].tobytes()
+
+def _decode_ima_adpcm_blocks(blocks):
+    """Decode equally sized mono IMA ADPCM blocks (2D uint8 array), all blocks in lockstep."""
+    predictor = blocks[:, 0].astype(np.int32) | (blocks[:, 1].astype(np.int32) << 8)
+    predictor = np.where(predictor >= 0x8000, predictor - 0x10000, predictor)
+    index = np.clip(blocks[:, 2].astype(np.int32), 0, 88)
+
+    data = blocks[:, 4:]
+    # Low nibble holds the earlier sample
+    nibbles = np.empty((blocks.shape[0], data.shape[1] * 2), dtype=np.int32)
+    nibbles[:, 0::2] = data & 0x0F
+    nibbles[:, 1::2] = data >> 4
+
+    samples = np.empty((blocks.shape[0], nibbles.shape[1] + 1), dtype=np.int16)
+    samples[:, 0] = predictor
+    # The predictor is sequential within a block, so iterate over positions and vectorize across blocks
+    for position in range(nibbles.shape[1]):
+        nibble = nibbles[:, position]
+        step = IMA_STEP_TABLE[index]
+        diff = step >> 3
+        diff += np.where(nibble & 1, step >> 2, 0)
+        diff += np.where(nibble & 2, step >> 1, 0)
+        diff += np.where(nibble & 4, step, 0)
+        predictor = np.clip(np.where(nibble & 8, predictor - diff, predictor + diff), -32768, 32767)
+        index = np.clip(index + IMA_INDEX_TABLE[nibble], 0, 88)
+        samples[:, position + 1] = predictor
+    return samples
+
+def decode_ima_adpcm(adpcm_data, block_align=DEFAULT_ADPCM_BLOCK_ALIGN):
+    """
+    Decode mono IMA ADPCM (Microsoft WAV block layout) to 16-bit little endian PCM.
+
+    Each block starts with a 4 byte header (int16 predictor, uint8 step index, reserved byte)
+    followed by 4-bit codes, low nibble first. A block of `block_align` bytes holds
+    1 + 2 * (block_align - 4) samples. The last block may be shorter.
+
+    :raises ValueError: When a block could not hold a header and a code byte
+    """
+    if block_align <= 4:
+        raise ValueError(f"Invalid ADPCM block align: {block_align}")
+    data = np.frombuffer(adpcm_data, dtype=np.uint8)
+    full_blocks = len(data) // block_align
+    pcm_parts = []
+    if full_blocks:
+        blocks = data[:full_blocks * block_align].reshape(full_blocks, block_align)
+        pcm_parts.append(_decode_ima_adpcm_blocks(blocks).reshape(-1))
+
+    tail = data[full_blocks * block_align:]
+    if len(tail) >= 4:
+        pcm_parts.append(_decode_ima_adpcm_blocks(tail.reshape(1, -1)).reshape(-1))
+
+    if not pcm_parts:
+        return b""
+    return np.concatenate(pcm_parts).astype('<i2').tobytes()
+
+def decode_upload_audio(audio_data, codec=PCM_CODEC, block_align=DEFAULT_ADPCM_BLOCK_ALIGN):
+    """
+    Decode the uploaded audio to 16-bit little endian PCM according to the declared codec.
+
+    :raises ValueError: When the codec is not supported or its parameters are invalid
+    """
+    if codec == PCM_CODEC:
+        return audio_data
+    if codec == MULAW_CODEC:
+        return decode_mulaw(audio_data)
+    if codec == IMA_ADPCM_CODEC:
+        return decode_ima_adpcm(audio_data, block_align=block_align)
+    raise ValueError(f"Unsupported audio codec: {codec}")
+
+def to_mono_pcm16(pcm_data, num_channels=1, bits_per_sample=16):
+    """Convert interleaved PCM of any common bit depth and channel count to mono 16-bit little endian PCM."""
+    if num_channels == 1 and bits_per_sample == 16:
+        return pcm_data
+
+    if bits_per_sample == 8:
+        samples = (np.frombuffer(pcm_data, dtype=np.uint8).astype(np.int32) - 128) << 8
+    elif bits_per_sample == 16:
+        samples = np.frombuffer(pcm_data, dtype='<i2').astype(np.int32)
+    elif bits_per_sample == 24:
+        raw = np.frombuffer(pcm_data[:len(pcm_data) // 3 * 3], dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = (raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16))
+        samples = np.where(samples >= 0x800000, samples - 0x1000000, samples) >> 8
+    elif bits_per_sample == 32:
+        samples = np.frombuffer(pcm_data, dtype='<i4') >> 16
+    else:
+        raise ValueError(f"Unsupported bits per sample: {bits_per_sample}")
+
+    if num_channels > 1:
+        samples = samples[:len(samples) // num_channels * num_channels].reshape(-1, num_channels).mean(axis=1)
+    return np.rint(samples).astype('<i2').tobytes()
+
+@lru_cache(maxsize=32)
+def _resampler_filter(up, down, taps=RESAMPLER_TAPS, beta=RESAMPLER_KAISER_BETA):
+    """Kaiser windowed-sinc low-pass at the lower of both Nyquist rates, laid out per polyphase branch."""
+    ratio = max(up, down)
+    num_taps_per_phase = -(-taps * ratio // up)
+    length = num_taps_per_phase * up
+    cutoff = 0.5 / ratio
+    # Centre on a whole upsampled sample, so the output is not shifted by half a sample
+    delay = (length - 1) // 2
+    n = np.arange(length) - delay
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta)
+    h *= up / h.sum()
+    # polyphase[phase, k] = h[phase + k * up]
+    return h.reshape(num_taps_per_phase, up).T.astype(np.float32), delay
+
+def resample_pcm(pcm_data, source_rate, target_rate):
+    """
+    Resample mono 16-bit PCM with a polyphase windowed-sinc filter.
+
+    Output sample m only touches the filter branch of its phase, so each output costs
+    `taps` multiply-adds instead of the `up` times larger zero-stuffed convolution.
+    The work is vectorized over chunks of output samples.
+    """
+    if source_rate == target_rate or not pcm_data:
+        return pcm_data
+
+    divisor = gcd(source_rate, target_rate)
+    up, down = target_rate // divisor, source_rate // divisor
+    polyphase, delay = _resampler_filter(up, down)
+    num_taps = polyphase.shape[1]
+
+    x = np.frombuffer(pcm_data, dtype='<i2').astype(np.float32)
+    padded = np.concatenate([np.zeros(num_taps, np.float32), x, np.zeros(num_taps + 1, np.float32)])
+    num_out = len(x) * up // down
+    k = np.arange(num_taps)
+
+    out = np.empty(num_out, dtype=np.float32)
+    for start in range(0, num_out, RESAMPLER_CHUNK_SIZE):
+        m = np.arange(start, min(start + RESAMPLER_CHUNK_SIZE, num_out))
+        position = m * down + delay
+        phase = position % up
+        base = position // up + num_taps
+        window = padded[base[:, None] - k[None, :]]
+        out[start:start + len(m)] = np.einsum('ij,ij->i', window, polyphase[phase])
+    return np.clip(np.rint(out), -32768, 32767).astype('<i2').tobytes()
+
+def stt_sample_rate(sample_rate, target_rate=STT_SAMPLE_RATE):
+    """Rate the upload is sent to STT at: higher rates are downsampled, upsampling would only grow the payload."""
+    return min(sample_rate, target_rate)
+
+def normalize_input_audio(pcm_data, sample_rate=DEFAULT_INPUT_SAMPLE_RATE, num_channels=DEFAULT_INPUT_CHANNELS,
+                          bits_per_sample=DEFAULT_INPUT_BITS_PER_SAMPLE, target_rate=STT_SAMPLE_RATE):
+    """
+    Convert the uploaded PCM to mono 16-bit at stt_sample_rate(sample_rate).
+
+    :raises ValueError: When the declared format is invalid or not supported
+    """
+    if not MIN_INPUT_SAMPLE_RATE <= sample_rate <= MAX_INPUT_SAMPLE_RATE:
+        raise ValueError(f"Unsupported sample rate: {sample_rate}")
+    if num_channels < 1:
+        raise ValueError(f"Invalid channel count: {num_channels}")
+    pcm_data = to_mono_pcm16(pcm_data, num_channels=num_channels, bits_per_sample=bits_per_sample)
+    return resample_pcm(pcm_data, sample_rate, stt_sample_rate(sample_rate, target_rate))
+
+def trim_silence(samples, sample_rate=TTS_SAMPLE_RATE, threshold=SEGMENT_SILENCE_THRESHOLD,
+                 margin_seconds=SEGMENT_SILENCE_MARGIN_SECONDS):
+    """Cut leading and trailing samples quieter than `threshold`, keeping a short margin."""
+    loud = np.flatnonzero(np.abs(samples.astype(np.int32)) >= threshold)
+    if len(loud) == 0:
+        return samples[:0]
+    margin = int(margin_seconds * sample_rate)
+    return samples[max(0, loud[0] - margin):loud[-1] + 1 + margin]
+
+def join_pcm_segments(segments, sample_rate=TTS_SAMPLE_RATE, pause_seconds=SEGMENT_PAUSE_SECONDS,
+                      fade_seconds=SEGMENT_FADE_SECONDS):
+    """
+    Join mono 16-bit PCM segments synthesized one sentence at a time.
+
+    Each segment is trimmed to its speech, faded in and out over a few milliseconds so
+    the cut does not click, and the segments are separated by the same short pause
+    whatever silence the TTS provider put around them.
+    """
+    if len(segments) == 1:
+        return segments[0]
+
+    pause = np.zeros(int(pause_seconds * sample_rate), dtype=np.float64)
+    parts = []
+    for segment in segments:
+        samples = shape_pcm_segment(segment, sample_rate, fade_seconds)
+        if len(samples) == 0:
+            continue
+        if parts:
+            parts.append(pause)
+        parts.append(samples)
+
+    if not parts:
+        return b""
+    return np.rint(np.concatenate(parts)).astype('<i2').tobytes()
+
+def shape_pcm_segment(segment, sample_rate=TTS_SAMPLE_RATE, fade_seconds=SEGMENT_FADE_SECONDS):
+    """One segment of join_pcm_segments: trimmed to its speech and faded at both ends, as float samples."""
+    samples = trim_silence(np.frombuffer(segment[:len(segment) // 2 * 2], dtype='<i2'), sample_rate)
+    samples = samples.astype(np.float64)
+    fade_length = int(fade_seconds * sample_rate)
+    edge = min(fade_length, len(samples) // 2)
+    fade_in = np.linspace(0.0, 1.0, fade_length, endpoint=False)[:edge]
+    samples[:edge] *= fade_in
+    samples[len(samples) - edge:] *= fade_in[::-1]
+    return samples
+
+def encode_ima_adpcm(pcm_data, block_align=DEFAULT_ADPCM_BLOCK_ALIGN):
+    """
+    Encode mono 16-bit PCM as IMA ADPCM in the block layout read by decode_ima_adpcm.
+
+    Every block carries its own predictor and step index, so all blocks are encoded in
+    lockstep. The starting step index of a block is estimated from its first samples
+    instead of being carried over from the previous block. The last block is padded with silence.
+    """
+    samples_per_block = 1 + 2 * (block_align - 4)
+    samples = np.frombuffer(pcm_data, dtype='<i2').astype(np.int32)
+    if len(samples) == 0:
+        return b""
+    num_blocks = -(-len(samples) // samples_per_block)
+    padded = np.zeros(num_blocks * samples_per_block, dtype=np.int32)
+    padded[:len(samples)] = samples
+    blocks = padded.reshape(num_blocks, samples_per_block)
+
+    predictor = blocks[:, 0].copy()
+    average_delta = np.abs(np.diff(blocks[:, :9], axis=1)).mean(axis=1)
+    index = np.clip(np.searchsorted(IMA_STEP_TABLE, average_delta), 0, 88).astype(np.int32)
+    initial_index = index.copy()
+
+    nibbles = np.empty((num_blocks, samples_per_block - 1), dtype=np.int32)
+    for position in range(1, samples_per_block):
+        step = IMA_STEP_TABLE[index]
+        diff = blocks[:, position] - predictor
+        nibble = np.where(diff < 0, 8, 0)
+        diff = np.abs(diff)
+        vpdiff = step >> 3
+        for mask in (4, 2, 1):
+            hit = diff >= step
+            nibble |= np.where(hit, mask, 0)
+            diff -= np.where(hit, step, 0)
+            vpdiff += np.where(hit, step, 0)
+            step = step >> 1
+        predictor = np.clip(np.where(nibble & 8, predictor - vpdiff, predictor + vpdiff), -32768, 32767)
+        index = np.clip(index + IMA_INDEX_TABLE[nibble], 0, 88)
+        nibbles[:, position - 1] = nibble
+
+    encoded = np.empty((num_blocks, block_align), dtype=np.uint8)
+    header_predictor = blocks[:, 0].astype('<i2').view(np.uint8).reshape(num_blocks, 2)
+    encoded[:, 0:2] = header_predictor
+    encoded[:, 2] = initial_index
+    encoded[:, 3] = 0
+    encoded[:, 4:] = nibbles[:, 0::2] | (nibbles[:, 1::2] << 4)
+    return encoded.tobytes()
@@ -0,0 +1,34 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Strong references to scheduled tasks, otherwise the event loop may garbage collect them mid-flight
+_background_tasks = set()
+
+def run_in_background(coro):
+    """Schedule a coroutine on the running loop without waiting for it."""
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_task_done)
+    return task
+
+def _on_task_done(task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task failed: %s", task.exception(), exc_info=task.exception())
+
+async def drain_background_tasks(timeout=None):
+    """
+    Wait for the background tasks scheduled on the current loop.
+
+    Lambda freezes the process as soon as the handler returns, so the handler drains
+    before returning. The long-running FastAPI server drains on shutdown.
+    """
+    loop = asyncio.get_running_loop()
+    pending = [task for task in _background_tasks if task.get_loop() is loop]
+    if not pending:
+        return
+    _, not_done = await asyncio.wait(pending, timeout=timeout)
+    for task in not_done:
+        task.cancel()
@@ -0,0 +1,175 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from collections import deque
+import aiohttp
+from .metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# A provider's circuit opens when this share of its calls in the window failed...
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", 0.5))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", 30))
+# ...and the window holds at least this many calls
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", 5))
+# A call taking longer than this counts as failed, whatever its outcome (LLM calls get the longer limit)
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", 6))
+CIRCUIT_LLM_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_LLM_SLOW_CALL_SECONDS", 10))
+# How long an open circuit fails calls before letting a probe through
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 15))
+# Concurrent probe calls while half-open
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", 1))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a provider whose circuit is open."""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} circuit is open")
+        self.provider = provider
+        self.retry_after = retry_after
+
+def is_provider_failure(error):
+    """Whether an exception says the provider is unhealthy, rather than that the request was bad."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return True
+
+class CircuitBreaker:
+    """
+    Stop calling a failing provider for a while, instead of waiting for each call to time out.
+
+    Closed: calls go through, outcomes are kept for the window. Open: calls fail at once with
+    CircuitOpen. After `open_seconds` it is half-open: a few probe calls go through, a
+    successful probe closes the circuit, a failed one opens it again.
+    """
+
+    def __init__(self, name, failure_rate=CIRCUIT_FAILURE_RATE, window_seconds=CIRCUIT_WINDOW_SECONDS,
+                 min_calls=CIRCUIT_MIN_CALLS, slow_call_seconds=CIRCUIT_SLOW_CALL_SECONDS,
+                 open_seconds=CIRCUIT_OPEN_SECONDS, half_open_probes=CIRCUIT_HALF_OPEN_PROBES, clock=time.monotonic):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = None
+        self.rejected = 0
+        self.opened = 0
+        self._probes = 0
+        # (finished at, failed) of the calls in the window
+        self._outcomes = deque()
+
+    def before_call(self):
+        """
+        Take permission for one call.
+
+        :raises CircuitOpen: When the call must not be made
+        :return: Whether the call is a half-open probe
+        """
+        if self.state == OPEN:
+            retry_after = self.opened_at + self.open_seconds - self.clock()
+            if retry_after > 0:
+                self.rejected += 1
+                raise CircuitOpen(self.name, retry_after)
+            self.state = HALF_OPEN
+            logger.info("Circuit of %s is half-open", self.name)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self.rejected += 1
+                raise CircuitOpen(self.name, self.open_seconds)
+            self._probes += 1
+            return True
+        return False
+
+    def raise_if_open(self):
+        """Fail like a call would while the circuit is open, without taking a probe."""
+        if self.state == OPEN and self.opened_at + self.open_seconds > self.clock():
+            raise CircuitOpen(self.name, self.opened_at + self.open_seconds - self.clock())
+
+    def after_call(self, probe, failed):
+        """
+        Record the outcome of a call made with permission from before_call.
+
+        :param failed: True, False, or None when the call tells nothing about the provider
+        """
+        now = self.clock()
+        if probe:
+            self._probes -= 1
+            if failed is None:
+                return
+            if failed:
+                self._open(now)
+            elif self.state == HALF_OPEN:
+                self.state = CLOSED
+                self._outcomes.clear()
+                logger.warning("Circuit of %s closed", self.name)
+            return
+        if failed is None:
+            return
+
+        self._outcomes.append((now, failed))
+        while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+            self._outcomes.popleft()
+        if self.state == CLOSED and failed and len(self._outcomes) >= self.min_calls:
+            failures = sum(1 for _, call_failed in self._outcomes if call_failed)
+            if failures / len(self._outcomes) >= self.failure_rate:
+                self._open(now)
+
+    async def call(self, func, *args, **kwargs):
+        probe = self.before_call()
+        start = self.clock()
+        failed = True
+        try:
+            result = await func(*args, **kwargs)
+            failed = self.clock() - start > self.slow_call_seconds
+            return result
+        except asyncio.CancelledError:
+            # Cancelled by the stage deadline counts when it was slow, a call abandoned early says nothing
+            failed = True if self.clock() - start > self.slow_call_seconds else None
+            raise
+        except Exception as e:
+            failed = is_provider_failure(e)
+            raise
+        finally:
+            self.after_call(probe, failed)
+
+    def stats(self):
+        failures = sum(1 for _, failed in self._outcomes if failed)
+        return {
+            "state": self.state,
+            "calls_in_window": len(self._outcomes),
+            "failures_in_window": failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.opened += 1
+        self._outcomes.clear()
+        logger.warning("Circuit of %s opened for %.1f seconds", self.name, self.open_seconds)
+
+circuit_breakers = {}
+
+register_metrics("circuit_breakers", lambda: {name: breaker.stats() for name, breaker in circuit_breakers.items()})
+
+def circuit_breaker(provider, slow_call_seconds=CIRCUIT_SLOW_CALL_SECONDS):
+    """Decorator failing the calls of an async provider request function fast while its circuit is open."""
+    breaker = circuit_breakers.setdefault(provider, CircuitBreaker(provider, slow_call_seconds=slow_call_seconds))
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await breaker.call(func, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,164 @@
+from collections.abc import Sequence
+
+MESSAGE_FIELDS = ("role", "content", "timestamp")
+
+def timestamp_to_number(timestamp):
+    try:
+        return float(timestamp)
+    except (ValueError, TypeError):
+        # Keep non numeric legacy timestamps (e.g. ISO dates) as they are
+        return timestamp
+
+def timestamp_to_string(timestamp):
+    # The rest of the code base compares str(time.time()) style timestamps
+    if timestamp is None or isinstance(timestamp, str):
+        return timestamp
+    return str(timestamp)
+
+class Message:
+    """
+    One conversation message with a numeric timestamp.
+
+    Reads like the message dicts used before (message["content"], message.get("timestamp")
+    returning the timestamp string), so code and stored data in the old shape keep working.
+    Messages are never modified once created.
+    """
+
+    __slots__ = MESSAGE_FIELDS
+
+    def __init__(self, role, content, timestamp=None):
+        self.role = role
+        self.content = content
+        # UNIX time as a float, or a legacy non numeric string
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_dict(cls, message):
+        return cls(message.get("role"), message.get("content", ""), timestamp_to_number(message.get("timestamp")))
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content, "timestamp": timestamp_to_string(self.timestamp)}
+
+    def __getitem__(self, key):
+        if key == "timestamp":
+            return timestamp_to_string(self.timestamp)
+        if key in MESSAGE_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return self[key] if key in MESSAGE_FIELDS else default
+
+    def keys(self):
+        return MESSAGE_FIELDS
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __eq__(self, other):
+        if isinstance(other, Message):
+            return (self.role, self.content, self.timestamp) == (other.role, other.content, other.timestamp)
+        if isinstance(other, dict):
+            # Stored dicts may spell the same time differently ("1" and "1.0")
+            return (self.role, self.content, self.timestamp) == (
+                other.get("role"), other.get("content"), timestamp_to_number(other.get("timestamp"))
+            )
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content!r}, {self.timestamp!r})"
+
+class Conversation(Sequence):
+    """
+    Append-only message history.
+
+    A Conversation is an immutable view (start, stop) on a backing list shared with the
+    views derived from it. Slices and tails are views, so they cost O(1). `appended`
+    extends the backing list in place when the view ends where the list ends, so a turn
+    adds its messages without copying the history. Only when another view already
+    appended something else is the history copied (a fork).
+    """
+
+    __slots__ = ("_items", "_start", "_stop")
+
+    def __init__(self, messages=()):
+        self._items = [message if isinstance(message, Message) else Message.from_dict(message) for message in messages]
+        self._start = 0
+        self._stop = len(self._items)
+
+    @classmethod
+    def from_messages(cls, messages):
+        """The messages as a Conversation, converting dicts only when needed."""
+        if isinstance(messages, Conversation):
+            return messages
+        return cls(messages)
+
+    @classmethod
+    def _view(cls, items, start, stop):
+        view = cls.__new__(cls)
+        view._items = items
+        view._start = start
+        view._stop = stop
+        return view
+
+    def appended(self, message):
+        """A conversation with `message` added at the end, this one is left unchanged."""
+        if self._stop == len(self._items):
+            self._items.append(message)
+        elif self._items[self._stop] is not message:
+            # Another view already appended past our end, fork the history
+            items = self._items[self._start:self._stop]
+            items.append(message)
+            return Conversation._view(items, 0, len(items))
+        return Conversation._view(self._items, self._start, self._stop + 1)
+
+    def tail(self, count):
+        """The last `count` messages, as a view."""
+        return Conversation._view(self._items, max(self._start, self._stop - count), self._stop)
+
+    def to_dicts(self):
+        return [message.to_dict() for message in self]
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self._items[self._start + i] for i in range(start, stop, step)]
+            return Conversation._view(self._items, self._start + start, self._start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("conversation index out of range")
+        return self._items[self._start + index]
+
+    def __iter__(self):
+        items = self._items
+        for index in range(self._start, self._stop):
+            yield items[index]
+
+    def __reversed__(self):
+        items = self._items
+        for index in range(self._stop - 1, self._start - 1, -1):
+            yield items[index]
+
+    def __add__(self, messages):
+        # Concatenation copies, like for lists; appended() is the cheap way to grow a history
+        return Conversation([*self, *messages])
+
+    def __radd__(self, messages):
+        return Conversation([*messages, *self])
+
+    def __eq__(self, other):
+        if isinstance(other, (Conversation, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Conversation({list(self)!r})"
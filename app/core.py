@@ -1,31 +1,94 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 import time  # Add time module for logging timestamps
 from datetime import datetime, timedelta, timezone
 import base64
 import json
+import logging
+import math
 import aiohttp
 import aiofiles
 import os
-from .db import get_user_session, update_user_session, get_user_system_prompt, update_user_system_prompt
-from .audio_processing import calculate_audio_length, add_wav_header, amplify_pcm_audio, compress_to_mp3
+from .conversation import Conversation, Message, timestamp_to_number
+from .db import get_user_session, update_user_session, get_user_system_prompt, update_user_system_prompt, get_user_summary
+from .audio_processing import (
+    calculate_audio_length, add_wav_header, decode_upload_audio, normalize_input_audio,
+    PCM_CODEC, DEFAULT_ADPCM_BLOCK_ALIGN, DEFAULT_INPUT_SAMPLE_RATE, DEFAULT_INPUT_CHANNELS,
+    DEFAULT_INPUT_BITS_PER_SAMPLE, STT_SAMPLE_RATE, MP3_CODEC, stt_sample_rate
+)
 from .stt_requests import send_azure_stt_request
 from .llm_requests import send_gpt_request, send_float16_request
 from .tts_requests import send_azure_tts_request
+from .tts_fanout import synthesize_reply, synthesize_segments
+from .streaming import StreamedAudio, encode_mp3_stream
 from .prompts import DEFAULT_SYSTEM_PROMPT
 from .utils import format_text_response
+from .summary import needs_compaction, compact_user_session, request_compaction, summary_message, SUMMARY_FUNCTION_NAME
+from .background import run_in_background
+from .idempotency import request_key, idempotency_cache, DEGRADED_HEADER
+from .admission import admission_controller, Overloaded
+from .circuit_breaker import circuit_breakers, CircuitOpen
+from .deadline import Deadline, StageTimeout, run_stage, AMPLIFY_MIN_REMAINING_SECONDS
+from .sound_bank import get_prerendered_audio
+from .reply_cache import reply_cache, reply_cache_key, reply_cache_mode
+from .session_writer import session_writer, SESSION_WRITE_MODE
+from .response_format import parse_response_format, transcode_canned_audio, DEFAULT_RESPONSE_FORMAT
+from .logger import log_request, log_conversation, current_request_id
+from .profiling import PROFILING_ENABLED, wants_profile, profile_request
+from .shadow import mirror
+from .pipeline import Pipeline, Stage, PipelineExit, THREAD
+from .metrics import register_metrics
+from .telemetry import latency_telemetry, timing_headers
+
+logger = logging.getLogger(__name__)
 
 def log_time(message, start_time):
     """Helper function to log elapsed time with a message."""
     elapsed_time = time.time() - start_time
-    print(f"{message}: {elapsed_time:.3f} seconds")
+    logger.info("%s: %.3f seconds", message, elapsed_time, extra={"stage": message, "seconds": round(elapsed_time, 3)})
+
+# Canned reply of the bear when it did not catch what was said
+SAY_AGAIN_REPLY = "อะไรนะ บั้ดดี้ขออีกที"
+# Uploads shorter than this are not transcribed, the bear answers them without knowing what was said
+SHORT_AUDIO_SECONDS = 0.4
 
 @dataclass
 class Response:
     status_code: int
     body: str
-
-async def process_audio_logic(event) -> Response:
+    headers: dict = field(default_factory=dict)
+
+async def process_audio_logic(event, deadline=None, response_format=None, stream=False) -> Response:
+    """
+    Run the whole turn for an upload event.
+
+    :param response_format: Reply format pinned by the caller (e.g. a stream that already started
+        in that format), otherwise negotiated from the Accept header and the user's config
+    :param stream: Return MP3 replies as a StreamedAudio body, written while TTS and the encoder
+        still run (the streaming endpoint), instead of bytes
+    """
+    # Every record of the turn carries the request id, and is sampled with the request
+    with log_request(extract_request_id(event)):
+        start = time.perf_counter()
+        if PROFILING_ENABLED and wants_profile(extract_headers(event)):
+            with profile_request(f"{int(time.time())}-{current_request_id()}"):
+                response = await process_event(event, deadline, response_format, stream)
+        else:
+            response = await process_event(event, deadline, response_format, stream)
+        return with_timing_headers(response, time.perf_counter() - start)
+
+def with_timing_headers(response, server_seconds) -> Response:
+    """The reply with the request id and the server time, the device reports its own timings of the turn against them."""
+    if response.status_code != 200:
+        return response
+    request_id = current_request_id()
+    latency_telemetry.record_turn(request_id, server_seconds)
+    # Replayed replies are shared between retries, each gets its own headers
+    return replace(response, headers={**response.headers, **timing_headers(request_id, server_seconds)})
+
+async def process_event(event, deadline=None, response_format=None, stream=False) -> Response:
     start_time = time.time()
+    if deadline is None:
+        deadline = Deadline()
 
     try:
         # Log extraction time
@@ -41,66 +104,41 @@ async def process_audio_logic(event) -> Response:
 
         audio_decode_start = time.time()
         raw_audio_data = base64.b64decode(body['audio_data'])
-        log_time("Audio decode", audio_decode_start)
-
-        user_id = body.get('user_id', 'default_user')
-
-        # Log session retrieval
-        session_retrieval_start = time.time()
-        full_messages = get_user_session(user_id)
-        log_time("User session retrieval", session_retrieval_start)
-
-        # Log system prompt retrieval
-        prompt_retrieval_start = time.time()
-        system_prompt_data = get_user_system_prompt(user_id)
-        system_prompt = system_prompt_data.get("SystemPrompt") or DEFAULT_SYSTEM_PROMPT
-        active_message_limit = system_prompt_data.get("ActiveMessageLimit") or 10
-        daily_rate_limit = system_prompt_data.get("DailyRateLimit") or 100
-        whitelist = system_prompt_data.get("Whitelist") or False
-        if (not whitelist):
-            update_user_system_prompt(
-                user_id,
-                system_prompt,
-                active_message_limit,
-                daily_rate_limit,
-                whitelist
+        try:
+            # Devices on weak links may upload mu-law or IMA ADPCM instead of raw PCM
+            raw_audio_data = decode_upload_audio(
+                raw_audio_data,
+                codec=body.get('audio_codec', PCM_CODEC),
+                block_align=int(body.get('adpcm_block_align', DEFAULT_ADPCM_BLOCK_ALIGN))
             )
-            return Response(
-                status_code=400,
-                body='Not whitelisted.'
+            # From here on the audio is mono 16-bit PCM at sample_rate, at most STT_SAMPLE_RATE
+            input_sample_rate = int(body.get('sample_rate', DEFAULT_INPUT_SAMPLE_RATE))
+            sample_rate = stt_sample_rate(input_sample_rate)
+            raw_audio_data = normalize_input_audio(
+                raw_audio_data,
+                sample_rate=input_sample_rate,
+                num_channels=int(body.get('channels', DEFAULT_INPUT_CHANNELS)),
+                bits_per_sample=int(body.get('bits_per_sample', DEFAULT_INPUT_BITS_PER_SAMPLE))
             )
-        log_time("System prompt retrieval", prompt_retrieval_start)
-
-        if(is_rate_limit_reached(full_messages, daily_rate_limit)):
+        except ValueError as e:
             return Response(
-                status_code=429,
-                body='Rate limit reached.'
+                status_code=400,
+                body=str(e)
             )
+        log_time("Audio decode", audio_decode_start)
 
-        # Log audio length calculation
-        audio_length_start = time.time()
-        audio_length_seconds = calculate_audio_length(raw_audio_data, sample_rate=15000)
-        log_time("Audio length calculation", audio_length_start)
-
-        # Handle short or normal audio
-        if audio_length_seconds < 0.4:
-            handling_audio_start = time.time()
-            full_updated_messages, audio_content = await handle_short_audio(user_id, full_messages, active_message_limit, system_prompt)
-            log_time("Short audio handling", handling_audio_start)
-        else:
-            handling_audio_start = time.time()
-            full_updated_messages, audio_content = await handle_audio(user_id, raw_audio_data, full_messages, active_message_limit, system_prompt)
-            log_time("Normal audio handling", handling_audio_start)
-
-        # Log session update
-        session_update_start = time.time()
-        update_user_session(user_id, full_updated_messages)
-        log_time("User session update", session_update_start)
-        log_time("Total process_audio_logic time", start_time)
-        
-        return Response(
-            status_code=200,
-            body=audio_content
+        user_id = body.get('user_id', 'default_user')
+        # Reply codec asked for by the device, the per-user config applies when absent
+        requested_format = response_format or parse_response_format(extract_headers(event).get('accept'))
+
+        # Device retries of the same recording are answered from a single pipeline run
+        key = request_key(body, user_id, raw_audio_data)
+        if requested_format is not None:
+            key = f"{key}:{requested_format.codec}:{requested_format.sample_rate}:{requested_format.bitrate}"
+        if stream:
+            key = f"{key}:stream"
+        return await idempotency_cache.run(
+            key, lambda: admit_user_turn(user_id, raw_audio_data, start_time, deadline, requested_format, stream, sample_rate)
         )
     except aiohttp.ClientResponseError as e:
         return Response(
@@ -113,6 +151,136 @@ async def process_audio_logic(event) -> Response:
             body=f"Error: {str(e)}"
         )
 
+async def admit_user_turn(user_id, raw_audio_data, start_time, deadline=None, requested_format=None, stream=False,
+                          sample_rate=STT_SAMPLE_RATE) -> Response:
+    """Run the turn once admitted, or answer with the busy clip when the server is overloaded."""
+    max_wait = admission_controller.max_queue_wait
+    if deadline is not None:
+        max_wait = min(max_wait, deadline.stage_timeout("queue"))
+
+    try:
+        async with admission_controller.admit(len(raw_audio_data), max_wait=max_wait):
+            return await process_user_turn(user_id, raw_audio_data, start_time, deadline, requested_format, stream,
+                                           sample_rate)
+    except Overloaded as e:
+        logger.warning("Shedding request for %s: %s", user_id, e)
+        return await busy_response(requested_format or DEFAULT_RESPONSE_FORMAT)
+    except CircuitOpen as e:
+        # Fails in milliseconds while the provider is down, instead of after its timeouts
+        logger.warning("Serving the busy clip to %s: %s", user_id, e)
+        return await busy_response(requested_format or DEFAULT_RESPONSE_FORMAT, f"{e.provider}_unavailable",
+                                   retry_after=e.retry_after)
+
+async def busy_response(response_format=DEFAULT_RESPONSE_FORMAT, reason='busy', retry_after=5) -> Response:
+    """The device only plays 200 responses, so overload and provider outages are signalled with a playable clip."""
+    return Response(
+        status_code=200,
+        body=await serve_canned_audio("busy.mp3", response_format),
+        headers={
+            'Content-Type': response_format.content_type, DEGRADED_HEADER: reason, 'Retry-After': str(math.ceil(retry_after))
+        }
+    )
+
+async def process_user_turn(user_id, raw_audio_data, start_time, deadline=None, requested_format=None, stream=False,
+                            sample_rate=STT_SAMPLE_RATE) -> Response:
+    """Run one conversation turn for the user through TURN_PIPELINE, then store it."""
+    try:
+        turn = await TURN_PIPELINE.run(
+            user_id=user_id, raw_audio_data=raw_audio_data, sample_rate=sample_rate, requested_format=requested_format,
+            deadline=deadline, stream=stream
+        )
+    except PipelineExit as e:
+        return e.result
+
+    # Log session update
+    session_update_start = time.time()
+    save_user_session(user_id, turn["updated_messages"])
+    log_time("User session update", session_update_start)
+
+    # Summarize the turns that left the active window off the request path
+    active_message_limit, summary_data = turn["active_message_limit"], turn["summary_data"]
+    if needs_compaction(turn["updated_messages"], active_message_limit, summary_data.get("SummaryUntil")):
+        if SUMMARY_FUNCTION_NAME:
+            # The handler would wait for the summary before replying, another invocation writes it
+            run_in_background(request_compaction(user_id))
+        else:
+            run_in_background(compact_user_session(user_id, turn["updated_messages"], active_message_limit, summary_data))
+
+    log_time("Total process_audio_logic time", start_time)
+
+    response_format = turn["response_format"]
+    headers = {'Content-Type': response_format.content_type}
+    if deadline is not None and deadline.fallbacks:
+        headers[DEGRADED_HEADER] = ",".join(deadline.fallbacks)
+
+    return Response(
+        status_code=200,
+        body=turn["speech_audio"] if turn["tts_pcm"] is None else turn["encoded_audio"],
+        headers=headers
+    )
+
+def load_prompt_config(user_id, requested_format):
+    """The user's prompt config with the defaults applied, and the reply format of the turn."""
+    system_prompt_data = get_user_system_prompt(user_id)
+    response_format = (requested_format
+                       or parse_response_format(system_prompt_data.get("ResponseFormat"))
+                       or DEFAULT_RESPONSE_FORMAT)
+    return (
+        system_prompt_data.get("SystemPrompt") or DEFAULT_SYSTEM_PROMPT,
+        system_prompt_data.get("ActiveMessageLimit") or 10,
+        system_prompt_data.get("DailyRateLimit") or 100,
+        system_prompt_data.get("Whitelist") or False,
+        reply_cache_mode(system_prompt_data.get("ReplyCache")),
+        response_format,
+    )
+
+def check_turn(user_id, raw_audio_data, sample_rate, full_messages, system_prompt, active_message_limit, daily_rate_limit,
+               whitelist):
+    """
+    Let the user's turn through.
+
+    :raises PipelineExit: With the error response when the user is not whitelisted or over the daily limit
+    :return: Length of the upload in seconds
+    """
+    if not whitelist:
+        update_user_system_prompt(user_id, system_prompt, active_message_limit, daily_rate_limit, whitelist)
+        raise PipelineExit(Response(status_code=400, body='Not whitelisted.'))
+
+    if is_rate_limit_reached(full_messages, daily_rate_limit):
+        raise PipelineExit(Response(status_code=429, body='Rate limit reached.'))
+
+    return calculate_audio_length(raw_audio_data, sample_rate=sample_rate)
+
+def load_summary(user_id, full_messages, active_message_limit):
+    # The summary only exists once the history has outgrown the active window
+    if active_message_limit != -1 and len(full_messages) > active_message_limit * 2:
+        return get_user_summary(user_id)
+    return {"Summary": None, "SummaryUntil": None}
+
+def load_user_session(user_id):
+    # A turn still queued for write-behind is newer than what the database holds
+    pending_messages = session_writer.pending_session(user_id)
+    if pending_messages is not None:
+        return pending_messages
+    return Conversation.from_messages(get_user_session(user_id))
+
+def save_user_session(user_id, messages):
+    if SESSION_WRITE_MODE == "write_behind":
+        session_writer.submit(user_id, messages, update_user_session)
+    else:
+        update_user_session(user_id, messages)
+
+def extract_headers(event):
+    """Request headers with lower-cased names (API Gateway keeps the client's casing)."""
+    return {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+
+def extract_request_id(event):
+    # Set by the device or a proxy, API Gateway puts its own into the request context
+    request_id = extract_headers(event).get('x-request-id')
+    if request_id:
+        return request_id
+    return (event.get('requestContext') or {}).get('requestId')
+
 def extract_body(event):
     """Extract and validate the body from the event."""
     try:
@@ -124,86 +292,52 @@ def extract_body(event):
         return {}
 
 
-async def handle_short_audio(user_id, full_messages, active_message_limit, system_prompt):
-    """Handle very short audio by generating a GPT response."""
-    handle_short_audio_start = time.time()
-    limited_messages = limit_messages(full_messages, active_message_limit)
-
-    gpt_start = time.time()
-    gpt_response = await generate_gpt_response(system_prompt, append_message(limited_messages, "", "user", verbose=False))
-    log_time("GPT response for short audio", gpt_start)
-
-    full_messages = append_message(full_messages, "", "user")
-    full_messages = append_message(full_messages, gpt_response, "assistant")
-
-    audio_conversion_start = time.time()
-    audio_response = await convert_text_to_audio_and_respond(gpt_response)
-    log_time("Audio conversion for short audio", audio_conversion_start)
-
-    log_time("Total short audio handling", handle_short_audio_start)
-    return full_messages, audio_response
-
-async def handle_audio(user_id, raw_audio_data, full_messages, active_message_limit, system_prompt):
-    """Handle normal-length audio with or without transcription."""
-    handle_audio_start = time.time()
-
-    stt_start = time.time()
-    transcription = await transcribe_audio(raw_audio_data)
-    log_time("STT transcription", stt_start)
-
-    if not transcription:
-        return await handle_no_transcription(user_id, full_messages)
-
-    handle_transcription_start = time.time()
-    full_messages, response = await handle_transcription(user_id, transcription, full_messages, active_message_limit, system_prompt)
-    log_time("Transcription handling", handle_transcription_start)
-
-    log_time("Total audio handling", handle_audio_start)
-    return full_messages, response
-
-
-async def handle_no_transcription(user_id, full_messages):
-    """Handle the case where no transcription is available."""
-    full_messages = append_message(full_messages, "", "user")
-    full_messages = append_message(full_messages, "อะไรนะ บั้ดดี้ขออีกที", "assistant")
-
-    audio_serve_start = time.time()
-    audio_response = await serve_audio_from_file("say_again.mp3")
-    log_time("Audio serve for no transcription", audio_serve_start)
-
-    return full_messages, audio_response
-
-
-async def handle_transcription(user_id, transcription, full_messages, active_message_limit, system_prompt):
-    """Handle valid transcription."""
-    limited_messages = limit_messages(full_messages, active_message_limit)
+async def transcribe_upload(raw_audio_data, sample_rate, audio_seconds, deadline=None):
+    """The transcription of the upload, empty when it is too short or STT ran out of time."""
+    if audio_seconds < SHORT_AUDIO_SECONDS:
+        return ""
+    try:
+        return await transcribe_audio(raw_audio_data, deadline, sample_rate)
+    except StageTimeout:
+        return ""  # Ask the user to say it again rather than waiting any longer
 
-    gpt_start = time.time()
-    gpt_response = await generate_gpt_response(system_prompt, append_message(limited_messages, transcription, "user", verbose=False))
-    log_time("GPT response for transcription", gpt_start)
+def build_prompt(transcription, full_messages, active_message_limit):
+    """The active window of the history with the user's message appended."""
+    return append_message(limit_messages(full_messages, active_message_limit), transcription, "user")
 
-    gpt_response = format_text_response(gpt_response)
+async def generate_reply(transcription, audio_seconds, prompt_messages, system_prompt, summary_data, deadline=None):
+    """The reply of the bear, None when it should ask the user to say it again."""
+    if not transcription and audio_seconds >= SHORT_AUDIO_SECONDS:
+        return None  # Something was said, but nothing was understood
 
-    full_messages = append_message(full_messages, transcription, "user")
-    full_messages = append_message(full_messages, gpt_response, "assistant")
+    try:
+        gpt_response = await generate_gpt_response(system_prompt, prompt_messages, summary_data.get("Summary"), deadline)
+    except StageTimeout:
+        return None
+    # A reply to a very short upload (no transcription) is used as the model wrote it
+    return format_text_response(gpt_response) if transcription else gpt_response
 
-    audio_response = await convert_text_to_audio_and_respond(gpt_response)
-    return full_messages, audio_response
+def record_turn(full_messages, prompt_messages, spoken_reply):
+    """The history with the turn appended, as it was spoken."""
+    # The prompt's user message is already at the end of the shared history, nothing is copied
+    full_messages = full_messages.appended(prompt_messages[-1])
+    return append_message(full_messages, spoken_reply, "assistant")
 
 
 def append_message(messages, content, role, verbose=True, timestamp=None):
-    """Append a message with the specified role and optional timestamp."""
+    """
+    Append a message with the specified role and optional timestamp.
+
+    Returns a new Conversation, `messages` itself is left unchanged. Appending to the
+    newest view of a history does not copy it.
+    """
     if timestamp is None:
         timestamp = time.time()  # Current time in UNIX timestamp
 
     if verbose:
-        print("Role:", role, ":", content)
+        log_conversation(role, content)
 
-    return messages + [{
-        "role": role,
-        "content": content,
-        "timestamp": str(timestamp)
-    }]
+    return Conversation.from_messages(messages).appended(Message(role, content, timestamp_to_number(timestamp)))
 
 def limit_messages(messages, active_message_limit):
     """Limit the number of message pairs for GPT API calls."""
@@ -211,6 +345,7 @@ def limit_messages(messages, active_message_limit):
         return messages
 
     # Calculate the correct slice index
+    # Slicing a Conversation returns a view, the history is not copied
     limit_slice_index = int(-active_message_limit * 2)
     return messages[limit_slice_index:]
 
@@ -241,11 +376,12 @@ def is_rate_limit_reached(full_messages, daily_rate_limit):
         # Iterate through the messages in reverse (newest first)
         for message in reversed(full_messages):
             try:
-                message_timestamp_str = message.get('timestamp')
-                if message_timestamp_str is None:
+                # Messages of a Conversation carry the parsed timestamp, plain dicts the string
+                message_timestamp = message.timestamp if isinstance(message, Message) else message.get('timestamp')
+                if message_timestamp is None:
                     continue  # Skip if timestamp is missing
 
-                message_timestamp = float(message_timestamp_str)
+                message_timestamp = float(message_timestamp)
 
                 if message_timestamp >= start_of_day_timestamp:
                     count_today += 1
@@ -262,31 +398,42 @@ def is_rate_limit_reached(full_messages, daily_rate_limit):
         return count_today >= message_limit
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error("Rate limit check failed: %s", e)
         return False
 
-async def generate_gpt_response(system_prompt, api_messages):
-    """Generate a GPT response based on the system prompt and provided conversation history."""
-    # Include the system prompt and call GPT API
-    api_messages = [{"role": "system", "content": system_prompt}] + api_messages
+async def generate_gpt_response(system_prompt, api_messages, summary=None, deadline=None):
+    """Generate a GPT response based on the system prompt, the rolling summary and the recent conversation history."""
+    # Include the system prompt (and the summary of older turns) and call GPT API
+    prefix = [{"role": "system", "content": system_prompt}]
+    if summary:
+        prefix.append(summary_message(summary))
+    # The API only takes role and content, the timestamps stay in the session
+    api_messages = prefix + [{"role": message["role"], "content": message["content"]} for message in api_messages]
 
     try:
-        gpt_response = await send_gpt_request(api_messages)
+        gpt_start = time.perf_counter()
+        gpt_response = await run_stage("gpt", send_gpt_request(api_messages), deadline)
+        # Candidate LLMs get the same prompt in the background when shadow traffic is on
+        mirror("llm", "openai", api_messages, gpt_response, time.perf_counter() - gpt_start)
         # gpt_response = await send_float16_request(api_messages)
+    except (StageTimeout, CircuitOpen):
+        raise  # No budget left for a retry, or no provider to retry with
     except Exception as e:
-        print(f"send_float16_request failed with exception: {e}")
+        logger.warning("send_float16_request failed with exception: %s", e)
         try:
-            gpt_response = await send_gpt_request(api_messages)
+            gpt_response = await run_stage("gpt", send_gpt_request(api_messages), deadline)
         except Exception as e2:
             # If the fallback also fails, raise an exception or handle accordingly
-            print(f"send_gpt_request also failed with exception: {e2}")
+            logger.error("send_gpt_request also failed with exception: %s", e2)
             raise  # Re-raise the exception or handle as needed
     return gpt_response
 
-async def transcribe_audio(raw_audio_data):
+async def transcribe_audio(raw_audio_data, deadline=None, sample_rate=STT_SAMPLE_RATE):
     """Send audio to STT service and return transcription."""
-    wav_data = add_wav_header(raw_audio_data, sample_rate=15000)
-    transcription_response = await send_azure_stt_request(wav_data)
+    wav_data = add_wav_header(raw_audio_data, sample_rate=sample_rate)
+    stt_start = time.perf_counter()
+    transcription_response = await run_stage("stt", send_azure_stt_request(wav_data), deadline)
+    mirror("stt", "azure_stt", wav_data, transcription_response, time.perf_counter() - stt_start)
     return transcription_response.get("text", "").strip()
 
 async def serve_audio_from_file(file_name):
@@ -296,14 +443,98 @@ async def serve_audio_from_file(file_name):
     async with aiofiles.open(mp3_file_path, "rb") as mp3_file:
         return await mp3_file.read()
 
-async def convert_text_to_audio_and_respond(assistant_response):
-    """Convert the GPT response to audio."""
+async def serve_canned_audio(file_name, response_format=DEFAULT_RESPONSE_FORMAT):
+    """Serve a pre-recorded clip in the reply format of the request."""
+    mp3_data = await serve_audio_from_file(file_name)
+    return await transcode_canned_audio(file_name, mp3_data, response_format)
+
+async def synthesize_speech(reply, deadline=None, response_format=DEFAULT_RESPONSE_FORMAT, stream=False):
+    """
+    Speak the reply, or ask the user to say it again when there is none.
+
+    :return: (TTS PCM still to be encoded or None, the finished audio or None, the text spoken, whether to amplify).
+        Canned, pre-rendered and streamed replies are finished here, a StreamedAudio when streaming an MP3 reply.
+    """
+    if reply is None:
+        return None, await serve_canned_audio("say_again.mp3", response_format), SAY_AGAIN_REPLY, False
+
+    # Frequent phrases are pre-rendered through the same pipeline, no TTS call needed
+    prerendered_audio = get_prerendered_audio(reply)
+    if prerendered_audio is not None:
+        return None, await transcode_canned_audio(f"bank:{reply}", prerendered_audio, response_format), reply, False
+
+    if stream and response_format.codec == MP3_CODEC:
+        # Once streaming, a TTS outage could only cut the reply short
+        circuit_breakers["azure_tts"].raise_if_open()
+        # Each sentence is encoded and sent as soon as it is synthesized, the first bytes leave after one TTS call
+        amplify = deadline is None or deadline.remaining() >= AMPLIFY_MIN_REMAINING_SECONDS
+        if not amplify:
+            deadline.degrade("amplify_skipped")
+        # Every TTS call keeps the stage budget, a call past the deadline ends the stream early
+        synthesize = lambda text: run_stage("tts", send_azure_tts_request(text), deadline)
+        streamed_audio = StreamedAudio(encode_mp3_stream(
+            synthesize_segments(reply, synthesize),
+            sample_rate=response_format.sample_rate, bitrate=response_format.bitrate, amplify=amplify
+        ))
+        return None, streamed_audio, reply, False
+
     audio_tts_start = time.time()
-    tts_audio_data = await send_azure_tts_request(assistant_response)
-    log_time("Audio TTS", audio_tts_start)
-
-    audio_processing_start = time.time()
-    tts_audio_data = amplify_pcm_audio(tts_audio_data, factor=3)
-    compressed_audio = compress_to_mp3(tts_audio_data, sample_rate=24000, bitrate='32k')
-    log_time("Audio Processing", audio_processing_start)
-    return compressed_audio
+    try:
+        # Longer replies are synthesized sentence by sentence in parallel
+        tts_audio_data = await run_stage("tts", synthesize_reply(reply, send_azure_tts_request), deadline)
+    except StageTimeout:
+        return None, await serve_canned_audio("say_again.mp3", response_format), SAY_AGAIN_REPLY, False
+    mirror("tts", "azure_tts", reply, tts_audio_data, time.time() - audio_tts_start)
+
+    amplify = True
+    if deadline is not None and deadline.remaining() < AMPLIFY_MIN_REMAINING_SECONDS:
+        deadline.degrade("amplify_skipped")  # Quieter reply rather than a late one
+        amplify = False
+    return tts_audio_data, None, reply, amplify
+
+def encode_speech(tts_pcm, response_format, amplify):
+    """Amplify and encode the TTS PCM in the reply format, None when the audio was finished already."""
+    if tts_pcm is None:
+        return None
+    return response_format.encode(tts_pcm, amplify=amplify)
+
+async def convert_text_to_audio_and_respond(assistant_response, deadline=None, response_format=DEFAULT_RESPONSE_FORMAT,
+                                            stream=False):
+    """Convert a reply to audio outside of a turn, a StreamedAudio when streaming an MP3 reply."""
+    tts_pcm, audio, _, amplify = await synthesize_speech(assistant_response, deadline, response_format, stream)
+    return audio if tts_pcm is None else encode_speech(tts_pcm, response_format, amplify)
+
+# One conversation turn. The session and the prompt config are read concurrently, the summary
+# while STT runs; the blocking database reads and the encoder run in threads.
+TURN_PIPELINE = Pipeline("turn", [
+    Stage("session", load_user_session, inputs=("user_id",), outputs=("full_messages",), executor=THREAD),
+    Stage("prompt_config", load_prompt_config, inputs=("user_id", "requested_format"),
+          outputs=("system_prompt", "active_message_limit", "daily_rate_limit", "whitelist", "reply_cache_setting",
+                   "response_format"),
+          executor=THREAD),
+    Stage("check", check_turn,
+          inputs=("user_id", "raw_audio_data", "sample_rate", "full_messages", "system_prompt", "active_message_limit",
+                  "daily_rate_limit", "whitelist"),
+          outputs=("audio_seconds",), executor=THREAD),
+    # Only once the turn passed the check, a rejected turn does not read the summary
+    Stage("summary", load_summary, inputs=("user_id", "full_messages", "active_message_limit"),
+          outputs=("summary_data",), executor=THREAD, after=("audio_seconds",)),
+    Stage("stt", transcribe_upload, inputs=("raw_audio_data", "sample_rate", "audio_seconds", "deadline"),
+          outputs=("transcription",)),
+    Stage("prompt", build_prompt, inputs=("transcription", "full_messages", "active_message_limit"),
+          outputs=("prompt_messages",)),
+    Stage("reply", generate_reply,
+          inputs=("transcription", "audio_seconds", "prompt_messages", "system_prompt", "summary_data", "deadline"),
+          outputs=("reply",),
+          # Common utterances (hello, goodnight) are answered from the reply cache when the user opted in
+          cache=reply_cache, cache_key=reply_cache_key,
+          cache_inputs=("user_id", "transcription", "system_prompt", "full_messages", "reply_cache_setting")),
+    Stage("speech", synthesize_speech, inputs=("reply", "deadline", "response_format", "stream"),
+          outputs=("tts_pcm", "speech_audio", "spoken_reply", "amplify")),
+    Stage("encode", encode_speech, inputs=("tts_pcm", "response_format", "amplify"), outputs=("encoded_audio",),
+          executor=THREAD),
+    Stage("messages", record_turn, inputs=("full_messages", "prompt_messages", "spoken_reply"),
+          outputs=("updated_messages",)),
+])
+
+register_metrics("pipeline", TURN_PIPELINE.stats)
@@ -1,72 +1,98 @@
-import boto3
+import logging
 import os
-from botocore.exceptions import ClientError
 from datetime import datetime
+from .conversation import Conversation
+from .storage import create_storage, StorageError, SessionConflict
+from .session_cache import session_cache, merge_sessions
 
+logger = logging.getLogger(__name__)
 
-# Environment Variables
-DYNAMODB_MESSAGES_TABLE = os.getenv("DYNAMODB_MESSAGES_TABLE", 'UserMessages')
-DYNAMODB_PROMPTS_TABLE = os.getenv("DYNAMODB_PROMPTS_TABLE", 'UserPrompts')
-ENDPOINT_URL = os.getenv("DYNAMODB_ENDPOINT_URL", None)
+# Conditional session writes retried after merging with a concurrent writer
+SESSION_WRITE_ATTEMPTS = int(os.getenv("SESSION_WRITE_ATTEMPTS", 3))
 
-# Create the DynamoDB resource
-if ENDPOINT_URL:
-    dynamodb = boto3.resource('dynamodb', endpoint_url=ENDPOINT_URL)
-else:
-    dynamodb = boto3.resource('dynamodb')
-
-# Tables
-messages_table = dynamodb.Table(DYNAMODB_MESSAGES_TABLE)
-prompts_table = dynamodb.Table(DYNAMODB_PROMPTS_TABLE)
+# Backend selected by STORAGE_BACKEND, see app/storage.py
+storage = create_storage()
+# The DynamoDB resource, used by the table setup of the DynamoDB tests
+dynamodb = getattr(storage, "dynamodb", None)
 
 def get_user_session(user_id):
+    cached_messages = session_cache.get(user_id)
+    if cached_messages is not None:
+        return cached_messages
+
     try:
-        response = messages_table.get_item(Key={'UserID': user_id})
-        return response.get('Item', {}).get('Messages', [])
-    except ClientError as e:
-        print("GET_USER_SESSION: ", e.response['Error']['Message'])
-        return []
+        messages, version = storage.read_session(user_id)
+        messages = Conversation.from_messages(messages)
+        session_cache.put(user_id, messages, version)
+        return messages
+    except StorageError as e:
+        logger.error("GET_USER_SESSION: %s", e)
+        return Conversation()
+
+def scan_user_sessions():
+    """Yield (user_id, messages) for every stored session, used by offline tools."""
+    return storage.scan_sessions()
 
 def update_user_session(user_id, messages):
+    version = session_cache.version(user_id)
+    try:
+        for _ in range(SESSION_WRITE_ATTEMPTS):
+            try:
+                new_version = storage.write_session(user_id, messages, version)
+                session_cache.put(user_id, messages, new_version)
+                return
+            except SessionConflict:
+                # Another worker wrote a turn since our read, keep both
+                session_cache.record_conflict()
+                stored_messages, version = storage.read_session(user_id)
+                messages = merge_sessions(stored_messages, messages)
+        logger.error("UPDATE_USER_SESSION: gave up on %s after %d conflicting writes", user_id, SESSION_WRITE_ATTEMPTS)
+        session_cache.invalidate(user_id)
+    except StorageError as e:
+        logger.error("UPDATE_USER_SESSION: %s", e)
+        session_cache.invalidate(user_id)
+
+def get_user_summary(user_id):
     try:
-        messages_table.put_item(Item={'UserID': user_id, 'Messages': messages})
-    except ClientError as e:
-        print("UPDATE_USER_SESSION: ", e.response['Error']['Message'])
+        summary, summary_until = storage.read_summary(user_id)
+        return {"Summary": summary, "SummaryUntil": summary_until}
+    except StorageError as e:
+        logger.error("GET_USER_SUMMARY: %s", e)
+        return {"Summary": None, "SummaryUntil": None}
+
+def update_user_summary(user_id, summary, summary_until):
+    try:
+        storage.write_summary(user_id, summary, summary_until)
+    except StorageError as e:
+        logger.error("UPDATE_USER_SUMMARY: %s", e)
 
 def get_user_system_prompt(user_id):
+    # If user does not exist, return None for every fields
+    empty_prompt = {
+        "SystemPrompt": None, "ActiveMessageLimit": None, "DailyRateLimit": None, "Whitelist": None,
+        "ResponseFormat": None, "ReplyCache": None,
+    }
     try:
-        response = prompts_table.get_item(Key={'UserID': user_id})
-        item = response.get('Item', None)
-        
-        # If user does not exist, return None for every fields
-        if not item:
-            return {"SystemPrompt": None, "ActiveMessageLimit": None, "DailyRateLimit": None, "Whitelist": None}
-        
-        system_prompt = item.get('SystemPrompt', None)
-        active_message_limit = item.get('ActiveMessageLimit', None)
-        daily_rate_limit = item.get('DailyRateLimit', None) 
-        whitelist = item.get('Whitelist', None) 
-        
-        return {
-            "SystemPrompt": system_prompt,
-            "ActiveMessageLimit": active_message_limit,
-            "DailyRateLimit": daily_rate_limit,
-            "Whitelist": whitelist,
-        }
-    except ClientError as e:
-        print("GET_USER_SYSTEM_PROMPT: ", e.response['Error']['Message'])
-        return {"SystemPrompt": None, "ActiveMessageLimit": None, "DailyRateLimit": None, "Whitelist": None}
+        fields = storage.read_prompt(user_id)
+    except StorageError as e:
+        logger.error("GET_USER_SYSTEM_PROMPT: %s", e)
+        return empty_prompt
+    if not fields:
+        return empty_prompt
+
+    # ResponseFormat is an Accept-style reply format, e.g. "audio/mpeg; rate=16000; bitrate=16k",
+    # ReplyCache is "off", "shared" or "personal" (see app/reply_cache.py)
+    return {field: fields.get(field, None) for field in empty_prompt}
 
 def update_user_system_prompt(user_id, system_prompt, active_message_limit, daily_rate_limit, whitelist):
     try:
         updated_date = datetime.utcnow().isoformat()
-        prompts_table.put_item(Item={
-            'UserID': user_id,
+        storage.write_prompt(user_id, {
             'SystemPrompt': system_prompt,
             'ActiveMessageLimit': active_message_limit,
             "DailyRateLimit": daily_rate_limit,
             'Whitelist': whitelist,
             'UpdatedDate': updated_date,
         })
-    except ClientError as e:
-        print("UPDATE_USER_SYSTEM_PROMPT: ", e.response['Error']['Message'])
+    except StorageError as e:
+        logger.error("UPDATE_USER_SYSTEM_PROMPT: %s", e)
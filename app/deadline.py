@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Budget of a request when the caller does not provide one (API Gateway gives up after 29 s)
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", 25))
+# Kept back from the Lambda remaining time for draining background work and returning the body
+LAMBDA_DEADLINE_MARGIN_SECONDS = float(os.getenv("LAMBDA_DEADLINE_MARGIN_SECONDS", 2))
+
+# Longest time each stage may take on its own
+STAGE_TIMEOUTS = {
+    "queue": float("inf"),
+    "stt": float(os.getenv("STT_TIMEOUT", 8)),
+    "gpt": float(os.getenv("GPT_TIMEOUT", 12)),
+    "tts": float(os.getenv("TTS_TIMEOUT", 8)),
+}
+
+# Budget kept for the stages that follow, so one slow stage cannot starve the rest
+STAGE_RESERVES = {
+    "queue": 10.0,
+    "stt": 7.0,
+    "gpt": 3.0,
+    "tts": 0.5,
+}
+
+# Below this remaining budget the TTS audio is encoded without amplification
+AMPLIFY_MIN_REMAINING_SECONDS = float(os.getenv("AMPLIFY_MIN_REMAINING_SECONDS", 1.0))
+
+class StageTimeout(Exception):
+    """Raised when a stage runs out of its slice of the request deadline."""
+
+    def __init__(self, stage):
+        super().__init__(f"{stage} stage exceeded its time slice")
+        self.stage = stage
+
+class Deadline:
+    """Per-request time budget threaded through the pipeline stages."""
+
+    def __init__(self, seconds=REQUEST_DEADLINE_SECONDS):
+        self.expires_at = time.monotonic() + seconds
+        # Fallbacks taken while serving the request, e.g. "gpt_timeout"
+        self.fallbacks = []
+
+    @classmethod
+    def from_lambda_context(cls, context, margin=LAMBDA_DEADLINE_MARGIN_SECONDS):
+        return cls(context.get_remaining_time_in_millis() / 1000 - margin)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def stage_timeout(self, stage):
+        """Time slice of `stage`: its own limit, bounded by what the later stages need."""
+        return max(0.0, min(STAGE_TIMEOUTS[stage], self.remaining() - STAGE_RESERVES[stage]))
+
+    def degrade(self, reason):
+        logger.warning("Deadline fallback: %s (%.3f seconds left)", reason, self.remaining(), extra={"fallback": reason})
+        self.fallbacks.append(reason)
+
+async def run_stage(stage, coro, deadline=None):
+    """
+    Await `coro` within the stage's slice of the deadline.
+
+    :raises StageTimeout: When the slice is exceeded, after recording the fallback on the deadline
+    """
+    if deadline is None:
+        return await coro
+
+    try:
+        return await asyncio.wait_for(coro, deadline.stage_timeout(stage))
+    except asyncio.TimeoutError:
+        deadline.degrade(f"{stage}_timeout")
+        raise StageTimeout(stage)
@@ -0,0 +1,136 @@
+import boto3
+import os
+from botocore.exceptions import ClientError
+from .conversation import Conversation
+from .session_codec import encode_messages, decode_messages, CODEC_VERSION
+from .storage import Storage, StorageError, SessionConflict, PROMPT_FIELDS
+
+# Environment Variables
+DYNAMODB_MESSAGES_TABLE = os.getenv("DYNAMODB_MESSAGES_TABLE", 'UserMessages')
+DYNAMODB_PROMPTS_TABLE = os.getenv("DYNAMODB_PROMPTS_TABLE", 'UserPrompts')
+ENDPOINT_URL = os.getenv("DYNAMODB_ENDPOINT_URL", None)
+
+def create_dynamodb_resource():
+    if ENDPOINT_URL:
+        return boto3.resource('dynamodb', endpoint_url=ENDPOINT_URL)
+    return boto3.resource('dynamodb')
+
+def _item_messages(item):
+    # Sessions written before the binary codec still hold a plain Messages list
+    if 'MessagesBlob' in item:
+        return decode_messages(item['MessagesBlob'])
+    return Conversation(item.get('Messages', []))
+
+def _storage_error(e):
+    return StorageError(e.response['Error']['Message'])
+
+class DynamoDBStorage(Storage):
+    """Sessions and summaries in the UserMessages table, prompt configs in UserPrompts."""
+
+    def __init__(self, dynamodb=None, messages_table=None, prompts_table=None):
+        if messages_table is None or prompts_table is None:
+            dynamodb = dynamodb or create_dynamodb_resource()
+        self.dynamodb = dynamodb
+        self.messages_table = messages_table or dynamodb.Table(DYNAMODB_MESSAGES_TABLE)
+        self.prompts_table = prompts_table or dynamodb.Table(DYNAMODB_PROMPTS_TABLE)
+
+    def read_session(self, user_id):
+        try:
+            response = self.messages_table.get_item(
+                Key={'UserID': user_id},
+                ProjectionExpression='Messages, MessagesBlob, Version',
+                ConsistentRead=True
+            )
+        except ClientError as e:
+            raise _storage_error(e)
+        item = response.get('Item', {})
+        return _item_messages(item), int(item.get('Version', 0))
+
+    def write_session(self, user_id, messages, expected_version=None):
+        values = {
+            ':blob': encode_messages(messages),
+            ':codec': CODEC_VERSION,
+            ':zero': 0,
+            ':one': 1,
+        }
+        condition = {}
+        if expected_version == 0:
+            condition['ConditionExpression'] = 'attribute_not_exists(Version)'
+        elif expected_version is not None:
+            condition['ConditionExpression'] = 'Version = :expected'
+            values[':expected'] = expected_version
+
+        try:
+            # update_item keeps the other attributes of the session (e.g. Summary) intact,
+            # the legacy Messages list is dropped once the session is rewritten with the codec
+            response = self.messages_table.update_item(
+                Key={'UserID': user_id},
+                UpdateExpression=(
+                    'SET MessagesBlob = :blob, Codec = :codec, Version = if_not_exists(Version, :zero) + :one '
+                    'REMOVE Messages'
+                ),
+                ExpressionAttributeValues=values,
+                ReturnValues='UPDATED_NEW',
+                **condition
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise SessionConflict(user_id)
+            raise _storage_error(e)
+        return int(response['Attributes']['Version'])
+
+    def scan_sessions(self):
+        scan_kwargs = {'ProjectionExpression': 'UserID, Messages, MessagesBlob'}
+        while True:
+            try:
+                response = self.messages_table.scan(**scan_kwargs)
+            except ClientError as e:
+                raise _storage_error(e)
+            for item in response.get('Items', []):
+                yield item['UserID'], _item_messages(item)
+
+            last_evaluated_key = response.get('LastEvaluatedKey')
+            if not last_evaluated_key:
+                break
+            scan_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+    def read_summary(self, user_id):
+        try:
+            response = self.messages_table.get_item(
+                Key={'UserID': user_id},
+                ProjectionExpression='Summary, SummaryUntil'
+            )
+        except ClientError as e:
+            raise _storage_error(e)
+        item = response.get('Item', {})
+        summary_until = item.get('SummaryUntil', None)
+        return item.get('Summary', None), float(summary_until) if summary_until is not None else None
+
+    def write_summary(self, user_id, summary, summary_until):
+        try:
+            self.messages_table.update_item(
+                Key={'UserID': user_id},
+                UpdateExpression='SET Summary = :summary, SummaryUntil = :summary_until',
+                ExpressionAttributeValues={
+                    ':summary': summary,
+                    ':summary_until': str(summary_until),
+                }
+            )
+        except ClientError as e:
+            raise _storage_error(e)
+
+    def read_prompt(self, user_id):
+        try:
+            response = self.prompts_table.get_item(Key={'UserID': user_id})
+        except ClientError as e:
+            raise _storage_error(e)
+        item = response.get('Item', None)
+        if not item:
+            return None
+        return {field: item[field] for field in PROMPT_FIELDS if field in item}
+
+    def write_prompt(self, user_id, fields):
+        try:
+            self.prompts_table.put_item(Item={'UserID': user_id, **fields})
+        except ClientError as e:
+            raise _storage_error(e)
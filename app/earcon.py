@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import wave
+from functools import lru_cache
+import numpy as np
+from .audio_processing import encode_pcm_audio, to_mono_pcm16, trim_silence, MP3_CODEC
+
+logger = logging.getLogger(__name__)
+
+# Filler played while the reply is prepared, lossless source so it is encoded only once
+EARCON_FILE = os.getenv(
+    "EARCON_FILE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 "resource", "sounds", "state_sounds", "wav", "wah.wav")
+)
+# Request header opting in to the streamed reply, e.g. "X-Buddy-Earcon: 1"
+EARCON_HEADER = "x-buddy-earcon"
+# While the reply is not ready, a short silent frame is sent this often so the device's stream stays alive
+EARCON_KEEPALIVE_SECONDS = float(os.getenv("EARCON_KEEPALIVE_SECONDS", 2.0))
+KEEPALIVE_SILENCE_SECONDS = 0.05
+
+def wants_earcon(headers, response_format):
+    """Only MP3 replies can be streamed, MP3 frames of the same format may be concatenated."""
+    return headers.get(EARCON_HEADER, "").lower() in ("1", "true", "yes") and response_format.codec == MP3_CODEC
+
+def strip_id3v2(mp3_data):
+    """
+    Drop the leading ID3v2 tag ffmpeg writes, so MP3 clips can be appended to one stream.
+
+    The tag size is a 28-bit syncsafe integer in bytes 6-9 of the 10 byte header.
+    """
+    if len(mp3_data) < 10 or mp3_data[:3] != b"ID3":
+        return mp3_data
+    size = (mp3_data[6] << 21) | (mp3_data[7] << 14) | (mp3_data[8] << 7) | mp3_data[9]
+    footer = 10 if mp3_data[5] & 0x10 else 0
+    return mp3_data[10 + size + footer:]
+
+@lru_cache(maxsize=8)
+def earcon_audio(response_format):
+    """The earcon encoded in `response_format`, kept in memory after the first call."""
+    with wave.open(EARCON_FILE, "rb") as wav_file:
+        pcm_data = to_mono_pcm16(
+            wav_file.readframes(wav_file.getnframes()),
+            num_channels=wav_file.getnchannels(),
+            bits_per_sample=wav_file.getsampwidth() * 8
+        )
+        source_rate = wav_file.getframerate()
+    # Silence around the clip would only delay the reply
+    pcm_data = trim_silence(np.frombuffer(pcm_data, dtype='<i2'), source_rate).tobytes()
+    return strip_id3v2(encode_pcm_audio(
+        pcm_data, codec=response_format.codec, sample_rate=response_format.sample_rate,
+        bitrate=response_format.bitrate, source_rate=source_rate
+    ))
+
+@lru_cache(maxsize=8)
+def keepalive_audio(response_format):
+    silence = b"\x00\x00" * int(KEEPALIVE_SILENCE_SECONDS * response_format.sample_rate)
+    return strip_id3v2(encode_pcm_audio(
+        silence, codec=response_format.codec, sample_rate=response_format.sample_rate,
+        bitrate=response_format.bitrate, source_rate=response_format.sample_rate
+    ))
+
+async def stream_with_earcon(reply, response_format, fallback_audio=None, keepalive_seconds=EARCON_KEEPALIVE_SECONDS):
+    """
+    Yield the earcon right away, then the reply audio once `reply` (an awaitable Response) is done.
+
+    The status code is sent before the reply exists, so a failed reply ends the stream
+    with `fallback_audio` (e.g. the say-again clip) instead of an error status.
+    """
+    task = asyncio.ensure_future(reply)
+    loop = asyncio.get_running_loop()
+    try:
+        # The first request in a format other than the pre-warmed one runs ffmpeg, off the event loop
+        yield await loop.run_in_executor(None, earcon_audio, response_format)
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=keepalive_seconds)
+            if done:
+                break
+            yield await loop.run_in_executor(None, keepalive_audio, response_format)
+
+        response = task.result()
+        if response.status_code == 200:
+            yield strip_id3v2(bytes(response.body))
+        else:
+            logger.warning("Streamed reply failed with %s: %s", response.status_code, response.body)
+            if fallback_audio:
+                yield strip_id3v2(fallback_audio)
+    finally:
+        # The device hung up, do not leave the pipeline running for nobody
+        if not task.done():
+            task.cancel()
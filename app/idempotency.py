@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from .streaming import StreamedAudio
+
+logger = logging.getLogger(__name__)
+
+# How long a finished reply is replayed to device retries
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 120))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 256))
+
+# Header marking canned replies served instead of the real pipeline output
+DEGRADED_HEADER = 'X-Buddy-Degraded'
+
+def request_key(body, user_id, raw_audio_data):
+    """Key a request by the client supplied request ID, or by the user and the recorded audio."""
+    request_id = body.get('request_id')
+    if request_id:
+        return f"{user_id}:{request_id}"
+
+    digest = hashlib.sha256()
+    digest.update(user_id.encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(raw_audio_data)
+    return f"{user_id}:{digest.hexdigest()}"
+
+class IdempotencyCache:
+    """
+    Coalesce duplicate requests onto a single pipeline run.
+
+    Concurrent duplicates wait for the run already in flight, later retries get the
+    finished response replayed until it expires. Only full successful responses are kept:
+    a streamed reply is kept while it is produced, and dropped once its production failed.
+    """
+
+    def __init__(self, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._in_flight = {}
+        self._results = OrderedDict()
+
+    async def run(self, key, factory):
+        """
+        Return the response for `key`, calling `factory()` only if no run is in flight or cached.
+
+        :param key: The idempotency key of the request
+        :param factory: Zero argument callable returning an awaitable Response
+        """
+        cached = self._get_result(key)
+        if cached is not None:
+            logger.info("Replaying cached response for %s", key)
+            return cached
+
+        loop = asyncio.get_running_loop()
+        future = self._in_flight.get(key)
+        # Futures from a previous event loop (e.g. an earlier Lambda invocation) are stale
+        if future is not None and future.get_loop() is loop:
+            logger.info("Joining in-flight request for %s", key)
+            return await asyncio.shield(future)
+
+        future = loop.create_future()
+        self._in_flight[key] = future
+        try:
+            response = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved when no duplicate is waiting
+            raise
+        finally:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+        # Canned replies (e.g. the busy clip) must not be replayed to the retry
+        if response.status_code == 200 and DEGRADED_HEADER not in response.headers:
+            self._put_result(key, response)
+        future.set_result(response)
+        return response
+
+    def clear(self):
+        self._in_flight.clear()
+        self._results.clear()
+
+    def _get_result(self, key):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        # A retry of a stream that broke off needs a fresh run, not the truncated replay
+        if expires_at < time.time() or (isinstance(response.body, StreamedAudio) and response.body.failed):
+            del self._results[key]
+            return None
+        return response
+
+    def _put_result(self, key, response):
+        if self.ttl_seconds <= 0:
+            return
+        self._results[key] = (time.time() + self.ttl_seconds, response)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+idempotency_cache = IdempotencyCache()
@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from .storage import STORAGE_BACKEND
+from .sqlite_storage import SQLITE_PATH, thread_connection, sqlite_errors
+
+# "memory" (one server process) or "sqlite" (shared by the workers of a box), follows STORAGE_BACKEND by default
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "sqlite" if STORAGE_BACKEND == "sqlite" else "memory")
+JOB_SQLITE_PATH = os.getenv("JOB_SQLITE_PATH", SQLITE_PATH)
+# How long a job and its reply are kept after it was submitted
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", 600))
+
+# Job states, a job moves forward only
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+@dataclass
+class Job:
+    job_id: str
+    status: str
+    expires_at: float
+    # The pipeline's response once the job is done
+    status_code: int = None
+    body: bytes = None
+    headers: dict = field(default_factory=dict)
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+class JobStore(ABC):
+    """
+    Interface of the stores keeping submitted jobs and their replies until they expire.
+
+    Expired jobs are never returned, whether or not they were purged yet.
+    """
+
+    @abstractmethod
+    def create(self, job_id, ttl_seconds=JOB_TTL_SECONDS):
+        """Store a new queued job and return it."""
+
+    @abstractmethod
+    def update(self, job):
+        """Replace the stored state of `job`."""
+
+    @abstractmethod
+    def get(self, job_id):
+        """:return: The Job, or None when it is unknown or expired"""
+
+    @abstractmethod
+    def purge_expired(self):
+        """Delete the expired jobs, return how many were deleted."""
+
+class MemoryJobStore(JobStore):
+    """Process-local store, only the process that ran a job can answer for it."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, ttl_seconds=JOB_TTL_SECONDS):
+        job = Job(job_id, QUEUED, time.time() + ttl_seconds)
+        with self._lock:
+            self._jobs[job_id] = job
+        return job
+
+    def update(self, job):
+        with self._lock:
+            self._jobs[job.job_id] = job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.expires_at < time.time():
+            return None
+        return job
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.expires_at < now]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+class SQLiteJobStore(JobStore):
+    """
+    Jobs in a table of the embedded database, visible to every server process of the box.
+
+    A device may poll a different uvicorn worker than the one running its job.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        status_code INTEGER,
+        body BLOB,
+        headers TEXT
+    );
+    CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at);
+    """
+
+    def __init__(self, path=JOB_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with sqlite_errors():
+            self._connection().executescript(self.SCHEMA)
+
+    def create(self, job_id, ttl_seconds=JOB_TTL_SECONDS):
+        job = Job(job_id, QUEUED, time.time() + ttl_seconds)
+        self.update(job)
+        return job
+
+    def update(self, job):
+        with sqlite_errors():
+            self._connection().execute(
+                "INSERT OR REPLACE INTO jobs (job_id, status, expires_at, status_code, body, headers) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job.job_id, job.status, job.expires_at, job.status_code, job.body, json.dumps(job.headers))
+            )
+
+    def get(self, job_id):
+        with sqlite_errors():
+            row = self._connection().execute(
+                "SELECT status, expires_at, status_code, body, headers FROM jobs "
+                "WHERE job_id = ? AND expires_at >= ?", (job_id, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        status, expires_at, status_code, body, headers = row
+        return Job(job_id, status, expires_at, status_code, body, json.loads(headers))
+
+    def purge_expired(self):
+        with sqlite_errors():
+            return self._connection().execute("DELETE FROM jobs WHERE expires_at < ?", (time.time(),)).rowcount
+
+    def _connection(self):
+        return thread_connection(self._local, self.path)
+
+def create_job_store(backend=JOB_STORE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteJobStore()
+    if backend == "memory":
+        return MemoryJobStore()
+    raise ValueError(f"Unknown job store backend: {backend}")
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import replace
+from .admission import Overloaded
+from .deadline import Deadline
+from .job_store import create_job_store, RUNNING, DONE, FAILED
+
+logger = logging.getLogger(__name__)
+
+# Pipeline runs of submitted jobs at a time, per server process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+# Jobs waiting for a worker, a submission beyond this is answered with the busy status
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", 64))
+# Budget of a job's pipeline run, longer than a request's since no connection is held open
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", 60))
+# Longest long-poll a device may ask for, and how often a job run by another process is polled
+JOB_MAX_WAIT_SECONDS = float(os.getenv("JOB_MAX_WAIT_SECONDS", 25))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", 0.25))
+# Lambda freezes the process between requests, so queued jobs would not run and the in-memory
+# store is not shared between instances: jobs are only served by the long-running server
+JOBS_ENABLED = not os.getenv("AWS_LAMBDA_FUNCTION_NAME")
+
+class JobQueue:
+    """
+    Run uploads as jobs: submitted at once, processed by a pool of workers, fetched later.
+
+    The device's connection only lasts for the submission and the (long) poll, so a turn
+    may take longer than a request may, and a burst of uploads waits in the queue instead
+    of in open connections. Replies are kept in the job store until they expire.
+
+    Workers are started on the running loop by the first submission.
+    """
+
+    def __init__(self, process, store=None, workers=JOB_WORKERS, max_queued=JOB_QUEUE_MAX,
+                 deadline_seconds=JOB_DEADLINE_SECONDS):
+        """
+        :param process: Coroutine function running a turn, called as process(event, deadline)
+        """
+        self.process = process
+        self.store = store if store is not None else create_job_store()
+        self.workers = workers
+        self.max_queued = max_queued
+        self.deadline_seconds = deadline_seconds
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+        self._queue = None
+        self._tasks = []
+        # Jobs of this process not finished yet, set when they finish
+        self._finished = {}
+
+    async def submit(self, event):
+        """
+        Queue `event` and return the ID of its job.
+
+        :raises Overloaded: When the queue is full
+        """
+        self._start()
+        if self._queue.qsize() >= self.max_queued:
+            self.rejected += 1
+            raise Overloaded("Job queue is full")
+
+        job_id = uuid.uuid4().hex
+        job = await self._call_store(self.store.create, job_id)
+        self._finished[job_id] = asyncio.Event()
+        self._queue.put_nowait((job, event))
+        self.submitted += 1
+        return job_id
+
+    async def wait(self, job_id, timeout=0.0):
+        """
+        The job, once it finished or after `timeout` seconds.
+
+        :return: The Job, or None when it is unknown or expired
+        """
+        timeout = min(timeout, JOB_MAX_WAIT_SECONDS)
+        finished = self._finished.get(job_id)
+        if finished is not None:
+            # Run by this process, woken up as soon as it finishes
+            try:
+                await asyncio.wait_for(finished.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return await self._call_store(self.store.get, job_id)
+
+        # Run by another process sharing the store, or already finished
+        give_up_at = time.monotonic() + timeout
+        while True:
+            job = await self._call_store(self.store.get, job_id)
+            if job is None or job.finished or time.monotonic() >= give_up_at:
+                return job
+            await asyncio.sleep(min(JOB_POLL_INTERVAL_SECONDS, give_up_at - time.monotonic()))
+
+    async def stop(self, timeout=None):
+        """Let the workers finish the queued jobs for up to `timeout` seconds, then cancel them."""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping with %d jobs unfinished", self._queue.qsize() + self.running)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self.running,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._tasks and self._tasks[0].get_loop() is loop:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def _work(self):
+        while True:
+            job, event = await self._queue.get()
+            try:
+                await self._run(job, event)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job, event):
+        self.running += 1
+        try:
+            await self._call_store(self.store.update, replace(job, status=RUNNING))
+            try:
+                response = await self.process(event, Deadline(self.deadline_seconds))
+                finished = replace(
+                    job, status=DONE, status_code=response.status_code, body=response.body, headers=response.headers
+                )
+                self.completed += 1
+            except Exception as e:
+                logger.error("Job %s failed: %s", job.job_id, e, exc_info=e)
+                finished = replace(job, status=FAILED, status_code=500, body=b"", headers={})
+                self.failed += 1
+            await self._call_store(self.store.update, finished)
+            await self._call_store(self.store.purge_expired)
+        except Exception as e:
+            logger.error("Storing job %s failed: %s", job.job_id, e)
+        finally:
+            self.running -= 1
+            finished_event = self._finished.pop(job.job_id, None)
+            if finished_event is not None:
+                finished_event.set()
+
+    async def _call_store(self, method, *args):
+        # The SQLite store blocks on its lock, keep the loop free for the requests in flight
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
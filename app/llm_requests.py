@@ -1,10 +1,17 @@
 import aiohttp
+import logging
 import os
 import json
+from .admission import provider_limit
+from .circuit_breaker import circuit_breaker, CIRCUIT_LLM_SLOW_CALL_SECONDS
+
+logger = logging.getLogger(__name__)
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_API_BASE = "https://api.openai.com/v1"
 
+@provider_limit("openai")
+@circuit_breaker("openai", slow_call_seconds=CIRCUIT_LLM_SLOW_CALL_SECONDS)
 async def send_gpt_request(messages):
     async with aiohttp.ClientSession() as session:
         async with session.post(
@@ -20,6 +27,8 @@ async def send_gpt_request(messages):
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_API_BASE = "https://api.groq.com"
 
+@provider_limit("groq")
+@circuit_breaker("groq", slow_call_seconds=CIRCUIT_LLM_SLOW_CALL_SECONDS)
 async def send_groq_request(messages):
     messages = [
         {key: value for key, value in message.items() if key != "timestamp"}
@@ -49,7 +58,7 @@ async def send_groq_request(messages):
         async with session.post(url, headers=headers, data=json_payload) as response:
             response_text = await response.text()
             if response.status != 200:
-                print(f"Error {response.status}: {response_text}")
+                logger.error("Error %s: %s", response.status, response_text)
                 response.raise_for_status()
             json_response = await response.json()
             return json_response["choices"][0]["message"]["content"].strip()
@@ -0,0 +1,165 @@
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from .metrics import register_metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Share of requests whose records below WARNING are emitted, warnings and errors are always kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+# What is logged of the conversation:
+#   "off"       nothing
+#   "redacted"  role, length and a digest of the text
+#   "full"      the text itself (local debugging only, children's speech ends up in the logs)
+LOG_CONVERSATION = os.getenv("LOG_CONVERSATION", "redacted")
+# Records waiting for the writer thread, beyond that records are dropped instead of blocking the request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+# Attributes every LogRecord has, anything else was passed with `extra` and goes into the JSON record
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+# (request id, sampled) of the request being handled, set by log_request
+_request = contextvars.ContextVar("log_request", default=(None, True))
+
+logger = logging.getLogger(__name__)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the request id and the `extra` fields of the record."""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RequestSampler(logging.Filter):
+    """Tags records with the request id and drops the low-level ones of unsampled requests."""
+
+    def __init__(self):
+        super().__init__()
+        self.sampled_out = 0
+
+    def filter(self, record):
+        request_id, sampled = _request.get()
+        record.request_id = request_id
+        if sampled or record.levelno >= logging.WARNING:
+            return True
+        self.sampled_out += 1
+        return False
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without blocking.
+
+    Formatting is left to the writer thread as well, so the request only pays for
+    creating the record. Arguments of log calls must therefore not be mutated afterwards.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_queue = queue.Queue(LOG_QUEUE_SIZE)
+_sampler = RequestSampler()
+_queue_handler = DroppingQueueHandler(_queue)
+_queue_handler.addFilter(_sampler)
+_listener = None
+_configure_lock = threading.Lock()
+
+def configure_logging(level=LOG_LEVEL, stream=None):
+    """
+    Route all logging through the queue to one writer thread printing JSON lines.
+
+    Called once by the entry points (main.py, lambda_function.py). Replaces the root
+    handlers, including the one the Lambda runtime installs.
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+        writer = logging.StreamHandler(stream or sys.stdout)
+        writer.setFormatter(JsonFormatter())
+        _listener = logging.handlers.QueueListener(_queue, writer, respect_handler_level=True)
+        _listener.start()
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+
+def flush_logs(timeout=1.0):
+    """Wait until the writer thread printed the queued records, Lambda freezes the process after returning."""
+    if _listener is None:
+        return
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+@contextmanager
+def log_request(request_id=None, sample_rate=None):
+    """
+    Scope the records logged inside (and in tasks started inside) to one request.
+
+    Whether the request's records below WARNING are emitted is decided once here.
+    """
+    sample_rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+    token = _request.set((request_id or uuid.uuid4().hex[:12], random.random() < sample_rate))
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+def current_request_id():
+    return _request.get()[0]
+
+def log_conversation(role, content, mode=None):
+    """Log one utterance, as configured by LOG_CONVERSATION."""
+    mode = mode or LOG_CONVERSATION
+    # Skipped before hashing when the request is not sampled
+    if mode == "off" or not logger.isEnabledFor(logging.INFO) or not _request.get()[1]:
+        return
+    content = content or ""
+    fields = {"role": role, "chars": len(content)}
+    if mode == "full":
+        fields["content"] = content
+    else:
+        fields["digest"] = hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+    logger.info("Conversation message", extra=fields)
+
+def log_stats():
+    return {
+        "queued": _queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "sampled_out": _sampler.sampled_out,
+    }
+
+register_metrics("logging", log_stats)
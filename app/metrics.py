@@ -0,0 +1,8 @@
+# Components register a callable returning a dict of their counters, the server exports them
+_collectors = {}
+
+def register_metrics(name, collector):
+    _collectors[name] = collector
+
+def collect_metrics():
+    return {name: collector() for name, collector in _collectors.items()}
@@ -0,0 +1,196 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Where a stage runs: awaited on the event loop, in the default thread pool, or in a process pool
+LOOP = "loop"
+THREAD = "thread"
+PROCESS = "process"
+EXECUTORS = (LOOP, THREAD, PROCESS)
+
+# Workers of the process pool, created on first use by a "process" stage
+PIPELINE_PROCESS_WORKERS = int(os.getenv("PIPELINE_PROCESS_WORKERS", 2))
+
+class PipelineError(Exception):
+    """Raised when the stages of a pipeline do not form a valid graph, or a run lacks inputs."""
+
+class PipelineExit(Exception):
+    """Raised by a stage to end the run early, the caller gets `result` instead of the outputs."""
+
+    def __init__(self, result):
+        super().__init__("Pipeline ended early")
+        self.result = result
+
+class Stage:
+    """
+    One step of a pipeline: a function from named inputs to named outputs.
+
+    The function is called with the inputs as keyword arguments. It returns the single output,
+    or a tuple of the outputs in declared order.
+
+    :param executor: LOOP (the function may be a coroutine function), THREAD or PROCESS (a module
+        level function with picklable arguments). PIPELINE_EXECUTOR_<NAME> overrides it, e.g.
+        PIPELINE_EXECUTOR_ENCODE=process.
+    :param cache: Object with lookup(key) and store(key, value, seconds), like the reply cache
+    :param cache_key: Called with the `cache_inputs` as positional arguments, in their order, returns the key
+        or None to bypass the cache. Lookups hit before the function runs; results other than None are stored.
+    :param after: Values the stage waits for without being passed them, e.g. the output of a check
+        that must pass before the stage may touch anything
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), executor=LOOP, cache=None, cache_key=None, cache_inputs=(),
+                 after=()):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.executor = os.getenv(f"PIPELINE_EXECUTOR_{name.upper()}", executor)
+        if self.executor not in EXECUTORS:
+            raise PipelineError(f"Unknown executor {self.executor} of stage {name}")
+        if self.executor != LOOP and inspect.iscoroutinefunction(func):
+            raise PipelineError(f"Stage {name} is a coroutine function, it can only run on the loop")
+        self.cache = cache
+        self.cache_key = cache_key
+        self.cache_inputs = tuple(cache_inputs)
+        self.after = tuple(after)
+        self.runs = 0
+        self.cache_hits = 0
+        self.total_seconds = 0.0
+
+    @property
+    def requires(self):
+        return self.inputs + self.cache_inputs + self.after
+
+    def stats(self):
+        return {
+            "executor": self.executor,
+            "runs": self.runs,
+            "cache_hits": self.cache_hits,
+            "mean_seconds": round(self.total_seconds / self.runs, 4) if self.runs else 0.0,
+        }
+
+class Pipeline:
+    """
+    Run stages as soon as their inputs are available, independent stages concurrently.
+
+    Every stage is timed and logged the same way, and its cache (if any) is consulted
+    before it runs. A stage raising ends the run: the stages still running are cancelled
+    and the exception propagates (PipelineExit carries an early result).
+    """
+
+    def __init__(self, name, stages):
+        self.name = name
+        self.stages = list(stages)
+
+        producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise PipelineError(f"{output} is an output of both {producers[output]} and {stage.name}")
+                producers[output] = stage.name
+        # Inputs no stage produces are the inputs of the run
+        self.inputs = {name for stage in self.stages for name in stage.requires if name not in producers}
+        self._check_acyclic(producers)
+
+    def _check_acyclic(self, producers):
+        available = set(self.inputs)
+        remaining = list(self.stages)
+        while remaining:
+            ready = [stage for stage in remaining if all(name in available for name in stage.requires)]
+            if not ready:
+                raise PipelineError(f"Stages {', '.join(stage.name for stage in remaining)} depend on each other")
+            for stage in ready:
+                remaining.remove(stage)
+                available.update(stage.outputs)
+
+    async def run(self, **inputs):
+        """
+        Run all stages.
+
+        :return: Dict of the run inputs and every stage output
+        :raises PipelineExit: When a stage ended the run early
+        """
+        missing = self.inputs - inputs.keys()
+        if missing:
+            raise PipelineError(f"Missing inputs of {self.name}: {', '.join(sorted(missing))}")
+
+        values = dict(inputs)
+        pending = list(self.stages)
+        running = {}
+        try:
+            while pending or running:
+                for stage in [stage for stage in pending if all(name in values for name in stage.requires)]:
+                    pending.remove(stage)
+                    running[asyncio.ensure_future(self._run_stage(stage, values))] = stage
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = running.pop(task)
+                    result = task.result()
+                    values.update(zip(stage.outputs, result if len(stage.outputs) > 1 else (result,)))
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        return values
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    async def _run_stage(self, stage, values):
+        start = time.perf_counter()
+        key = None
+        if stage.cache is not None:
+            key = stage.cache_key(*(values[name] for name in stage.cache_inputs))
+        if key is not None:
+            cached = stage.cache.lookup(key)
+            if cached is not None:
+                stage.cache_hits += 1
+                self._record(stage, start, cached=True)
+                return cached
+
+        result = await self._call(stage, {name: values[name] for name in stage.inputs})
+        if key is not None and result is not None:
+            stage.cache.store(key, result, time.perf_counter() - start)
+        self._record(stage, start)
+        return result
+
+    async def _call(self, stage, kwargs):
+        if stage.executor == LOOP:
+            result = stage.func(**kwargs)
+            return await result if inspect.isawaitable(result) else result
+
+        loop = asyncio.get_running_loop()
+        pool = process_pool() if stage.executor == PROCESS else None
+        if pool is not None:
+            return await loop.run_in_executor(pool, functools.partial(stage.func, **kwargs))
+        # The thread runs in a copy of the context, so its log records keep the request id
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, functools.partial(context.run, stage.func, **kwargs))
+
+    def _record(self, stage, start, cached=False):
+        elapsed = time.perf_counter() - start
+        stage.runs += 1
+        stage.total_seconds += elapsed
+        logger.info("%s: %.3f seconds", stage.name, elapsed,
+                    extra={"pipeline": self.name, "stage": stage.name, "seconds": round(elapsed, 3), "cached": cached})
+
+_process_pool = None
+
+def process_pool():
+    """The shared process pool, or None where processes cannot be started (Lambda has no /dev/shm)."""
+    global _process_pool
+    if _process_pool is None:
+        try:
+            _process_pool = ProcessPoolExecutor(PIPELINE_PROCESS_WORKERS)
+        except (OSError, NotImplementedError) as e:
+            logger.warning("No process pool, process stages run in threads: %s", e)
+            _process_pool = False
+    return _process_pool or None
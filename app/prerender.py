@@ -0,0 +1,93 @@
+"""
+Pre-render canned and frequent phrases into the sound bank.
+
+Render a phrase list (one phrase per line):
+    python -m app.prerender --phrases app/sounds/bank/phrases.txt
+
+Add the most frequent assistant replies stored in the Messages table:
+    python -m app.prerender --phrases app/sounds/bank/phrases.txt --mine 50
+
+Phrases whose text and voice settings did not change since the last run are skipped.
+"""
+import argparse
+import asyncio
+from collections import Counter
+from dotenv import load_dotenv
+load_dotenv()
+
+from .audio_processing import encode_reply_audio
+from .sound_bank import sound_bank, normalize_phrase
+from .tts_fanout import synthesize_reply
+from .tts_requests import send_azure_tts_request
+from .db import scan_user_sessions
+
+DEFAULT_CONCURRENCY = 4
+
+def read_phrase_file(path):
+    with open(path, "r", encoding="utf-8") as phrase_file:
+        return [line.strip() for line in phrase_file if line.strip() and not line.startswith("#")]
+
+def mine_frequent_replies(limit, min_count=2):
+    """Return up to `limit` assistant replies seen at least `min_count` times across all sessions."""
+    counter = Counter()
+    for _, messages in scan_user_sessions():
+        for message in messages:
+            content = normalize_phrase(message.get('content') or "")
+            if message.get('role') == "assistant" and content:
+                counter[content] += 1
+    return [phrase for phrase, count in counter.most_common(limit) if count >= min_count]
+
+async def render_phrase(text):
+    """Render `text` through the exact reply pipeline: chunked Azure TTS, amplification, MP3 encode."""
+    tts_audio_data = await synthesize_reply(text, send_azure_tts_request)
+    return await asyncio.get_running_loop().run_in_executor(None, encode_reply_audio, tts_audio_data)
+
+async def prerender_phrases(phrases, bank=sound_bank, concurrency=DEFAULT_CONCURRENCY, force=False):
+    """
+    Render the phrases missing from the bank, at most `concurrency` at a time.
+
+    :return: Dict with the rendered, skipped and failed phrase counts
+    """
+    stats = {"rendered": 0, "skipped": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def render(phrase):
+        if not force and bank.is_current(phrase):
+            stats["skipped"] += 1
+            return
+        async with semaphore:
+            try:
+                mp3_data = await render_phrase(phrase)
+            except Exception as e:
+                print(f"Failed to render '{phrase}': {e}")
+                stats["failed"] += 1
+                return
+        bank.store(phrase, mp3_data)
+        stats["rendered"] += 1
+        print(f"Rendered '{phrase}' ({len(mp3_data)} bytes)")
+
+    unique_phrases = list(dict.fromkeys(normalize_phrase(phrase) for phrase in phrases))
+    await asyncio.gather(*[render(phrase) for phrase in unique_phrases])
+    bank.save_manifest()
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-render phrases into the sound bank.")
+    parser.add_argument("--phrases", help="File with one phrase per line")
+    parser.add_argument("--mine", type=int, default=0, help="Also render the N most frequent assistant replies")
+    parser.add_argument("--min-count", type=int, default=2, help="Minimum occurrences of a mined reply")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Parallel TTS requests")
+    parser.add_argument("--force", action="store_true", help="Re-render phrases that are up to date")
+    args = parser.parse_args(argv)
+
+    phrases = read_phrase_file(args.phrases) if args.phrases else []
+    if args.mine:
+        phrases += mine_frequent_replies(args.mine, args.min_count)
+    if not phrases:
+        parser.error("nothing to render, pass --phrases and/or --mine")
+
+    stats = asyncio.run(prerender_phrases(phrases, concurrency=args.concurrency, force=args.force))
+    print(f"Rendered: {stats['rendered']}, up to date: {stats['skipped']}, failed: {stats['failed']}")
+
+if __name__ == '__main__':
+    main()
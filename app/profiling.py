@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Share of requests profiled, 0 disables sampling
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+# Whether a request may ask for a profile with "X-Buddy-Profile: 1", off in production
+PROFILE_HEADER_ENABLED = os.getenv("PROFILE_HEADER_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_HEADER = "x-buddy-profile"
+# Interval of the stack sampler
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", 0.005))
+# Where the profiles are written, only /tmp is writable in Lambda
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "profiles")
+# Allocation sites listed in the memory report
+PROFILE_TOP_ALLOCATIONS = 15
+
+# Decided once at import, so a disabled profiler costs the request nothing but this check
+PROFILING_ENABLED = PROFILE_SAMPLE_RATE > 0 or PROFILE_HEADER_ENABLED
+
+# Stacks of all threads and the tracemalloc state are process-wide, one profile runs at a time
+_profile_lock = threading.Lock()
+
+def wants_profile(headers):
+    if PROFILE_HEADER_ENABLED and headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    return random.random() < PROFILE_SAMPLE_RATE
+
+class StackSampler:
+    """
+    Samples the Python stacks of every other thread at a fixed interval.
+
+    The event loop thread shows CPU work of the pipeline (amplify, resampling) and
+    network waits (the selector), the executor threads show ffmpeg and database calls.
+    Each sample is weighted by the time since the previous one.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL_SECONDS):
+        self.interval = interval
+        # (thread name, stack of (function, file, first line) from the root) -> seconds
+        self.stacks = {}
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                key = (names.get(ident, str(ident)), tuple(reversed(stack)))
+                self.stacks[key] = self.stacks.get(key, 0.0) + weight
+                self.samples.append((key, weight))
+
+def _frame_label(frame):
+    name, file_name, line = frame
+    return f"{name} ({os.path.basename(file_name)}:{line})"
+
+def collapsed_stacks(sampler):
+    """Brendan Gregg's collapsed format ("thread;outer;inner microseconds"), for flamegraph.pl and speedscope."""
+    lines = []
+    for (thread_name, stack), seconds in sorted(sampler.stacks.items(), key=lambda item: -item[1]):
+        frames = ";".join([thread_name] + [_frame_label(frame) for frame in stack])
+        lines.append(f"{frames} {max(1, round(seconds * 1e6))}")
+    return "\n".join(lines) + "\n"
+
+def speedscope_profile(sampler, name):
+    """The samples in the speedscope file format, one sampled profile per thread."""
+    frames = []
+    frame_index = {}
+    profiles = {}
+    for (thread_name, stack), weight in sampler.samples:
+        indices = []
+        for frame in stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            indices.append(frame_index[frame])
+        profile = profiles.setdefault(thread_name, {
+            "type": "sampled", "name": thread_name, "unit": "seconds",
+            "startValue": 0, "endValue": 0, "samples": [], "weights": [],
+        })
+        profile["samples"].append(indices)
+        profile["weights"].append(weight)
+        profile["endValue"] += weight
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "buddy-profiler",
+        "shared": {"frames": frames},
+        "profiles": list(profiles.values()),
+    }
+
+def _allocation_report(snapshot, peak_bytes):
+    lines = [f"tracemalloc peak: {peak_bytes} bytes", "", "Largest live allocations at the end of the request:"]
+    for stat in snapshot.statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]:
+        lines.append(str(stat))
+    return "\n".join(lines) + "\n"
+
+def write_profile(name, sampler, peak_bytes, snapshot, directory=None):
+    """Write <name>.collapsed, <name>.speedscope.json and <name>.memory.txt, return their paths."""
+    directory = directory or PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    # The name carries the client's request id, which must not reach outside the directory
+    name = re.sub(r"[^A-Za-z0-9_-]", "_", name)
+    paths = {
+        "collapsed": os.path.join(directory, f"{name}.collapsed"),
+        "speedscope": os.path.join(directory, f"{name}.speedscope.json"),
+        "memory": os.path.join(directory, f"{name}.memory.txt"),
+    }
+    with open(paths["collapsed"], "w") as f:
+        f.write(collapsed_stacks(sampler))
+    with open(paths["speedscope"], "w") as f:
+        json.dump(speedscope_profile(sampler, name), f)
+    with open(paths["memory"], "w") as f:
+        f.write(_allocation_report(snapshot, peak_bytes))
+    return paths
+
+@contextmanager
+def profile_request(name, directory=None, interval=PROFILE_INTERVAL_SECONDS):
+    """
+    Profile the block: sampled stacks of all threads plus the tracemalloc peak.
+
+    Yields the StackSampler, or None when another profile is already running and the
+    block runs unprofiled.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        yield None
+        return
+    sampler = StackSampler(interval)
+    started_tracing = not tracemalloc.is_tracing()
+    try:
+        if started_tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        sampler.start()
+        try:
+            yield sampler
+        finally:
+            sampler.stop()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            try:
+                paths = write_profile(name, sampler, peak_bytes, snapshot, directory)
+                # Logged as a warning so the pointer to the files is never sampled out
+                logger.warning(
+                    "Profiled request %s: %.3f seconds, %d samples, peak %d bytes", name, sampler.duration,
+                    len(sampler.samples), peak_bytes, extra={"profile": paths, "peak_bytes": peak_bytes}
+                )
+            except OSError as e:
+                logger.error("Writing the profile of %s failed: %s", name, e)
+    finally:
+        _profile_lock.release()
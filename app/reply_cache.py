@@ -0,0 +1,132 @@
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from .metrics import register_metrics
+
+# Per-user ReplyCache setting of the prompt config:
+#   "off"      never use the cache
+#   "shared"   share replies with every user on the same system prompt
+#   "personal" only reuse the user's own replies
+REPLY_CACHE_MODES = ("off", "shared", "personal")
+# Setting of users without one in their prompt config
+REPLY_CACHE_DEFAULT_MODE = os.getenv("REPLY_CACHE_MODE", "off")
+
+REPLY_CACHE_TTL_SECONDS = float(os.getenv("REPLY_CACHE_TTL_SECONDS", 24 * 60 * 60))
+# Different replies collected for an utterance before the cache answers it, so kids do not hear the same line every time
+REPLY_CACHE_VARIANTS = int(os.getenv("REPLY_CACHE_VARIANTS", 3))
+REPLY_CACHE_MAX_ENTRIES = int(os.getenv("REPLY_CACHE_MAX_ENTRIES", 2048))
+# Only short utterances (greetings, names, goodnight) are worth caching
+REPLY_CACHE_MAX_UTTERANCE_CHARS = int(os.getenv("REPLY_CACHE_MAX_UTTERANCE_CHARS", 40))
+
+# Thai polite particles and fillers that do not change what the child asked
+TRAILING_PARTICLES = re.compile(r"(?:\s*(?:ครับ|คับ|ค่ะ|คะ|ค่า|จ้ะ|จ้า|นะ|น้า|จ๊ะ))+$")
+
+def normalize_utterance(text):
+    """Lower-case, drop punctuation, trailing polite particles and repeated spaces."""
+    # Thai vowel and tone marks are combining characters, only punctuation and symbols are dropped
+    text = "".join(" " if unicodedata.category(char)[0] in "PS" else char for char in text.lower())
+    text = " ".join(text.split())
+    return TRAILING_PARTICLES.sub("", text).strip()
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def context_fingerprint(messages):
+    """Fingerprint of the last assistant turn, "yes" after "want a story?" is not "yes" after "are you sad?"."""
+    for message in reversed(messages):
+        if message.get("role") == "assistant":
+            return _digest(normalize_utterance(message.get("content") or ""))
+    return ""
+
+def reply_cache_mode(setting):
+    return setting if setting in REPLY_CACHE_MODES else REPLY_CACHE_DEFAULT_MODE
+
+def reply_cache_key(user_id, transcription, system_prompt, messages, mode):
+    """Cache key of the turn, None when the turn must go to the LLM."""
+    utterance = normalize_utterance(transcription)
+    if mode == "off" or not utterance or len(utterance) > REPLY_CACHE_MAX_UTTERANCE_CHARS:
+        return None
+    scope = user_id if mode == "personal" else ""
+    return "|".join((scope, _digest(system_prompt), context_fingerprint(messages), utterance))
+
+class ReplyCache:
+    """
+    Replies to common utterances, answered without an LLM round-trip.
+
+    Every key collects up to `variants` distinct replies from real LLM calls; once it
+    has them all, lookups return a random pick. Replies expire after `ttl` seconds.
+    """
+
+    def __init__(self, ttl=REPLY_CACHE_TTL_SECONDS, variants=REPLY_CACHE_VARIANTS, max_entries=REPLY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.variants = variants
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Moving average of the LLM time of a miss, what each hit saves
+        self.llm_seconds = None
+        self.saved_seconds = 0.0
+        # key -> {reply: stored at}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """A random cached reply for `key`, or None when the LLM has to answer."""
+        with self._lock:
+            replies = self._fresh_replies(key)
+            if len(replies) < self.variants:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += self.llm_seconds or 0.0
+            self._entries.move_to_end(key)
+            return random.choice(replies)
+
+    def store(self, key, reply, llm_seconds=None):
+        """Record a reply the LLM gave for `key`, and how long it took."""
+        with self._lock:
+            if llm_seconds is not None:
+                self.llm_seconds = llm_seconds if self.llm_seconds is None else 0.9 * self.llm_seconds + 0.1 * llm_seconds
+            if not reply:
+                return
+            replies = self._entries.setdefault(key, {})
+            self._entries.move_to_end(key)
+            replies[reply] = time.time()
+            while len(replies) > self.variants:
+                del replies[min(replies, key=replies.get)]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+    def _fresh_replies(self, key):
+        replies = self._entries.get(key)
+        if not replies:
+            return []
+        now = time.time()
+        for reply, stored_at in list(replies.items()):
+            if now - stored_at > self.ttl:
+                del replies[reply]
+        return list(replies)
+
+reply_cache = ReplyCache()
+
+register_metrics("reply_cache", reply_cache.stats)
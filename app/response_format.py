@@ -0,0 +1,96 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from .audio_processing import (
+    encode_reply_audio, encode_pcm_audio, decode_mp3_to_pcm,
+    MP3_CODEC, IMA_ADPCM_CODEC, REPLY_SAMPLE_RATE, REPLY_BITRATE, DEFAULT_ADPCM_BLOCK_ALIGN
+)
+
+# Media types of the reply codecs, as used in the Accept header
+MEDIA_TYPES = {
+    MP3_CODEC: "audio/mpeg",
+    IMA_ADPCM_CODEC: "audio/x-ima-adpcm",
+}
+CODECS_BY_MEDIA_TYPE = {media_type: codec for codec, media_type in MEDIA_TYPES.items()}
+
+# Variants a device may ask for, kept small so the per-variant caches stay bounded
+SUPPORTED_SAMPLE_RATES = (8000, 16000, 22050, 24000)
+SUPPORTED_BITRATES = ('8k', '16k', '24k', '32k', '48k', '64k')
+
+CANNED_VARIANT_CACHE_SIZE = 64
+
+@dataclass(frozen=True)
+class ResponseFormat:
+    codec: str = MP3_CODEC
+    sample_rate: int = REPLY_SAMPLE_RATE
+    bitrate: str = REPLY_BITRATE
+
+    @property
+    def content_type(self):
+        if self.codec == IMA_ADPCM_CODEC:
+            return f"{MEDIA_TYPES[self.codec]}; rate={self.sample_rate}; block-align={DEFAULT_ADPCM_BLOCK_ALIGN}"
+        return MEDIA_TYPES[self.codec]
+
+    def encode(self, tts_pcm_data, amplify=True):
+        """Amplify and encode TTS PCM in this format."""
+        return encode_reply_audio(
+            tts_pcm_data, amplify=amplify, codec=self.codec, sample_rate=self.sample_rate, bitrate=self.bitrate
+        )
+
+DEFAULT_RESPONSE_FORMAT = ResponseFormat()
+
+def parse_response_format(value):
+    """
+    Parse an Accept-style list, e.g. "audio/x-ima-adpcm; rate=16000, audio/mpeg; rate=16000; bitrate=16k".
+
+    :return: The first supported ResponseFormat in the list, or None
+    """
+    if not value:
+        return None
+
+    for media_range in value.split(","):
+        media_type, *parameters = [part.strip() for part in media_range.split(";")]
+        codec = CODECS_BY_MEDIA_TYPE.get(media_type.lower())
+        if codec is None:
+            continue
+
+        options = dict(part.split("=", 1) for part in parameters if "=" in part)
+        try:
+            sample_rate = int(options.get("rate", REPLY_SAMPLE_RATE))
+        except ValueError:
+            continue
+        bitrate = options.get("bitrate", REPLY_BITRATE).lower()
+        if sample_rate in SUPPORTED_SAMPLE_RATES and bitrate in SUPPORTED_BITRATES:
+            return ResponseFormat(codec=codec, sample_rate=sample_rate, bitrate=bitrate)
+    return None
+
+# (clip name, format) -> encoded clip
+_canned_variants = OrderedDict()
+
+async def transcode_canned_audio(name, mp3_data, response_format):
+    """
+    Convert a canned MP3 clip (say again, busy, sound bank phrases) to the requested format.
+
+    Clips are stored as default-format MP3; other variants are transcoded once and cached.
+    """
+    if response_format == DEFAULT_RESPONSE_FORMAT:
+        return mp3_data
+
+    key = (name, response_format)
+    encoded = _canned_variants.get(key)
+    if encoded is None:
+        loop = asyncio.get_running_loop()
+        encoded = await loop.run_in_executor(None, _transcode, mp3_data, response_format)
+        _canned_variants[key] = encoded
+        while len(_canned_variants) > CANNED_VARIANT_CACHE_SIZE:
+            _canned_variants.popitem(last=False)
+    else:
+        _canned_variants.move_to_end(key)
+    return encoded
+
+def _transcode(mp3_data, response_format):
+    pcm_data = decode_mp3_to_pcm(mp3_data, sample_rate=response_format.sample_rate)
+    return encode_pcm_audio(
+        pcm_data, codec=response_format.codec, sample_rate=response_format.sample_rate,
+        bitrate=response_format.bitrate, source_rate=response_format.sample_rate
+    )
@@ -0,0 +1,134 @@
+import os
+import threading
+from collections import OrderedDict
+from .conversation import Conversation, Message, timestamp_to_number
+from .metrics import register_metrics
+
+# Memory budget of the cached sessions, 0 keeps only the versions (Lambda)
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", 0))
+# Versions are a few bytes each, they are kept for far more users than full sessions
+SESSION_VERSION_MAX_ENTRIES = int(os.getenv("SESSION_VERSION_MAX_ENTRIES", 10000))
+
+# Rough per-message overhead of the slotted Message, its float timestamp and list slot
+MESSAGE_OVERHEAD_BYTES = 120
+
+def session_size(messages):
+    """Approximate memory held by a message list."""
+    return sum(len((message.get("content") or "").encode("utf-8")) + MESSAGE_OVERHEAD_BYTES for message in messages)
+
+def message_key(message):
+    if isinstance(message, Message):
+        return (message.role, message.content, message.timestamp)
+    return (message.get("role"), message.get("content"), timestamp_to_number(message.get("timestamp")))
+
+def merge_sessions(stored_messages, messages):
+    """
+    Merge a session written concurrently by another worker with ours.
+
+    Sessions only ever grow, so our messages that the stored session lacks are the
+    turns added since we read it. They are appended after the stored ones.
+    """
+    merged = Conversation.from_messages(stored_messages)
+    stored_keys = {message_key(message) for message in merged}
+    for message in Conversation.from_messages(messages):
+        if message_key(message) not in stored_keys:
+            merged = merged.appended(message)
+    return merged
+
+class SessionCache:
+    """
+    Write-through cache of conversation sessions with LRU eviction by bytes.
+
+    Every cached session carries the version it was read or written at. Writes are
+    conditional on that version, so a session changed by another worker or Lambda
+    instance is detected (and merged) instead of overwritten. Versions outlive the
+    evicted sessions so the conditional write works even without cached messages.
+    """
+
+    def __init__(self, max_bytes=SESSION_CACHE_MAX_BYTES, max_versions=SESSION_VERSION_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_versions = max_versions
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.conflicts = 0
+        # user_id -> (messages, size)
+        self._sessions = OrderedDict()
+        self._versions = OrderedDict()
+        # The write-behind writer updates sessions from executor threads
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Cached messages of the user, or None on a miss."""
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._sessions.move_to_end(user_id)
+            # Conversations are immutable views, callers can share the cached one
+            return entry[0]
+
+    def version(self, user_id):
+        """Version the user's session was last seen at, None when unknown."""
+        with self._lock:
+            return self._versions.get(user_id)
+
+    def put(self, user_id, messages, version):
+        with self._lock:
+            self._versions[user_id] = version
+            self._versions.move_to_end(user_id)
+            while len(self._versions) > self.max_versions:
+                evicted_user_id, _ = self._versions.popitem(last=False)
+                self._drop(evicted_user_id)
+
+            self._drop(user_id)
+            size = session_size(messages)
+            if size > self.max_bytes:
+                return
+            self._sessions[user_id] = (Conversation.from_messages(messages), size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._sessions.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._versions.pop(user_id, None)
+            self._drop(user_id)
+
+    def record_conflict(self):
+        with self._lock:
+            self.conflicts += 1
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._versions.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._sessions),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "conflicts": self.conflicts,
+            }
+
+    def _drop(self, user_id):
+        entry = self._sessions.pop(user_id, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+session_cache = SessionCache()
+
+register_metrics("session_cache", session_cache.stats)
@@ -0,0 +1,48 @@
+import json
+import zlib
+from .conversation import Conversation, Message, timestamp_to_number
+
+# Version byte written in front of every blob, bump it when the layout changes
+CODEC_VERSION = 1
+ZLIB_LEVEL = 6
+
+# Roles are stored as their index to keep the blob small
+ROLES = ("user", "assistant", "system")
+
+def encode_messages(messages):
+    """
+    Pack the conversation history into a compressed binary blob.
+
+    Layout (version 1): one version byte followed by zlib-compressed compact JSON,
+    a list of [role_index, content, timestamp] with numeric timestamps.
+
+    :param messages: Conversation, or list of {"role", "content", "timestamp"} dicts
+    :return: The encoded blob (bytes)
+    """
+    rows = []
+    for message in Conversation.from_messages(messages):
+        role = message.role
+        rows.append([ROLES.index(role) if role in ROLES else role, message.content, message.timestamp])
+    payload = json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return bytes([CODEC_VERSION]) + zlib.compress(payload, ZLIB_LEVEL)
+
+def decode_messages(blob):
+    """
+    Unpack a blob written by encode_messages.
+
+    :param blob: bytes, or a boto3 Binary as returned by DynamoDB
+    :return: Conversation of the stored messages
+    """
+    blob = bytes(getattr(blob, "value", blob))
+    if not blob:
+        return Conversation()
+
+    version = blob[0]
+    if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported session codec version: {version}")
+
+    rows = json.loads(zlib.decompress(blob[1:]).decode("utf-8"))
+    return Conversation(
+        Message(ROLES[role] if isinstance(role, int) else role, content, timestamp_to_number(timestamp))
+        for role, content, timestamp in rows
+    )
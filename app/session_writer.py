@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+from .background import run_in_background
+from .conversation import Conversation
+from .metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# "sync" writes the session before the response is returned,
+# "write_behind" persists it after the response has been handed off
+SESSION_WRITE_MODE = os.getenv("SESSION_WRITE_MODE", "sync")
+
+class SessionWriter:
+    """
+    Per-user ordered write-behind queue for conversation sessions.
+
+    Every write stores the full message list, so only the newest snapshot of a user
+    has to reach the database: a snapshot submitted while an older one is being
+    written replaces any queued one. One worker per user writes the snapshots in
+    submission order, so a slow write can never land after a newer one.
+
+    Workers run as background tasks, which the Lambda handler and the FastAPI
+    shutdown hook drain before the process freezes or exits.
+    """
+
+    def __init__(self):
+        self._queued = {}
+        self._writing = {}
+        self._workers = {}
+        self.submitted = 0
+        self.coalesced = 0
+        self.written = 0
+        self.failed = 0
+
+    def submit(self, user_id, messages, write):
+        """Queue `write(user_id, messages)` behind the pending writes of the user."""
+        self.submitted += 1
+        if user_id in self._queued:
+            self.coalesced += 1
+        self._queued[user_id] = (Conversation.from_messages(messages), write)
+
+        worker = self._workers.get(user_id)
+        if worker is None or worker.done() or worker.get_loop() is not asyncio.get_running_loop():
+            self._workers[user_id] = run_in_background(self._write_user(user_id))
+
+    def pending_session(self, user_id):
+        """The newest not yet persisted messages of the user, or None when everything is written."""
+        if user_id in self._queued:
+            return self._queued[user_id][0]
+        if user_id in self._writing:
+            return self._writing[user_id]
+        return None
+
+    def stats(self):
+        return {
+            "mode": SESSION_WRITE_MODE,
+            "pending": len(self._queued) + len(self._writing),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+    async def _write_user(self, user_id):
+        loop = asyncio.get_running_loop()
+        try:
+            while user_id in self._queued:
+                messages, write = self._queued.pop(user_id)
+                self._writing[user_id] = messages
+                try:
+                    # boto3 blocks, keep the loop free for the requests in flight
+                    await loop.run_in_executor(None, write, user_id, messages)
+                    self.written += 1
+                except Exception as e:
+                    logger.error("Session write for %s failed: %s", user_id, e)
+                    self.failed += 1
+                finally:
+                    self._writing.pop(user_id, None)
+        finally:
+            if self._workers.get(user_id) is asyncio.current_task():
+                del self._workers[user_id]
+
+session_writer = SessionWriter()
+
+register_metrics("session_writes", session_writer.stats)
@@ -0,0 +1,263 @@
+"""
+Shadow traffic: mirror a sample of real STT, LLM and TTS calls to candidate backends.
+
+The candidates run in the background after the primary call returned, so they never
+delay the reply. Each mirrored call is recorded with its latency, the primary's latency
+and how its output compares, and the records are summarized per stage and backend.
+
+    python -m app.shadow shadow.jsonl      print the comparison report of a records file
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import deque
+from .background import run_in_background
+from .logger import LOG_CONVERSATION
+from .metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Share of primary calls mirrored, 0 disables shadow traffic
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", 0))
+# Candidate backends per stage, comma separated names of CANDIDATE_BACKENDS
+SHADOW_BACKENDS = {
+    "stt": os.getenv("SHADOW_STT_BACKENDS", ""),
+    "llm": os.getenv("SHADOW_LLM_BACKENDS", ""),
+    "tts": os.getenv("SHADOW_TTS_BACKENDS", ""),
+}
+# Mirrored calls in flight at most, a sampled call beyond this is skipped
+SHADOW_MAX_IN_FLIGHT = int(os.getenv("SHADOW_MAX_IN_FLIGHT", 4))
+SHADOW_TIMEOUT_SECONDS = float(os.getenv("SHADOW_TIMEOUT_SECONDS", 30))
+# JSON lines file of every record, empty keeps them in memory only
+SHADOW_RECORDS_PATH = os.getenv("SHADOW_RECORDS_PATH", "shadow.jsonl")
+# Recent records summarized in GET /metrics
+SHADOW_MAX_RECORDS = int(os.getenv("SHADOW_MAX_RECORDS", 2000))
+
+# Lambda returns the reply only when the handler returns, after the background work was
+# drained, so mirrored calls would delay it there. Shadow traffic runs in the server only.
+SHADOW_ENABLED = SHADOW_SAMPLE_RATE > 0 and not os.getenv("AWS_LAMBDA_FUNCTION_NAME")
+
+# Bytes per second of the 24 kHz 16-bit mono PCM both TTS backends return
+TTS_BYTES_PER_SECOND = 24000 * 2
+
+def candidate_backends():
+    """Request functions by backend name, imported on demand so unused providers cost nothing."""
+    from .stt_requests import send_whisper_stt_request, send_deepgram_stt_request
+    from .llm_requests import send_groq_request
+    from .tts_requests import send_openai_tts_request
+    # send_float16_request is synchronous (and unfinished), it cannot be mirrored off the loop
+    return {
+        "stt": {"openai_stt": send_whisper_stt_request, "deepgram_stt": send_deepgram_stt_request},
+        "llm": {"groq": send_groq_request},
+        "tts": {"openai_tts": send_openai_tts_request},
+    }
+
+def configured_candidates(backends=SHADOW_BACKENDS):
+    available = candidate_backends()
+    candidates = {}
+    for stage, names in backends.items():
+        for name in filter(None, (name.strip() for name in names.split(","))):
+            if name not in available[stage]:
+                raise ValueError(f"Unknown {stage} shadow backend: {name}")
+            candidates.setdefault(stage, {})[name] = available[stage][name]
+    return candidates
+
+def character_error_rate(reference, hypothesis):
+    """Edit distance between the transcriptions over the reference length, by character since Thai has no spaces."""
+    reference = reference.replace(" ", "")
+    hypothesis = hypothesis.replace(" ", "")
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_char in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_char in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_char != hyp_char)))
+        previous = current
+    return previous[-1] / len(reference)
+
+def stt_text(output):
+    return (output or {}).get("text", "").strip()
+
+def compare_outputs(stage, primary_output, output):
+    """Fields describing the candidate's output next to the primary's."""
+    if stage == "stt":
+        text = stt_text(output)
+        fields = {"chars": len(text), "cer": round(character_error_rate(stt_text(primary_output), text), 4)}
+    elif stage == "llm":
+        text = output or ""
+        fields = {"chars": len(text), "primary_chars": len(primary_output or "")}
+    else:
+        text = None
+        fields = {
+            "audio_seconds": round(len(output or b"") / TTS_BYTES_PER_SECOND, 3),
+            "primary_audio_seconds": round(len(primary_output or b"") / TTS_BYTES_PER_SECOND, 3),
+        }
+    # What the child said and the replies are personal, kept only where conversations are logged in full
+    if text is not None and LOG_CONVERSATION == "full":
+        fields["output"] = text
+    return fields
+
+class ShadowRunner:
+    """Mirror sampled primary calls to the candidate backends in the background and record the outcomes."""
+
+    def __init__(self, candidates=None, sample_rate=SHADOW_SAMPLE_RATE, max_in_flight=SHADOW_MAX_IN_FLIGHT,
+                 timeout=SHADOW_TIMEOUT_SECONDS, records_path=SHADOW_RECORDS_PATH, max_records=SHADOW_MAX_RECORDS):
+        """
+        :param candidates: {stage: {backend name: async request function}}, configured from the environment by default
+        """
+        self.candidates = candidates if candidates is not None else configured_candidates()
+        self.sample_rate = sample_rate
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.records_path = records_path
+        self.records = deque(maxlen=max_records)
+        self.in_flight = 0
+        self.mirrored = 0
+        self.skipped = 0
+
+    def mirror(self, stage, primary, request, primary_output, primary_seconds):
+        """
+        Schedule the candidates of `stage` on the primary call's input, when this call is sampled.
+
+        :param primary: Name of the primary backend
+        :param request: Input of the primary call, passed to each candidate as is
+        """
+        backends = self.candidates.get(stage)
+        if not backends or random.random() >= self.sample_rate:
+            return
+        if self.in_flight >= self.max_in_flight:
+            self.skipped += 1
+            return
+        self.in_flight += 1
+        self.mirrored += 1
+        run_in_background(self._run(stage, primary, backends, request, primary_output, primary_seconds))
+
+    def report(self):
+        return shadow_report(self.records)
+
+    def stats(self):
+        return {
+            "mirrored": self.mirrored,
+            "skipped": self.skipped,
+            "in_flight": self.in_flight,
+            "report": self.report(),
+        }
+
+    async def _run(self, stage, primary, backends, request, primary_output, primary_seconds):
+        try:
+            records = await asyncio.gather(*(
+                self._call(stage, primary, name, send, request, primary_output, primary_seconds)
+                for name, send in backends.items()
+            ))
+            self.records.extend(records)
+            if self.records_path:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, records)
+        finally:
+            self.in_flight -= 1
+
+    async def _call(self, stage, primary, name, send, request, primary_output, primary_seconds):
+        record = {
+            "time": time.time(), "stage": stage, "backend": name,
+            "primary": primary, "primary_seconds": round(primary_seconds, 4),
+        }
+        start = time.perf_counter()
+        try:
+            output = await asyncio.wait_for(send(request), self.timeout)
+            record["seconds"] = round(time.perf_counter() - start, 4)
+            record.update(compare_outputs(stage, primary_output, output))
+        except Exception as e:
+            record["seconds"] = round(time.perf_counter() - start, 4)
+            record["error"] = type(e).__name__
+        return record
+
+    def _write(self, records):
+        try:
+            with open(self.records_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error("Writing shadow records failed: %s", e)
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def shadow_report(records):
+    """
+    Per stage and candidate backend: latency next to the primary's on the same calls, errors and output agreement.
+
+    :return: {stage: {backend: summary}}
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(record["stage"], {}).setdefault(record["backend"], []).append(record)
+
+    report = {}
+    for stage, backends in groups.items():
+        for backend, backend_records in backends.items():
+            succeeded = [record for record in backend_records if "error" not in record]
+            summary = {"calls": len(backend_records), "errors": len(backend_records) - len(succeeded)}
+            if succeeded:
+                seconds = [record["seconds"] for record in succeeded]
+                primary_seconds = [record["primary_seconds"] for record in succeeded]
+                summary.update({
+                    "primary": succeeded[0]["primary"],
+                    "p50_seconds": _percentile(seconds, 0.5),
+                    "p95_seconds": _percentile(seconds, 0.95),
+                    "primary_p50_seconds": _percentile(primary_seconds, 0.5),
+                    "primary_p95_seconds": _percentile(primary_seconds, 0.95),
+                    # Share of the calls the candidate answered faster than the primary did
+                    "faster_share": round(sum(1 for record in succeeded
+                                              if record["seconds"] < record["primary_seconds"]) / len(succeeded), 3),
+                })
+                if stage == "stt":
+                    summary["mean_cer"] = round(sum(record["cer"] for record in succeeded) / len(succeeded), 4)
+            report.setdefault(stage, {})[backend] = summary
+    return report
+
+def _format_report(report):
+    lines = [f"{'stage':<5} {'backend':<14} {'calls':>6} {'errors':>6} | {'p50 s':>7} {'p95 s':>7} | "
+             f"{'primary':<10} {'p50 s':>7} {'p95 s':>7} | {'faster':>6} {'CER':>6}"]
+    for stage, backends in sorted(report.items()):
+        for backend, summary in sorted(backends.items()):
+            line = f"{stage:<5} {backend:<14} {summary['calls']:>6} {summary['errors']:>6} | "
+            if "p50_seconds" in summary:
+                cer = f"{summary['mean_cer']:>6.3f}" if "mean_cer" in summary else f"{'':>6}"
+                line += (f"{summary['p50_seconds']:>7.3f} {summary['p95_seconds']:>7.3f} | {summary['primary']:<10} "
+                         f"{summary['primary_p50_seconds']:>7.3f} {summary['primary_p95_seconds']:>7.3f} | "
+                         f"{summary['faster_share']:>6.0%} {cer}")
+            lines.append(line)
+    return "\n".join(lines)
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+shadow_runner = ShadowRunner() if SHADOW_ENABLED else None
+
+if shadow_runner is not None:
+    register_metrics("shadow", shadow_runner.stats)
+
+def mirror(stage, primary, request, primary_output, primary_seconds):
+    """Mirror a primary call to the configured candidates, a no-op unless shadow traffic is enabled."""
+    if shadow_runner is not None:
+        shadow_runner.mirror(stage, primary, request, primary_output, primary_seconds)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare shadow backends with the primary ones.")
+    parser.add_argument("records", nargs="?", default=SHADOW_RECORDS_PATH, help="JSON lines file written by the server")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = shadow_report(read_records(args.records))
+    print(json.dumps(report, indent=2) if args.json else _format_report(report))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
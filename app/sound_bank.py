@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+from .audio_processing import REPLY_AMPLIFY_FACTOR, REPLY_SAMPLE_RATE, REPLY_BITRATE
+from .tts_requests import azure_tts_voice_settings
+
+SOUND_BANK_DIR = os.getenv(
+    "SOUND_BANK_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "sounds", "bank")
+)
+MANIFEST_FILE = "manifest.json"
+
+def normalize_phrase(text):
+    return " ".join(text.split())
+
+def phrase_fingerprint(text):
+    """Hash of everything that changes the rendered audio: the text, the voice and the reply encoding."""
+    settings = {
+        "text": normalize_phrase(text),
+        "voice": azure_tts_voice_settings(),
+        "amplify_factor": REPLY_AMPLIFY_FACTOR,
+        "sample_rate": REPLY_SAMPLE_RATE,
+        "bitrate": REPLY_BITRATE,
+    }
+    serialized = json.dumps(settings, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+def phrase_file_name(text):
+    return hashlib.sha256(normalize_phrase(text).encode("utf-8")).hexdigest()[:16] + ".mp3"
+
+class SoundBank:
+    """
+    Pre-rendered MP3 replies for fixed and frequent phrases.
+
+    The manifest maps each normalized phrase to its file and fingerprint. Entries whose
+    fingerprint no longer matches the current voice settings are ignored until re-rendered.
+    """
+
+    def __init__(self, directory=SOUND_BANK_DIR):
+        self.directory = directory
+        self._manifest = None
+        self._audio = {}
+
+    def manifest(self):
+        if self._manifest is None:
+            manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+                    self._manifest = json.load(manifest_file)
+            except FileNotFoundError:
+                self._manifest = {"phrases": {}}
+        return self._manifest
+
+    def lookup(self, text):
+        """Return the pre-rendered MP3 of `text`, or None when it is not (or no longer) in the bank."""
+        phrase = normalize_phrase(text)
+        entry = self.manifest()["phrases"].get(phrase)
+        if entry is None or entry["fingerprint"] != phrase_fingerprint(phrase):
+            return None
+
+        audio = self._audio.get(phrase)
+        if audio is None:
+            with open(os.path.join(self.directory, entry["file"]), "rb") as mp3_file:
+                audio = mp3_file.read()
+            self._audio[phrase] = audio
+        return audio
+
+    def is_current(self, text):
+        phrase = normalize_phrase(text)
+        entry = self.manifest()["phrases"].get(phrase)
+        return (entry is not None
+                and entry["fingerprint"] == phrase_fingerprint(phrase)
+                and os.path.exists(os.path.join(self.directory, entry["file"])))
+
+    def store(self, text, mp3_data):
+        """Write the rendered audio of `text` and record it in the in-memory manifest."""
+        phrase = normalize_phrase(text)
+        file_name = phrase_file_name(phrase)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, file_name), "wb") as mp3_file:
+            mp3_file.write(mp3_data)
+
+        self.manifest()["phrases"][phrase] = {"file": file_name, "fingerprint": phrase_fingerprint(phrase)}
+        self._audio[phrase] = mp3_data
+
+    def save_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(manifest_path, "w", encoding="utf-8") as manifest_file:
+            json.dump(self.manifest(), manifest_file, ensure_ascii=False, indent=2, sort_keys=True)
+
+sound_bank = SoundBank()
+
+def get_prerendered_audio(text):
+    return sound_bank.lookup(text)
@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from .conversation import Conversation, Message
+from .storage import Storage, StorageError, SessionConflict
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "buddy.db")
+# How long a writer waits for the database lock held by another connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    summary TEXT,
+    summary_until REAL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    user_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp,
+    PRIMARY KEY (user_id, position)
+);
+CREATE INDEX IF NOT EXISTS messages_user_timestamp ON messages (user_id, timestamp);
+CREATE TABLE IF NOT EXISTS prompts (
+    user_id TEXT PRIMARY KEY,
+    system_prompt TEXT,
+    active_message_limit INTEGER,
+    daily_rate_limit INTEGER,
+    whitelist INTEGER,
+    response_format TEXT,
+    reply_cache TEXT,
+    updated_date TEXT
+);
+"""
+
+# Column of each prompt field
+PROMPT_COLUMNS = {
+    "SystemPrompt": "system_prompt",
+    "ActiveMessageLimit": "active_message_limit",
+    "DailyRateLimit": "daily_rate_limit",
+    "Whitelist": "whitelist",
+    "ResponseFormat": "response_format",
+    "ReplyCache": "reply_cache",
+    "UpdatedDate": "updated_date",
+}
+
+def thread_connection(local, path):
+    """The calling thread's connection to the database at `path`, kept in the threading.local `local`."""
+    connection = getattr(local, "connection", None)
+    if connection is None:
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+        connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        local.connection = connection
+    return connection
+
+@contextmanager
+def sqlite_errors():
+    """Raise SQLite errors as the StorageError the callers of a store handle."""
+    try:
+        yield
+    except sqlite3.Error as e:
+        raise StorageError(str(e))
+
+class SQLiteStorage(Storage):
+    """
+    Embedded store for self-hosted deployments.
+
+    One row per message, indexed by user and timestamp. The database runs in WAL mode
+    so readers never wait for the writer. Connections are per thread because the
+    write-behind writer stores sessions from executor threads.
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with sqlite_errors():
+            connection = self._connection()
+            connection.executescript(SCHEMA)
+            # Databases created before a prompt field existed get its column added
+            existing = {row[1] for row in connection.execute("PRAGMA table_info(prompts)")}
+            for column in PROMPT_COLUMNS.values():
+                if column not in existing:
+                    connection.execute(f"ALTER TABLE prompts ADD COLUMN {column}")
+
+    def read_session(self, user_id):
+        # One read transaction, so the version matches the messages
+        with self._transaction(write=False) as connection:
+            row = connection.execute("SELECT version FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            rows = connection.execute(
+                "SELECT role, content, timestamp FROM messages WHERE user_id = ? ORDER BY position", (user_id,)
+            ).fetchall()
+        messages = Conversation(Message(role, content, timestamp) for role, content, timestamp in rows)
+        return messages, row[0] if row else 0
+
+    def write_session(self, user_id, messages, expected_version=None):
+        with self._transaction() as connection:
+            row = connection.execute("SELECT version FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            version = row[0] if row else 0
+            if expected_version is not None and expected_version != version:
+                raise SessionConflict(user_id)
+
+            connection.execute(
+                "INSERT INTO sessions (user_id, version) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET version = excluded.version",
+                (user_id, version + 1)
+            )
+            messages = Conversation.from_messages(messages)
+            start = self._stored_prefix(connection, user_id, messages) if expected_version is not None else 0
+            if start == 0:
+                connection.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+            connection.executemany(
+                "INSERT INTO messages (user_id, position, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [
+                    # Numeric timestamps are stored as REAL so the (user_id, timestamp) index orders them by time
+                    (user_id, position, messages[position].role, messages[position].content or "",
+                     messages[position].timestamp)
+                    for position in range(start, len(messages))
+                ]
+            )
+        return version + 1
+
+    def _stored_prefix(self, connection, user_id, messages):
+        """
+        Number of leading `messages` already stored, 0 when the stored rows are not a prefix of them.
+
+        Sessions only grow, so a write at the version it read just appends the new turns. Only
+        the last stored row is compared, through the primary key, to keep a write independent
+        of the history's length.
+        """
+        row = connection.execute(
+            "SELECT position, role, content, timestamp FROM messages WHERE user_id = ? ORDER BY position DESC LIMIT 1",
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            return 0
+        position, role, content, timestamp = row
+        count = position + 1
+        if count > len(messages):
+            return 0
+        last = messages[count - 1]
+        if (last.role, last.content or "", last.timestamp) != (role, content, timestamp):
+            return 0
+        return count
+
+    def scan_sessions(self):
+        with sqlite_errors():
+            user_ids = [row[0] for row in self._connection().execute("SELECT user_id FROM sessions ORDER BY user_id")]
+        for user_id in user_ids:
+            yield user_id, self.read_session(user_id)[0]
+
+    def read_summary(self, user_id):
+        with sqlite_errors():
+            row = self._connection().execute(
+                "SELECT summary, summary_until FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def write_summary(self, user_id, summary, summary_until):
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT INTO sessions (user_id, summary, summary_until) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET summary = excluded.summary, summary_until = excluded.summary_until",
+                (user_id, summary, summary_until)
+            )
+
+    def read_prompt(self, user_id):
+        columns = ", ".join(PROMPT_COLUMNS.values())
+        with sqlite_errors():
+            row = self._connection().execute(
+                f"SELECT {columns} FROM prompts WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        fields = {field: value for field, value in zip(PROMPT_COLUMNS, row) if value is not None}
+        if "Whitelist" in fields:
+            fields["Whitelist"] = bool(fields["Whitelist"])
+        return fields
+
+    def write_prompt(self, user_id, fields):
+        columns = ", ".join(PROMPT_COLUMNS.values())
+        placeholders = ", ".join("?" for _ in PROMPT_COLUMNS)
+        with self._transaction() as connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO prompts (user_id, {columns}) VALUES (?, {placeholders})",
+                (user_id, *(fields.get(field) for field in PROMPT_COLUMNS))
+            )
+
+    def _connection(self):
+        return thread_connection(self._local, self.path)
+
+    @contextmanager
+    def _transaction(self, write=True):
+        with sqlite_errors():
+            connection = self._connection()
+            # Writers take the lock up front, so the version check and the write cannot interleave
+            connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
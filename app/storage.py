@@ -0,0 +1,116 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from .conversation import Conversation
+
+# "dynamodb" (AWS), "sqlite" (single self-hosted box) or "memory" (tests, local runs)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "dynamodb")
+
+# Fields of a user's prompt config, named as stored in the UserPrompts table
+PROMPT_FIELDS = (
+    "SystemPrompt", "ActiveMessageLimit", "DailyRateLimit", "Whitelist", "ResponseFormat", "ReplyCache", "UpdatedDate"
+)
+
+class StorageError(Exception):
+    """Raised by a backend when the underlying store fails."""
+
+class SessionConflict(Exception):
+    """Raised when the stored session changed since it was read."""
+
+class Storage(ABC):
+    """
+    Interface of the session and prompt stores behind app.db.
+
+    Sessions carry a version that every write bumps. A write with an expected version
+    only succeeds while the stored session is still at that version (0: no session yet).
+    """
+
+    @abstractmethod
+    def read_session(self, user_id):
+        """:return: (messages, version) of the user, ([], 0) when there is none"""
+
+    @abstractmethod
+    def write_session(self, user_id, messages, expected_version=None):
+        """
+        Replace the user's messages.
+
+        :param expected_version: Version the messages were based on, None writes unconditionally
+        :raises SessionConflict: When the stored version is not the expected one
+        :return: The new version
+        """
+
+    @abstractmethod
+    def scan_sessions(self):
+        """Yield (user_id, messages) for every stored session."""
+
+    @abstractmethod
+    def read_summary(self, user_id):
+        """:return: (summary, summary_until) of the user, (None, None) when there is none"""
+
+    @abstractmethod
+    def write_summary(self, user_id, summary, summary_until):
+        """Store the rolling summary and the timestamp of the last message it covers."""
+
+    @abstractmethod
+    def read_prompt(self, user_id):
+        """:return: Dict of the stored PROMPT_FIELDS, or None for an unknown user"""
+
+    @abstractmethod
+    def write_prompt(self, user_id, fields):
+        """Replace the prompt config of the user with `fields`."""
+
+class MemoryStorage(Storage):
+    """Process-local store, for tests and local runs without a database."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._summaries = {}
+        self._prompts = {}
+        self._lock = threading.Lock()
+
+    def read_session(self, user_id):
+        with self._lock:
+            # Stored conversations are immutable views, no copy needed
+            return self._sessions.get(user_id, (Conversation(), 0))
+
+    def write_session(self, user_id, messages, expected_version=None):
+        with self._lock:
+            _, version = self._sessions.get(user_id, ([], 0))
+            if expected_version is not None and expected_version != version:
+                raise SessionConflict(user_id)
+            self._sessions[user_id] = (Conversation.from_messages(messages), version + 1)
+            return version + 1
+
+    def scan_sessions(self):
+        with self._lock:
+            sessions = [(user_id, messages) for user_id, (messages, _) in self._sessions.items()]
+        yield from sessions
+
+    def read_summary(self, user_id):
+        with self._lock:
+            return self._summaries.get(user_id, (None, None))
+
+    def write_summary(self, user_id, summary, summary_until):
+        with self._lock:
+            self._summaries[user_id] = (summary, summary_until)
+
+    def read_prompt(self, user_id):
+        with self._lock:
+            fields = self._prompts.get(user_id)
+            return dict(fields) if fields is not None else None
+
+    def write_prompt(self, user_id, fields):
+        with self._lock:
+            self._prompts[user_id] = dict(fields)
+
+def create_storage(backend=STORAGE_BACKEND):
+    # Backends are imported on demand so e.g. the SQLite deployment does not need boto3 credentials
+    if backend == "dynamodb":
+        from .dynamodb_storage import DynamoDBStorage
+        return DynamoDBStorage()
+    if backend == "sqlite":
+        from .sqlite_storage import SQLiteStorage
+        return SQLiteStorage()
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
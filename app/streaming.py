@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+from .audio_processing import amplify_pcm_audio, REPLY_AMPLIFY_FACTOR, TTS_SAMPLE_RATE
+from .background import run_in_background
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from ffmpeg at a time, about 1 s of 32k MP3
+STREAM_READ_BYTES = int(os.getenv("STREAM_READ_BYTES", 4096))
+
+async def encode_mp3_stream(pcm_segments, sample_rate, bitrate, amplify=True, source_rate=TTS_SAMPLE_RATE):
+    """
+    Encode PCM segments into one MP3 stream, yielding the MP3 bytes as ffmpeg writes them.
+
+    One ffmpeg process encodes all segments, so the stream has a single header and no
+    gaps between segments. Segments are fed while earlier ones are being encoded.
+
+    :param pcm_segments: Async iterator of mono 16-bit PCM at `source_rate`
+    """
+    output_args = ['-ar', str(sample_rate)] if sample_rate != source_rate else []
+    process = await asyncio.create_subprocess_exec(
+        # Raw PCM needs no probing, by default ffmpeg would wait for seconds of input before encoding
+        'ffmpeg', '-y', '-probesize', '32', '-analyzeduration', '0',
+        '-f', 's16le', '-ar', str(source_rate), '-ac', '1', '-i', 'pipe:0',
+        *output_args, '-b:a', bitrate, '-f', 'mp3', '-flush_packets', '1', 'pipe:1',
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+
+    async def feed():
+        try:
+            async for pcm_data in pcm_segments:
+                if amplify:
+                    pcm_data = amplify_pcm_audio(pcm_data, factor=REPLY_AMPLIFY_FACTOR)
+                process.stdin.write(pcm_data)
+                await process.stdin.drain()
+        finally:
+            process.stdin.close()
+
+    feeder = asyncio.ensure_future(feed())
+    try:
+        while True:
+            chunk = await process.stdout.read(STREAM_READ_BYTES)
+            if not chunk:
+                break
+            yield chunk
+        await feeder
+        await process.wait()
+    finally:
+        if not feeder.done():
+            feeder.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+class StreamedAudio:
+    """
+    Reply audio that is still being produced, used as the body of a streamed Response.
+
+    Production starts right away in the background, independently of the readers.
+    Every reader iterates over all chunks from the start, so a retry joining the
+    request (or replaying it from the idempotency cache) gets the complete reply.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._changed = asyncio.get_running_loop().create_future()
+        self._task = run_in_background(self._produce(chunks))
+
+    async def _produce(self, chunks):
+        try:
+            async for chunk in chunks:
+                self._chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            logger.error("Streamed reply failed after %d chunks: %s", len(self._chunks), e)
+            self._error = e
+        finally:
+            self._done = True
+            self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.get_running_loop().create_future()
+        changed.set_result(None)
+
+    @property
+    def failed(self):
+        """Whether production stopped with an error, the readers got a truncated reply."""
+        return self._done and self._error is not None
+
+    async def __aiter__(self):
+        index = 0
+        while True:
+            while index < len(self._chunks):
+                yield self._chunks[index]
+                index += 1
+            if self._done:
+                if self._error is not None:
+                    raise self._error
+                return
+            await self._changed
+
+    async def read(self):
+        """The whole reply, once it is complete."""
+        return b"".join([chunk async for chunk in self])
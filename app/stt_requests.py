@@ -1,6 +1,8 @@
 import aiohttp
 import os
 import io
+from .admission import provider_limit
+from .circuit_breaker import circuit_breaker
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_API_BASE = "https://api.openai.com/v1"
@@ -10,6 +12,8 @@ AZURE_REGION = os.getenv("AZURE_REGION")
 
 DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY")
 
+@provider_limit("openai_stt")
+@circuit_breaker("openai_stt")
 async def send_whisper_stt_request(wav_data):
     async with aiohttp.ClientSession() as session:
         data = aiohttp.FormData()
@@ -24,6 +28,8 @@ async def send_whisper_stt_request(wav_data):
             response.raise_for_status()
             return await response.json()
 
+@provider_limit("deepgram_stt")
+@circuit_breaker("deepgram_stt")
 async def send_deepgram_stt_request(wav_data):
     deepgram_endpoint = "https://api.deepgram.com/v1/listen"
 
@@ -51,6 +57,8 @@ async def send_deepgram_stt_request(wav_data):
             return {"text": transcription}
 
 
+@provider_limit("azure_stt")
+@circuit_breaker("azure_stt")
 async def send_azure_stt_request(wav_data):
     # Azure STT endpoint
     azure_endpoint = f"https://{AZURE_REGION}.stt.speech.microsoft.com/speech/recognition/conversation/cognitiveservices/v1"
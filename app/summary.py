@@ -0,0 +1,104 @@
+import asyncio
+import json
+import os
+from .db import get_user_session, get_user_summary, get_user_system_prompt, update_user_summary
+from .llm_requests import send_gpt_request
+from .prompts import SUMMARY_SYSTEM_PROMPT
+
+# Number of messages that must fall out of the active window before a compaction runs
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", 20))
+# Hard cap on the stored summary, so the prompt stays bounded even if the LLM ignores the word limit
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", 1500))
+# Lambda waits for background work before it replies, so compaction goes to an asynchronous
+# invocation of this function instead (see lambda_function.py). Unset outside Lambda.
+SUMMARY_FUNCTION_NAME = os.getenv("SUMMARY_FUNCTION_NAME") if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else None
+# Key of the invocation event naming the user whose session is compacted
+COMPACT_EVENT_KEY = "compact_user_id"
+
+_lambda_client = None
+
+# Users with a compaction in flight in this process
+_compacting_users = set()
+
+def message_timestamp(message):
+    try:
+        return float(message.get('timestamp'))
+    except (ValueError, TypeError):
+        return None
+
+def messages_to_summarize(full_messages, active_message_limit, summary_until):
+    """Return the messages outside the active window that are not covered by the summary yet."""
+    if active_message_limit == -1:  # Unlimited window, everything is sent raw
+        return []
+
+    window_size = int(active_message_limit * 2)
+    older_messages = full_messages[:-window_size] if window_size else full_messages
+
+    pending = []
+    for message in older_messages:
+        timestamp = message_timestamp(message)
+        if timestamp is None:
+            continue  # Skip messages with invalid timestamp formats
+        if summary_until is None or timestamp > summary_until:
+            pending.append(message)
+    return pending
+
+def needs_compaction(full_messages, active_message_limit, summary_until):
+    return len(messages_to_summarize(full_messages, active_message_limit, summary_until)) >= SUMMARY_BATCH_MESSAGES
+
+def build_summary_request(previous_summary, messages):
+    """Build the GPT messages asking to fold the new turns into the previous summary."""
+    lines = []
+    for message in messages:
+        content = message.get('content', '')
+        if content:
+            speaker = "Buddy" if message.get('role') == "assistant" else "User"
+            lines.append(f"{speaker}: {content}")
+
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Previous summary:\n{previous_summary or '-'}\n\nNew turns:\n" + "\n".join(lines)},
+    ]
+
+def summary_message(summary):
+    """Render the stored summary as the message prepended to the GPT history."""
+    return {"role": "system", "content": f"Summary of the earlier conversation with this user:\n{summary}"}
+
+async def compact_user_session(user_id, full_messages, active_message_limit, summary_data):
+    """Fold the messages that left the active window into the user's rolling summary."""
+    if user_id in _compacting_users:
+        return
+    _compacting_users.add(user_id)
+
+    try:
+        previous_summary = summary_data.get("Summary")
+        pending = messages_to_summarize(full_messages, active_message_limit, summary_data.get("SummaryUntil"))
+        if not pending:
+            return
+
+        summary = await send_gpt_request(build_summary_request(previous_summary, pending))
+        summary = summary[:SUMMARY_MAX_CHARS]
+        update_user_summary(user_id, summary, message_timestamp(pending[-1]))
+    finally:
+        _compacting_users.discard(user_id)
+
+def _invoke_compaction(user_id):
+    global _lambda_client
+    if _lambda_client is None:
+        import boto3
+        _lambda_client = boto3.client("lambda")
+    _lambda_client.invoke(
+        FunctionName=SUMMARY_FUNCTION_NAME, InvocationType="Event", Payload=json.dumps({COMPACT_EVENT_KEY: user_id})
+    )
+
+async def request_compaction(user_id):
+    """Hand the compaction to an asynchronous invocation, only the invoke call is waited for."""
+    await asyncio.get_running_loop().run_in_executor(None, _invoke_compaction, user_id)
+
+async def compact_stored_session(user_id):
+    """Compact the stored session of the user, run by the invocation request_compaction started."""
+    full_messages = get_user_session(user_id)
+    active_message_limit = get_user_system_prompt(user_id).get("ActiveMessageLimit") or 10
+    summary_data = get_user_summary(user_id)
+    if needs_compaction(full_messages, active_message_limit, summary_data.get("SummaryUntil")):
+        await compact_user_session(user_id, full_messages, active_message_limit, summary_data)
@@ -0,0 +1,176 @@
+"""
+Perceived latency, as measured on the device.
+
+Server timings miss the upload over the device's Wi-Fi, the TLS setup and the time until
+the speaker starts playing. Every reply carries its request id and the server time
+(timing_headers); the device reports its own timestamps of the turn against that id,
+and the reports are aggregated into latency histograms per firmware version.
+"""
+import logging
+import os
+from collections import OrderedDict
+from .logger import log_request
+from .metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the histogram buckets, a last bucket takes everything above
+TELEMETRY_BUCKETS_MS = [
+    int(bound) for bound in os.getenv("TELEMETRY_BUCKETS_MS", "250,500,750,1000,1500,2000,3000,4000,6000,8000,12000").split(",")
+]
+# Firmware versions with their own histograms, reports of further versions are counted under "other"
+TELEMETRY_MAX_FIRMWARE_VERSIONS = int(os.getenv("TELEMETRY_MAX_FIRMWARE_VERSIONS", 20))
+# Server times of the most recent turns, kept to correlate the device reports with
+TELEMETRY_RECENT_TURNS = int(os.getenv("TELEMETRY_RECENT_TURNS", 2000))
+
+REQUEST_ID_HEADER = "X-Request-Id"
+TIMING_HEADER = "Server-Timing"
+
+# Device timestamps of a turn (ms, any one device clock), in the order they happen
+TIMESTAMPS = ("record_end", "request_sent", "first_byte", "playback_start")
+# Intervals derived from them: name -> (from, to)
+INTERVALS = {
+    "end_to_end": ("record_end", "playback_start"),   # what the user waits for
+    "prepare": ("record_end", "request_sent"),        # encoding, connection and TLS setup
+    "first_byte": ("request_sent", "first_byte"),     # upload, server time and the way back
+    "playback": ("first_byte", "playback_start"),     # buffering and decoding on the device
+}
+
+def timing_headers(request_id, server_seconds):
+    """Headers the device reports its timings against: the request id and the server time until the reply started."""
+    return {REQUEST_ID_HEADER: request_id, TIMING_HEADER: f"total;dur={server_seconds * 1000:.1f}"}
+
+class Histogram:
+    """Counts of values per bucket of `bounds`, with quantiles estimated from the buckets."""
+
+    def __init__(self, bounds=TELEMETRY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.bounds) if value <= bound), len(self.bounds))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the quantile, None above the last bound (or without values)."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def stats(self):
+        buckets = {f"le_{bound}": count for bound, count in zip(self.bounds, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 1) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "buckets": buckets,
+        }
+
+class LatencyTelemetry:
+    """Aggregates device latency reports per firmware version."""
+
+    def __init__(self, max_firmware_versions=TELEMETRY_MAX_FIRMWARE_VERSIONS, recent_turns=TELEMETRY_RECENT_TURNS,
+                 bounds=TELEMETRY_BUCKETS_MS):
+        self.max_firmware_versions = max_firmware_versions
+        self.recent_turns = recent_turns
+        self.bounds = bounds
+        # firmware version -> interval name -> Histogram
+        self.histograms = {}
+        # request id -> server seconds, oldest first
+        self._server_seconds = OrderedDict()
+        self.reports = 0
+        self.uncorrelated = 0
+
+    def record_turn(self, request_id, server_seconds):
+        """Remember the server time of a turn, until its device report comes in."""
+        self._server_seconds[request_id] = server_seconds
+        while len(self._server_seconds) > self.recent_turns:
+            self._server_seconds.popitem(last=False)
+
+    def report(self, report):
+        """
+        Record one device report.
+
+        :param report: {"request_id", "firmware_version", and the TIMESTAMPS the device took, in ms}.
+            Missing timestamps are allowed (e.g. playback never started), `server_ms` may carry the
+            time of the timing header for turns this process did not serve.
+        :raises ValueError: When the report is malformed
+        :return: The intervals in ms, with "server" and "network" when the turn could be correlated
+        """
+        if not isinstance(report, dict):
+            raise ValueError("A report is a JSON object")
+        request_id = report.get("request_id")
+        firmware_version = str(report.get("firmware_version") or "unknown")
+
+        timestamps = {}
+        for name in TIMESTAMPS:
+            value = report.get(name)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"{name} is not a number")
+            timestamps[name] = value
+        ordered = [timestamps[name] for name in TIMESTAMPS if name in timestamps]
+        if ordered != sorted(ordered):
+            raise ValueError("Timestamps are out of order")
+
+        intervals = {
+            name: timestamps[end] - timestamps[start]
+            for name, (start, end) in INTERVALS.items() if start in timestamps and end in timestamps
+        }
+        if not intervals:
+            raise ValueError("A report needs at least two timestamps")
+
+        server_seconds = self._server_seconds.pop(request_id, None)
+        if server_seconds is not None:
+            server_ms = server_seconds * 1000
+        else:
+            server_ms = report.get("server_ms")
+            self.uncorrelated += 1
+        if isinstance(server_ms, (int, float)) and "first_byte" in intervals:
+            # What the server did not spend of the wait for the first byte went to Wi-Fi and the internet
+            intervals["server"] = server_ms
+            intervals["network"] = max(intervals["first_byte"] - server_ms, 0)
+
+        histograms = self._firmware_histograms(firmware_version)
+        for name, value in intervals.items():
+            histograms.setdefault(name, Histogram(self.bounds)).observe(value)
+        self.reports += 1
+
+        # Logged under the turn's request id, next to the server's records of it
+        with log_request(request_id):
+            logger.info("Device latency: %s ms end to end", intervals.get("end_to_end"),
+                        extra={"firmware_version": firmware_version,
+                               **{f"{name}_ms": round(value, 1) for name, value in intervals.items()}})
+        return intervals
+
+    def stats(self):
+        return {
+            "reports": self.reports,
+            "uncorrelated": self.uncorrelated,
+            "firmware": {
+                version: {name: histogram.stats() for name, histogram in histograms.items()}
+                for version, histograms in self.histograms.items()
+            },
+        }
+
+    def _firmware_histograms(self, firmware_version):
+        if firmware_version not in self.histograms and len(self.histograms) >= self.max_firmware_versions:
+            firmware_version = "other"
+        return self.histograms.setdefault(firmware_version, {})
+
+latency_telemetry = LatencyTelemetry()
+
+register_metrics("device_latency", latency_telemetry.stats)
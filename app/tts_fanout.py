@@ -0,0 +1,99 @@
+import asyncio
+import os
+import re
+import numpy as np
+from .audio_processing import join_pcm_segments, shape_pcm_segment, TTS_SAMPLE_RATE, SEGMENT_PAUSE_SECONDS
+
+# Replies shorter than two chunks are synthesized in one request, as before
+TTS_CHUNK_MIN_CHARS = int(os.getenv("TTS_CHUNK_MIN_CHARS", 40))
+TTS_CHUNK_MAX_CHARS = int(os.getenv("TTS_CHUNK_MAX_CHARS", 160))
+# Chunks of one reply synthesized at the same time (the provider limit still applies on top)
+TTS_FANOUT_CONCURRENCY = int(os.getenv("TTS_FANOUT_CONCURRENCY", 4))
+
+# Sentence punctuation followed by a space ends a sentence
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+# Thai does not mark sentences with punctuation, a space between Thai characters ends a phrase
+THAI_PHRASE_BOUNDARY = re.compile(r"(?<=[\u0E00-\u0E7F])\s+(?=[\u0E00-\u0E7F])")
+
+def split_for_tts(text, min_chars=TTS_CHUNK_MIN_CHARS, max_chars=TTS_CHUNK_MAX_CHARS):
+    """
+    Split a reply into chunks at sentence and Thai phrase boundaries.
+
+    Phrases are merged until a chunk holds at least `min_chars`, so no chunk is a lone
+    word with its own intonation, and never beyond `max_chars`. Spaces inside English
+    text are not boundaries, so English words are never cut apart from their sentence.
+    """
+    text = " ".join(text.split())
+    if len(text) < 2 * min_chars:
+        return [text] if text else []
+
+    phrases = []
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        phrases.extend(THAI_PHRASE_BOUNDARY.split(sentence))
+
+    chunks = []
+    for phrase in phrases:
+        if chunks and len(chunks[-1]) < min_chars and len(chunks[-1]) + 1 + len(phrase) <= max_chars:
+            chunks[-1] += " " + phrase
+        else:
+            chunks.append(phrase)
+    # A short tail joins the chunk before it
+    if len(chunks) > 1 and len(chunks[-1]) < min_chars and len(chunks[-2]) + 1 + len(chunks[-1]) <= max_chars:
+        tail = chunks.pop()
+        chunks[-1] += " " + tail
+    return chunks
+
+async def synthesize_reply(text, synthesize, concurrency=TTS_FANOUT_CONCURRENCY, sample_rate=TTS_SAMPLE_RATE):
+    """
+    Synthesize a reply chunk by chunk, at most `concurrency` chunks at a time.
+
+    :param synthesize: Async TTS function returning mono 16-bit PCM for a text
+    :return: The PCM of the whole reply, chunks joined in reply order
+    """
+    chunks = split_for_tts(text)
+    if len(chunks) <= 1:
+        return await synthesize(text)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def synthesize_chunk(chunk):
+        async with semaphore:
+            return await synthesize(chunk)
+
+    segments = await asyncio.gather(*[synthesize_chunk(chunk) for chunk in chunks])
+    return join_pcm_segments(segments, sample_rate=sample_rate)
+
+async def synthesize_segments(text, synthesize, concurrency=TTS_FANOUT_CONCURRENCY, sample_rate=TTS_SAMPLE_RATE):
+    """
+    Yield the PCM of a reply chunk by chunk, in reply order, as soon as each chunk is ready.
+
+    Chunks are synthesized like in synthesize_reply and come out joined the same way
+    (trimmed, faded, separated by the same pause), so the concatenated output
+    sounds like the joined reply. Chunks still synthesizing are cancelled when the
+    consumer stops early.
+    """
+    chunks = split_for_tts(text)
+    if len(chunks) <= 1:
+        yield await synthesize(text)
+        return
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def synthesize_chunk(chunk):
+        async with semaphore:
+            return await synthesize(chunk)
+
+    tasks = [asyncio.ensure_future(synthesize_chunk(chunk)) for chunk in chunks]
+    pause = bytes(2 * int(SEGMENT_PAUSE_SECONDS * sample_rate))
+    try:
+        started = False
+        for task in tasks:
+            samples = shape_pcm_segment(await task, sample_rate)
+            if len(samples) == 0:
+                continue
+            segment = np.rint(samples).astype('<i2').tobytes()
+            yield pause + segment if started else segment
+            started = True
+    finally:
+        for task in tasks:
+            task.cancel()
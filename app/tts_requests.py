@@ -1,5 +1,7 @@
 import aiohttp
 import os
+from .admission import provider_limit
+from .circuit_breaker import circuit_breaker
 
 # Environment variables for OpenAI API
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -9,6 +11,16 @@ OPENAI_API_BASE = "https://api.openai.com/v1"
 AZURE_API_KEY = os.getenv("AZURE_API_KEY")
 AZURE_REGION = os.getenv("AZURE_REGION")
 
+# Voice of Buddy, part of the fingerprint of pre-rendered phrases
+AZURE_TTS_VOICE = 'th-TH-AcharaNeural'
+AZURE_TTS_PROSODY = {"rate": "-30%", "pitch": "70%", "contour": "(50%, +50%) (100%,-0%)"}
+AZURE_TTS_OUTPUT_FORMAT = 'raw-24khz-16bit-mono-pcm'
+
+def azure_tts_voice_settings():
+    return {"voice": AZURE_TTS_VOICE, "prosody": AZURE_TTS_PROSODY, "output_format": AZURE_TTS_OUTPUT_FORMAT}
+
+@provider_limit("openai_tts")
+@circuit_breaker("openai_tts")
 async def send_openai_tts_request(gpt_text):
     """Send TTS request to OpenAI API."""
     async with aiohttp.ClientSession() as session:
@@ -19,6 +31,8 @@ async def send_openai_tts_request(gpt_text):
             response.raise_for_status()
             return await response.read()
 
+@provider_limit("azure_tts")
+@circuit_breaker("azure_tts")
 async def send_azure_tts_request(text):
     """Send TTS request to Microsoft Azure TTS API using SSML."""
     azure_endpoint = f"https://{AZURE_REGION}.tts.speech.microsoft.com/cognitiveservices/v1"
@@ -26,8 +40,8 @@ async def send_azure_tts_request(text):
     # SSML input for Azure TTS
     ssml_text = f"""
     <speak version='1.0' xml:lang='th-TH'>
-        <voice name='th-TH-AcharaNeural'>
-            <prosody rate="-30%" pitch="70%" contour="(50%, +50%) (100%,-0%)">
+        <voice name='{AZURE_TTS_VOICE}'>
+            <prosody rate="{AZURE_TTS_PROSODY['rate']}" pitch="{AZURE_TTS_PROSODY['pitch']}" contour="{AZURE_TTS_PROSODY['contour']}">
                 {text}
             </prosody>
         </voice>
@@ -37,7 +51,7 @@ async def send_azure_tts_request(text):
     headers = {
         'Ocp-Apim-Subscription-Key': AZURE_API_KEY,
         'Content-Type': 'application/ssml+xml',
-        'X-Microsoft-OutputFormat': 'raw-24khz-16bit-mono-pcm',
+        'X-Microsoft-OutputFormat': AZURE_TTS_OUTPUT_FORMAT,
         'User-Agent': 'BUDDYANDME-SERVER'
     }
 
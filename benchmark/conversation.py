@@ -0,0 +1,91 @@
+"""
+Per-turn cost of the conversation history, dict lists vs. the Conversation type.
+
+A turn limits the history to the active window, checks the daily rate limit, builds the
+prompt and appends the user and assistant messages, as app.core does. Allocations are
+measured with tracemalloc (Python 3.9+), resident size with sys.getsizeof over the messages.
+
+Run with `python -m benchmark.conversation`.
+"""
+import sys
+import time
+import tracemalloc
+from app.conversation import Conversation, Message
+from app.core import append_message, limit_messages, is_rate_limit_reached
+
+HISTORY_SIZES = [10, 1000, 10000]
+ACTIVE_MESSAGE_LIMIT = 10
+DAILY_RATE_LIMIT = 100
+REPEAT = 20
+
+def make_history(count, start_timestamp=1730000000.0):
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"สวัสดี บั้ดดี้ {i}",
+            "timestamp": str(start_timestamp + i * 7.123456)
+        }
+        for i in range(count)
+    ]
+
+def dict_turn(messages):
+    # The turn as it was done before the Conversation type
+    limited = messages[-ACTIVE_MESSAGE_LIMIT * 2:]
+    is_rate_limit_reached(messages, DAILY_RATE_LIMIT)
+    prompt = limited + [{"role": "user", "content": "เล่านิทานให้ฟังหน่อย", "timestamp": str(time.time())}]
+    messages = messages + [{"role": "user", "content": "เล่านิทานให้ฟังหน่อย", "timestamp": str(time.time())}]
+    messages = messages + [{"role": "assistant", "content": "ได้เลย", "timestamp": str(time.time())}]
+    return prompt, messages
+
+def conversation_turn(messages):
+    limited = limit_messages(messages, ACTIVE_MESSAGE_LIMIT)
+    is_rate_limit_reached(messages, DAILY_RATE_LIMIT)
+    prompt = append_message(limited, "เล่านิทานให้ฟังหน่อย", "user", verbose=False)
+    messages = messages.appended(prompt[-1])
+    messages = append_message(messages, "ได้เลย", "assistant", verbose=False)
+    return prompt, messages
+
+def measure(turn, messages):
+    # Each turn continues the history of the previous one, as consecutive requests of a user do
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        _, messages = turn(messages)
+        best = min(best, time.perf_counter() - start)
+
+    # Average peak of a turn, growing the shared backing list is amortized over the turns
+    peaks = 0
+    tracemalloc.start()
+    for _ in range(REPEAT):
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        _, messages = turn(messages)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks += peak - baseline
+    tracemalloc.stop()
+    return best, peaks // REPEAT
+
+def resident_size(messages):
+    size = sys.getsizeof(messages)
+    for message in messages:
+        size += sys.getsizeof(message) + sys.getsizeof(message["content"])
+        timestamp = message.timestamp if isinstance(message, Message) else message["timestamp"]
+        size += sys.getsizeof(timestamp)
+    return size
+
+def main():
+    print(f"{'messages':>8} | {'dict us':>9} {'conv us':>9} | {'dict alloc B':>12} {'conv alloc B':>12} | "
+          f"{'dict KiB':>9} {'conv KiB':>9}")
+    for count in HISTORY_SIZES:
+        dicts = make_history(count)
+        conversation = Conversation(dicts)
+
+        dict_seconds, dict_peak = measure(dict_turn, dicts)
+        conversation_seconds, conversation_peak = measure(conversation_turn, conversation)
+
+        print(f"{count:>8} | {dict_seconds * 1e6:>9.1f} {conversation_seconds * 1e6:>9.1f} | "
+              f"{dict_peak:>12} {conversation_peak:>12} | "
+              f"{resident_size(dicts) / 1024:>9.1f} {resident_size(conversation) / 1024:>9.1f}")
+
+if __name__ == '__main__':
+    main()
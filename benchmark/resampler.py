@@ -0,0 +1,35 @@
+"""
+STT payload size and resampling time per input sample rate.
+
+Run with `python -m benchmark.resampler`.
+"""
+import time
+import numpy as np
+from app.audio_processing import normalize_input_audio, add_wav_header, stt_sample_rate, STT_SAMPLE_RATE
+
+INPUT_RATES = [8000, 11025, 15000, 16000, 22050, 32000, 44100, 48000]
+SECONDS = 10
+REPEAT = 3
+
+def make_speech_like_pcm(sample_rate, seconds):
+    # Sum of tones with a slow envelope, a rough stand-in for voiced speech
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    signal = sum(np.sin(2 * np.pi * frequency * t) for frequency in (180, 360, 720, 1440, 2880))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    return (signal * envelope * 4000).astype('<i2').tobytes()
+
+def main():
+    print(f"{'input Hz':>8} | {'upload bytes':>12} {'stt wav bytes':>13} | {'resample ms':>11} {'x realtime':>10}")
+    for sample_rate in INPUT_RATES:
+        pcm = make_speech_like_pcm(sample_rate, SECONDS)
+        best = float("inf")
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            normalized = normalize_input_audio(pcm, sample_rate=sample_rate, target_rate=STT_SAMPLE_RATE)
+            best = min(best, time.perf_counter() - start)
+        wav_bytes = len(add_wav_header(normalized, sample_rate=stt_sample_rate(sample_rate)))
+        realtime = SECONDS / best if best > 0 else float("inf")
+        print(f"{sample_rate:>8} | {len(pcm):>12} {wav_bytes:>13} | {best * 1000:>11.2f} {realtime:>10.0f}")
+
+if __name__ == '__main__':
+    main()
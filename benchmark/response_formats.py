@@ -0,0 +1,48 @@
+"""
+Reply size and server-side encode time of the negotiable reply formats.
+
+Run with `python -m benchmark.response_formats`.
+"""
+import time
+import numpy as np
+from app.audio_processing import TTS_SAMPLE_RATE, IMA_ADPCM_CODEC, MP3_CODEC
+from app.response_format import ResponseFormat, DEFAULT_RESPONSE_FORMAT
+
+DURATIONS = [3, 10]
+REPEAT = 3
+
+FORMATS = [
+    DEFAULT_RESPONSE_FORMAT,
+    ResponseFormat(MP3_CODEC, 24000, '24k'),
+    ResponseFormat(MP3_CODEC, 16000, '16k'),
+    ResponseFormat(MP3_CODEC, 8000, '8k'),
+    ResponseFormat(IMA_ADPCM_CODEC, 16000),
+    ResponseFormat(IMA_ADPCM_CODEC, 8000),
+]
+
+def make_speech_like(seconds):
+    # Harmonic tone with a syllable-rate envelope, closer to TTS output than white noise
+    t = np.arange(seconds * TTS_SAMPLE_RATE) / TTS_SAMPLE_RATE
+    signal = sum(np.sin(2 * np.pi * 180 * k * t) / k for k in range(1, 8))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    return (signal * envelope * 4000).astype('<i2').tobytes()
+
+def best_of(fn):
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    print(f"{'format':>26} {'seconds':>7} | {'bytes':>8} {'kbit/s':>7} | {'encode ms':>9}")
+    for seconds in DURATIONS:
+        pcm_data = make_speech_like(seconds)
+        for response_format in FORMATS:
+            elapsed, encoded = best_of(lambda: response_format.encode(pcm_data))
+            label = f"{response_format.codec} {response_format.sample_rate} {response_format.bitrate if response_format.codec == MP3_CODEC else ''}"
+            print(f"{label:>26} {seconds:>7} | {len(encoded):>8} {len(encoded) * 8 / seconds / 1000:>7.1f} | {elapsed * 1000:>9.1f}")
+
+if __name__ == '__main__':
+    main()
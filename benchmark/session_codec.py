@@ -0,0 +1,62 @@
+"""
+Compare the legacy Messages list with the compressed MessagesBlob codec.
+
+Run with `python -m benchmark.session_codec`.
+"""
+import json
+import time
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer, Binary
+from app.session_codec import encode_messages, decode_messages
+
+HISTORY_SIZES = [10, 100, 1000, 5000]
+REPEAT = 5
+
+SAMPLE_REPLIES = [
+    "บั้ดดี้ชอบกินน้ำผึ้งที่สุดเลย แล้วเธอชอบกินอะไรล่ะ",
+    "วันนี้ไปโรงเรียนมาสนุกไหม เล่าให้บั้ดดี้ฟังหน่อยสิ",
+    "ฝันดีนะ พรุ่งนี้มาเล่นกันใหม่",
+]
+
+def make_history(count, start_timestamp=1730000000.0):
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": SAMPLE_REPLIES[i % len(SAMPLE_REPLIES)],
+            "timestamp": str(start_timestamp + i * 7.123456)
+        }
+        for i in range(count)
+    ]
+
+def best_of(fn):
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    serializer = TypeSerializer()
+    deserializer = TypeDeserializer()
+
+    print(f"{'messages':>8} | {'legacy bytes':>12} {'blob bytes':>10} | "
+          f"{'legacy ser ms':>13} {'blob ser ms':>11} | {'legacy de ms':>12} {'blob de ms':>10}")
+    for count in HISTORY_SIZES:
+        messages = make_history(count)
+
+        legacy_wire = serializer.serialize(messages)
+        blob_wire = serializer.serialize(Binary(encode_messages(messages)))
+        # Wire size of the attribute value as sent through the DynamoDB JSON protocol
+        legacy_bytes = len(json.dumps(legacy_wire, ensure_ascii=False).encode("utf-8"))
+        blob_bytes = len(blob_wire["B"])
+
+        legacy_ser = best_of(lambda: serializer.serialize(messages))
+        blob_ser = best_of(lambda: serializer.serialize(Binary(encode_messages(messages))))
+        legacy_de = best_of(lambda: deserializer.deserialize(legacy_wire))
+        blob_de = best_of(lambda: decode_messages(deserializer.deserialize(blob_wire)))
+
+        print(f"{count:>8} | {legacy_bytes:>12} {blob_bytes:>10} | "
+              f"{legacy_ser * 1000:>13.3f} {blob_ser * 1000:>11.3f} | {legacy_de * 1000:>12.3f} {blob_de * 1000:>10.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Time to first audio byte of a reply, buffered vs. streamed chunk by chunk.
+
+TTS is simulated as in benchmark.tts_fanout, encoding runs the real ffmpeg. A buffered
+reply is complete (and sent) only after every chunk was synthesized and the whole
+reply encoded; a streamed one sends the first MP3 frames after the first chunk.
+With -v the streamed chunks are printed as bursts, ffmpeg writes one MP3 frame at a time.
+
+Run with `python -m benchmark.streaming`.
+"""
+import argparse
+import asyncio
+import time
+from unittest.mock import patch
+import numpy as np
+from app.core import convert_text_to_audio_and_respond
+from app.tts_fanout import split_for_tts
+from benchmark.tts_fanout import REPLIES, FIRST_BYTE_SECONDS, SECONDS_PER_CHAR
+
+TTS_SAMPLE_RATE = 24000
+
+async def simulated_tts(text):
+    await asyncio.sleep(FIRST_BYTE_SECONDS + SECONDS_PER_CHAR * len(text))
+    # About the speech length Azure returns for Thai, 0.1 s per character
+    t = np.arange(len(text) * 2400) / TTS_SAMPLE_RATE
+    return (np.sin(2 * np.pi * 220 * t) * 4000).astype('<i2').tobytes()
+
+async def buffered(text):
+    start = time.perf_counter()
+    audio = await convert_text_to_audio_and_respond(text)
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, [(elapsed, len(audio))]
+
+async def streamed(text):
+    start = time.perf_counter()
+    audio = await convert_text_to_audio_and_respond(text, stream=True)
+    arrivals = []
+    async for chunk in audio:
+        arrivals.append((time.perf_counter() - start, len(chunk)))
+    return arrivals[0][0], arrivals[-1][0], arrivals
+
+def bursts(arrivals, gap_seconds=0.02):
+    """Merge chunks arriving within `gap_seconds` of each other into (first arrival, last arrival, bytes)."""
+    merged = []
+    for seconds, size in arrivals:
+        if merged and seconds - merged[-1][1] <= gap_seconds:
+            first, _, total = merged[-1]
+            merged[-1] = (first, seconds, total + size)
+        else:
+            merged.append((seconds, seconds, size))
+    return merged
+
+async def run(verbose):
+    print(f"{'reply':>8} {'chunks':>6} | {'buffered first ms':>17} {'total ms':>9} | {'streamed first ms':>17} {'total ms':>9}")
+    with patch('app.core.send_azure_tts_request', simulated_tts):
+        for name, text in REPLIES.items():
+            buffered_first, buffered_total, _ = await buffered(text)
+            streamed_first, streamed_total, arrivals = await streamed(text)
+            print(f"{name:>8} {len(split_for_tts(text)):>6} | {buffered_first * 1000:>17.0f} {buffered_total * 1000:>9.0f} | "
+                  f"{streamed_first * 1000:>17.0f} {streamed_total * 1000:>9.0f}")
+            if verbose:
+                for first, last, size in bursts(arrivals):
+                    print(f"{'':>17} {first * 1000:>6.0f} - {last * 1000:>6.0f} ms {size:>7} B")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-v", "--verbose", action="store_true", help="print when the streamed bytes arrived")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.verbose))
+
+if __name__ == '__main__':
+    main()
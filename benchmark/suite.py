@@ -0,0 +1,231 @@
+"""
+Hot path microbenchmarks with a stored baseline and regression gates.
+
+Times and peak memory of the audio, text and history helpers over the recorded
+test/sounds payloads, synthetic multi-minute TTS PCM and large histories.
+
+    python -m benchmark.suite                    compare with benchmark/baseline.json, exit 1 on a regression
+    python -m benchmark.suite --save             run and store the results as the new baseline
+    python -m benchmark.suite --only amplify     run the cases whose name contains "amplify"
+
+Baselines are machine specific. Every run times a fixed pure Python loop first, and
+the baseline times are scaled by how much faster or slower this machine runs it, so
+a baseline recorded on a laptop still gates a CI box roughly right.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+import numpy as np
+from app.audio_processing import amplify_pcm_audio, add_wav_header, compress_to_mp3
+from app.conversation import Conversation
+from app.core import limit_messages, is_rate_limit_reached
+from app.utils import format_text_response
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SOUNDS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test", "sounds")
+# A change regresses when it is this much slower, or needs this much more peak memory, than the baseline
+TIME_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.25
+# Peak memory below this is noise (interpreter caches, small temporaries), it is not gated
+MEMORY_FLOOR_BYTES = 64 * 1024
+# Likewise for timings, a few microseconds of scheduling jitter are more than 25% of the fastest cases
+TIME_FLOOR_SECONDS = 0.0001
+# Each case is repeated until it ran this long (at least once, at most MAX_REPEAT times), the best run counts
+TIME_BUDGET_SECONDS = 1.0
+MAX_REPEAT = 20
+# Fast cases are called in a loop until one timing takes this long, so timer resolution does not matter
+MIN_TIMING_SECONDS = 0.005
+# A regressed case is measured again this many times before it fails the run, shared CI boxes are noisy
+CONFIRM_ATTEMPTS = 2
+TTS_SAMPLE_RATE = 24000
+
+REPLIES = {
+    "short": "สวัสดีจ้า หนูชื่ออะไร 😊",
+    "long": ("กาลครั้งหนึ่งนานมาแล้ว มีกระต่ายน้อยตัวหนึ่งอาศัยอยู่ในป่าใหญ่ 🐰 ทุกเช้ามันจะวิ่งไปที่ลำธารเพื่อดื่มน้ำ "
+             "วันหนึ่งมันได้พบกับเต่าเฒ่าที่กำลังเดินช้าๆ อยู่ริมน้ำ 🐢 กระต่ายหัวเราะเยาะเต่าว่าเดินช้าเหลือเกิน ") * 4,
+}
+
+@dataclass
+class Case:
+    name: str
+    run: object
+    # Bytes or items processed per run, reported as throughput
+    size: int
+    unit: str
+
+def recorded_payloads():
+    """PCM of the recorded uploads in test/sounds, as the device sends it."""
+    payloads = {}
+    for file_name in sorted(os.listdir(SOUNDS_DIR)):
+        if file_name.endswith(".txt"):
+            with open(os.path.join(SOUNDS_DIR, file_name)) as f:
+                payloads[file_name[:-4]] = base64.b64decode(f.read())
+    return payloads
+
+def synthetic_tts_pcm(seconds):
+    # Voiced-speech-like tones with pauses, at the level Azure TTS returns
+    t = np.arange(int(TTS_SAMPLE_RATE * seconds)) / TTS_SAMPLE_RATE
+    signal = sum(np.sin(2 * np.pi * frequency * t) for frequency in (200, 400, 800, 1600))
+    envelope = np.clip(np.sin(2 * np.pi * 0.5 * t), 0, None)
+    return (signal * envelope * 2000).astype('<i2').tobytes()
+
+def make_history(count, start_timestamp=None):
+    # The newest messages are from today, so the rate limit check walks back through them
+    start_timestamp = time.time() - count * 5 if start_timestamp is None else start_timestamp
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"สวัสดี บั้ดดี้ {i}",
+            "timestamp": str(start_timestamp + i * 5)
+        }
+        for i in range(count)
+    ]
+
+def build_cases(quick=False):
+    tts_seconds = [10, 30] if quick else [10, 120]
+    history_sizes = [10, 1000] if quick else [10, 1000, 10000]
+    cases = []
+
+    for name, pcm in recorded_payloads().items():
+        cases.append(Case(f"add_wav_header/{name}", lambda pcm=pcm: add_wav_header(pcm), len(pcm), "B"))
+        cases.append(Case(f"amplify_pcm_audio/{name}", lambda pcm=pcm: amplify_pcm_audio(pcm), len(pcm), "B"))
+
+    for seconds in tts_seconds:
+        pcm = synthetic_tts_pcm(seconds)
+        cases.append(Case(f"amplify_pcm_audio/tts_{seconds}s", lambda pcm=pcm: amplify_pcm_audio(pcm), len(pcm), "B"))
+        cases.append(Case(f"compress_to_mp3/tts_{seconds}s", lambda pcm=pcm: compress_to_mp3(pcm), len(pcm), "B"))
+
+    for name, text in REPLIES.items():
+        cases.append(Case(f"format_text_response/{name}", lambda text=text: format_text_response(text), len(text), "chars"))
+
+    for count in history_sizes:
+        dicts = make_history(count)
+        conversation = Conversation(dicts)
+        cases.append(Case(f"limit_messages/{count}", lambda c=conversation: limit_messages(c, 10), 1, "calls"))
+        cases.append(Case(f"is_rate_limit_reached/{count}", lambda c=conversation: is_rate_limit_reached(c, 10000), 1, "calls"))
+        cases.append(Case(f"is_rate_limit_reached/dicts_{count}", lambda d=dicts: is_rate_limit_reached(d, 10000), 1, "calls"))
+    return cases
+
+def calibrate():
+    """Best time of a fixed pure Python workload, the yardstick of this machine."""
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        total = 0
+        for i in range(300000):
+            total += i * i % 7
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _time_calls(run, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        run()
+    return time.perf_counter() - start
+
+def measure(case):
+    # The warm-up (e.g. the first ffmpeg start) also finds how many calls make one timing
+    number = 1
+    while _time_calls(case.run, number) < MIN_TIMING_SECONDS:
+        number *= 10
+
+    timings = []
+    while len(timings) < MAX_REPEAT and (not timings or sum(timings) < TIME_BUDGET_SECONDS):
+        timings.append(_time_calls(case.run, number) / number)
+
+    tracemalloc.start()
+    case.run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = min(timings)
+    return {
+        "seconds": seconds,
+        "throughput": case.size / seconds if seconds else float("inf"),
+        "unit": f"{case.unit}/s",
+        "peak_bytes": peak,
+        "runs": len(timings) * number,
+    }
+
+def compare(results, baseline, calibration, time_threshold=TIME_THRESHOLD, memory_threshold=MEMORY_THRESHOLD):
+    """
+    Regressions of `results` against `baseline`.
+
+    :return: List of (case name, message) for every case past a threshold
+    """
+    scale = calibration / baseline["calibration_seconds"]
+    regressions = []
+    for name, result in results.items():
+        expected = baseline["results"].get(name)
+        if expected is None:
+            continue
+        allowed_seconds = max(expected["seconds"] * scale, TIME_FLOOR_SECONDS) * (1 + time_threshold)
+        if result["seconds"] > allowed_seconds:
+            regressions.append((name, f"{result['seconds'] * 1000:.3f} ms > {allowed_seconds * 1000:.3f} ms allowed"))
+        allowed_peak = max(expected["peak_bytes"], MEMORY_FLOOR_BYTES) * (1 + memory_threshold)
+        if result["peak_bytes"] > allowed_peak:
+            regressions.append((name, f"peak {result['peak_bytes']} B > {allowed_peak:.0f} B allowed"))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--only", help="run only the cases whose name contains this")
+    parser.add_argument("--quick", action="store_true", help="shorter inputs, for a fast local check")
+    parser.add_argument("--time-threshold", type=float, default=TIME_THRESHOLD)
+    parser.add_argument("--memory-threshold", type=float, default=MEMORY_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    calibration = calibrate()
+    results = {}
+    cases = {case.name: case for case in build_cases(args.quick) if not args.only or args.only in case.name}
+    print(f"{'case':<54} | {'best ms':>10} {'throughput':>16} | {'peak KiB':>9}")
+    for case in cases.values():
+        result = results[case.name] = measure(case)
+        throughput = f"{result['throughput']:.3g} {result['unit']}"
+        print(f"{case.name:<54} | {result['seconds'] * 1000:>10.3f} {throughput:>16} | {result['peak_bytes'] / 1024:>9.1f}")
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "calibration_seconds": calibration,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, calibration, args.time_threshold, args.memory_threshold)
+    for _ in range(CONFIRM_ATTEMPTS):
+        if not regressions:
+            break
+        # Keep the best of the measurements, a real regression is slow every time
+        calibration = min(calibration, calibrate())
+        for name in {name for name, _ in regressions}:
+            retry = measure(cases[name])
+            if retry["seconds"] < results[name]["seconds"]:
+                results[name].update(seconds=retry["seconds"], throughput=retry["throughput"])
+            results[name]["peak_bytes"] = min(results[name]["peak_bytes"], retry["peak_bytes"])
+        regressions = compare(results, baseline, calibration, args.time_threshold, args.memory_threshold)
+
+    for name, message in regressions:
+        print(f"REGRESSION {name}: {message}")
+    print(f"{len(regressions)} regression(s) against {args.baseline}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
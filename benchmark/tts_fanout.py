@@ -0,0 +1,46 @@
+"""
+Wall-clock TTS time of a reply, one request per reply vs. one request per chunk in parallel.
+
+The provider is simulated: time to first byte plus synthesis time proportional to the text,
+which is how Azure TTS behaves for non-streamed requests.
+
+Run with `python -m benchmark.tts_fanout`.
+"""
+import asyncio
+import time
+import numpy as np
+from app.tts_fanout import synthesize_reply, split_for_tts
+
+FIRST_BYTE_SECONDS = 0.25
+SECONDS_PER_CHAR = 0.006
+
+REPLIES = {
+    "short": "สวัสดีจ้า หนูชื่ออะไร",
+    "medium": "วันนี้บั้ดดี้ไปเที่ยวสวนสัตว์มาแล้วสนุกมากเลย เห็นช้างตัวใหญ่กำลังกินกล้วยอยู่ หนูชอบสัตว์อะไรที่สุดเหรอ",
+    "long": ("กาลครั้งหนึ่งนานมาแล้ว มีกระต่ายน้อยตัวหนึ่งอาศัยอยู่ในป่าใหญ่ ทุกเช้ามันจะวิ่งไปที่ลำธารเพื่อดื่มน้ำ "
+             "วันหนึ่งมันได้พบกับเต่าเฒ่าที่กำลังเดินช้าๆ อยู่ริมน้ำ กระต่ายหัวเราะเยาะเต่าว่าเดินช้าเหลือเกิน "
+             "เต่าจึงท้ากระต่ายให้มาแข่งวิ่งกัน กระต่ายรับคำท้าทันทีเพราะมั่นใจว่าตัวเองต้องชนะแน่นอน "
+             "แต่ระหว่างทางกระต่ายกลับแวะนอนหลับใต้ต้นไม้ เต่าจึงค่อยๆ เดินไปจนถึงเส้นชัยก่อน หนูคิดว่าเรื่องนี้สอนอะไรเราบ้าง"),
+}
+
+async def simulated_tts(text):
+    await asyncio.sleep(FIRST_BYTE_SECONDS + SECONDS_PER_CHAR * len(text))
+    return (np.ones(len(text) * 2400, dtype='<i2') * 1000).tobytes()
+
+async def timed(coro):
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+async def run():
+    print(f"{'reply':>8} {'chars':>6} {'chunks':>6} | {'single ms':>9} {'fan-out ms':>10}")
+    for name, text in REPLIES.items():
+        single = await timed(simulated_tts(text))
+        fanout = await timed(synthesize_reply(text, simulated_tts))
+        print(f"{name:>8} {len(text):>6} {len(split_for_tts(text)):>6} | {single * 1000:>9.0f} {fanout * 1000:>10.0f}")
+
+def main():
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Upload size and server-side decode throughput of the compressed upload codecs.
+
+Run with `python -m benchmark.upload_codecs`.
+"""
+import struct
+import time
+import numpy as np
+from app.audio_processing import decode_mulaw, decode_ima_adpcm, DEFAULT_ADPCM_BLOCK_ALIGN
+
+SAMPLE_RATE = 15000
+DURATIONS = [5, 30, 120]
+REPEAT = 5
+
+def make_mulaw(seconds):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=seconds * SAMPLE_RATE, dtype=np.uint8).tobytes()
+
+def make_ima_adpcm(seconds, block_align=DEFAULT_ADPCM_BLOCK_ALIGN):
+    # Random codes are as expensive to decode as real speech
+    samples_per_block = 1 + 2 * (block_align - 4)
+    num_blocks = -(-seconds * SAMPLE_RATE // samples_per_block)
+    rng = np.random.default_rng(0)
+    blocks = rng.integers(0, 256, size=(num_blocks, block_align), dtype=np.uint8)
+    blocks[:, 0:2] = 0
+    blocks[:, 2] = rng.integers(0, 89, size=num_blocks)
+    blocks[:, 3] = 0
+    return blocks.tobytes()
+
+def scalar_mulaw_decode(mulaw_data):
+    samples = []
+    for code in mulaw_data:
+        code = ~code & 0xFF
+        magnitude = ((((code & 0x0F) << 3) + 0x84) << ((code >> 4) & 0x07)) - 0x84
+        samples.append(-magnitude if code & 0x80 else magnitude)
+    return struct.pack(f'<{len(samples)}h', *samples)
+
+def best_of(fn, data):
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    print(f"{'codec':>18} {'seconds':>7} | {'upload bytes':>12} {'pcm bytes':>10} | {'decode ms':>9} {'x realtime':>10}")
+    for seconds in DURATIONS:
+        pcm_bytes = seconds * SAMPLE_RATE * 2
+        cases = [
+            ("mulaw", make_mulaw(seconds), decode_mulaw),
+            ("mulaw (scalar)", make_mulaw(seconds), scalar_mulaw_decode),
+            ("ima_adpcm", make_ima_adpcm(seconds), decode_ima_adpcm),
+        ]
+        for name, data, decode in cases:
+            elapsed = best_of(decode, data)
+            print(f"{name:>18} {seconds:>7} | {len(data):>12} {pcm_bytes:>10} | {elapsed * 1000:>9.2f} {seconds / elapsed:>10.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,30 @@
 import base64
 import asyncio
 from app import core
+from app.background import drain_background_tasks
+from app.deadline import Deadline
+from app.logger import configure_logging, flush_logs
+from app.summary import compact_stored_session, COMPACT_EVENT_KEY
+
+# JSON records written by a background thread instead of the runtime's synchronous stdout handler
+configure_logging()
+
+async def handle_event(event, deadline):
+    response = await core.process_audio_logic(event, deadline)
+    # Lambda freezes the process once the handler returns, finish background work first
+    await drain_background_tasks(timeout=deadline.remaining())
+    return response
 
 def lambda_handler(event, context):
-    response = asyncio.run(core.process_audio_logic(event))
+    # Asynchronous invocation by a turn whose history outgrew the summary, nobody waits for it
+    if COMPACT_EVENT_KEY in event:
+        asyncio.run(compact_stored_session(event[COMPACT_EVENT_KEY]))
+        flush_logs()
+        return {'statusCode': 200}
+
+    response = asyncio.run(handle_event(event, Deadline.from_lambda_context(context)))
+    # Records still queued would only be written when (if) the frozen process is thawed
+    flush_logs()
     
     if response.status_code != 200:
         return {
@@ -14,7 +35,7 @@ def lambda_handler(event, context):
     
     return {
         'statusCode': 200,
-        'headers': {'Content-Type': 'audio/mpeg'},
+        'headers': {'Content-Type': 'audio/mpeg', **response.headers},
         'body': base64.b64encode(response.body).decode('utf-8'),
         'isBase64Encoded': True
     }
@@ -1,19 +1,54 @@
+import logging
+import os
 import socket
-from fastapi import FastAPI, Request, Response, HTTPException
+from fastapi import APIRouter, FastAPI, Request, Response, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse
 from dotenv import load_dotenv
 load_dotenv()
 
+# The long-running server sees the same devices turn after turn, keep their sessions in memory
+os.environ.setdefault("SESSION_CACHE_MAX_BYTES", str(32 * 1024 * 1024))
+
 from app import core
+from app.logger import configure_logging, flush_logs
+from app.background import drain_background_tasks
+from app.metrics import collect_metrics
+from app.earcon import wants_earcon, stream_with_earcon, earcon_audio, keepalive_audio
+from app.response_format import parse_response_format, DEFAULT_RESPONSE_FORMAT
+from app.streaming import StreamedAudio
+from app.admission import Overloaded
+from app.jobs import JobQueue, JOB_DEADLINE_SECONDS, JOBS_ENABLED
+from app.metrics import register_metrics
+from app.telemetry import latency_telemetry
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+job_queue = JobQueue(core.process_audio_logic)
+jobs_router = APIRouter()
+
 @app.post("/")
 async def upload(request: Request):
     event = await request.json()
     event = {
-        "body": event
+        "body": event,
+        "headers": dict(request.headers)
     }
-    
+
+    # Streamed mode: the thinking earcon goes out at once, the reply follows in the same stream
+    response_format = parse_response_format(request.headers.get("accept")) or DEFAULT_RESPONSE_FORMAT
+    if wants_earcon(request.headers, response_format):
+        return StreamingResponse(
+            stream_with_earcon(
+                core.process_audio_logic(event, response_format=response_format),
+                response_format,
+                fallback_audio=await core.serve_canned_audio("say_again.mp3", response_format)
+            ),
+            media_type=response_format.content_type
+        )
+
     response = await core.process_audio_logic(event)
 
     if response.status_code != 200:
@@ -21,10 +56,104 @@ async def upload(request: Request):
     
     return Response(
         content=bytes(response.body),
-        media_type="audio/mpeg",
-        status_code=response.status_code
+        media_type=response.headers.get("Content-Type", "audio/mpeg"),
+        status_code=response.status_code,
+        headers=response.headers
+    )
+
+@app.post("/stream")
+async def upload_streamed(request: Request):
+    """
+    Same turn as POST /, but the MP3 reply is written while it is synthesized and encoded.
+
+    In Lambda this runs behind the Lambda Web Adapter with a RESPONSE_STREAM function URL
+    (see serverless.yml), the bytes go out raw instead of base64 through API Gateway.
+    """
+    event = {
+        "body": await request.json(),
+        "headers": dict(request.headers)
+    }
+    response = await core.process_audio_logic(event, stream=True)
+
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.body)
+
+    # Canned and pre-rendered replies are complete already and go out in one piece
+    if isinstance(response.body, StreamedAudio):
+        return StreamingResponse(response.body, media_type=response.headers.get("Content-Type"), headers=response.headers)
+    return Response(
+        content=bytes(response.body),
+        media_type=response.headers.get("Content-Type", "audio/mpeg"),
+        status_code=response.status_code,
+        headers=response.headers
     )
 
+@jobs_router.post("/jobs", status_code=202)
+async def submit_job(request: Request):
+    """
+    Same body as POST /, answered at once with the ID of a job running the turn.
+
+    Fetch the reply with GET /jobs/{job_id}, the device does not hold a connection
+    open while the turn runs.
+    """
+    event = {
+        "body": await request.json(),
+        "headers": dict(request.headers)
+    }
+    try:
+        job_id = await job_queue.submit(event)
+    except Overloaded:
+        return JSONResponse({"status": "busy"}, status_code=503, headers={"Retry-After": "5"})
+    return JSONResponse(
+        {"job_id": job_id, "status": "queued"}, status_code=202, headers={"Location": f"/jobs/{job_id}"}
+    )
+
+@jobs_router.get("/jobs/{job_id}")
+async def fetch_job(job_id: str, wait: float = 0.0):
+    """
+    The reply of a job, like POST / returns it, once the job finished.
+
+    `wait` long-polls: the request is answered as soon as the job finishes, or after `wait`
+    seconds with 202 and the job status.
+    """
+    job = await job_queue.wait(job_id, timeout=wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    if not job.finished:
+        return JSONResponse({"job_id": job_id, "status": job.status}, status_code=202, headers={"Retry-After": "1"})
+    if job.status_code != 200:
+        raise HTTPException(status_code=job.status_code, detail=job.body or "Job failed")
+
+    return Response(
+        content=bytes(job.body),
+        media_type=job.headers.get("Content-Type", "audio/mpeg"),
+        status_code=200,
+        headers=job.headers
+    )
+
+if JOBS_ENABLED:
+    app.include_router(jobs_router)
+    register_metrics("jobs", job_queue.stats)
+
+@app.post("/telemetry", status_code=204)
+async def report_telemetry(request: Request):
+    """
+    Timestamps the device took around a turn, one report or a list of them.
+
+    A report names the turn by the X-Request-Id of its reply, see app/telemetry.py.
+    """
+    try:
+        body = await request.json()
+        for report in body if isinstance(body, list) else [body]:
+            latency_telemetry.report(report)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(status_code=204)
+
+@app.get("/metrics")
+async def metrics():
+    return collect_metrics()
+
 @app.on_event("startup")
 async def startup_event():
     # Get the local IP address
@@ -36,4 +165,14 @@ async def startup_event():
     finally:
         s.close()
     
-    print(f"Local IP address: {local_ip}")
\ No newline at end of file
+    logger.info("Local IP address: %s", local_ip)
+
+    # Encode the earcon now, so the first streamed reply does not wait for ffmpeg
+    earcon_audio(DEFAULT_RESPONSE_FORMAT)
+    keepalive_audio(DEFAULT_RESPONSE_FORMAT)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_queue.stop(timeout=JOB_DEADLINE_SECONDS)
+    await drain_background_tasks()
+    flush_logs()
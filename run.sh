@@ -0,0 +1,4 @@
+#!/bin/sh
+# Entry point of the streaming function. The Lambda Web Adapter (AWS_LAMBDA_EXEC_WRAPPER) starts
+# this script, waits for the server on $PORT and streams its responses through the function URL.
+exec python -m uvicorn --port="$PORT" main:app
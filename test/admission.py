@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from unittest.mock import patch
+from app.admission import AdmissionController, ProviderLimiter, Overloaded, provider_limit
+from app.core import admit_user_turn, Response
+
+@pytest.mark.asyncio
+async def test_requests_within_budget_are_admitted():
+    controller = AdmissionController(max_requests=2, max_bytes=100)
+    async with controller.admit(10):
+        async with controller.admit(10):
+            assert controller.stats()["in_flight_requests"] == 2
+            assert controller.stats()["in_flight_bytes"] == 20
+    assert controller.stats()["in_flight_requests"] == 0
+    assert controller.stats()["admitted"] == 2
+
+@pytest.mark.asyncio
+async def test_queued_request_runs_when_a_slot_frees():
+    controller = AdmissionController(max_requests=1, max_bytes=100, max_queue_wait=1.0, initial_service_time=0.1)
+    order = []
+
+    async def request(name, hold):
+        async with controller.admit(10):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    first = asyncio.create_task(request("first", 0.05))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(request("second", 0))
+    await asyncio.sleep(0)
+    assert controller.stats()["queue_depth"] == 1
+
+    await asyncio.gather(first, second)
+    assert order == ["first", "second"]
+    assert controller.stats()["shed"] == 0
+
+@pytest.mark.asyncio
+async def test_bytes_budget_queues_large_requests():
+    controller = AdmissionController(max_requests=10, max_bytes=100, max_queue_wait=0.05, initial_service_time=0.01)
+    async with controller.admit(80):
+        with pytest.raises(Overloaded):
+            async with controller.admit(40):
+                pass
+    assert controller.stats()["shed"] == 1
+
+@pytest.mark.asyncio
+async def test_shed_immediately_when_estimated_wait_exceeds_budget():
+    controller = AdmissionController(max_requests=1, max_bytes=100, max_queue_wait=1.0, initial_service_time=5.0)
+    async with controller.admit(10):
+        with pytest.raises(Overloaded):
+            async with controller.admit(10):
+                pass
+    assert controller.stats()["queue_depth"] == 0
+    assert controller.stats()["shed"] == 1
+
+@pytest.mark.asyncio
+async def test_provider_limit_bounds_concurrency():
+    limiter = ProviderLimiter(default_limit=2)
+    running = 0
+    peak = 0
+
+    async def call():
+        nonlocal running, peak
+        async with limiter.slot("fake_provider"):
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*[call() for _ in range(6)])
+    assert peak == 2
+    assert limiter.stats()["fake_provider"]["calls"] == 6
+
+@pytest.mark.asyncio
+async def test_provider_limit_decorator_keeps_the_result():
+    @provider_limit("fake_provider")
+    async def send_request(text):
+        return text.upper()
+
+    assert await send_request("hello") == "HELLO"
+
+@pytest.mark.asyncio
+@patch('app.core.admission_controller', AdmissionController(max_requests=1, max_queue_wait=0.0))
+@patch('app.core.process_user_turn')
+async def test_shed_request_gets_busy_clip(mock_process_user_turn):
+    from app.core import admission_controller
+    mock_process_user_turn.return_value = Response(status_code=200, body=b"reply")
+
+    async with admission_controller.admit(10):
+        result = await admit_user_turn("test_user", b"audio", 0)
+
+    assert result.status_code == 200
+    assert result.headers["X-Buddy-Degraded"] == "busy"
+    assert result.body.startswith(b"ID3")
+    mock_process_user_turn.assert_not_called()
+
+if __name__ == '__main__':
+    pytest.main()
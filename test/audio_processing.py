@@ -0,0 +1,181 @@
+import struct
+import warnings
+import numpy as np
+import pytest
+from app.audio_processing import (
+    decode_mulaw, decode_ima_adpcm, decode_upload_audio, IMA_STEP_TABLE, IMA_INDEX_TABLE,
+    to_mono_pcm16, resample_pcm, normalize_input_audio
+)
+
+STEP_TABLE = [int(step) for step in IMA_STEP_TABLE]
+INDEX_TABLE = [int(index) for index in IMA_INDEX_TABLE]
+
+def load_pcm(filename):
+    with open(f'test/sounds/{filename}.wav', 'rb') as file:
+        return file.read()[44:]
+
+def reference_ima_adpcm_encode(samples, block_align):
+    """Scalar IMA ADPCM encoder (Microsoft WAV block layout), one predictor per block."""
+    samples_per_block = 1 + 2 * (block_align - 4)
+    encoded = bytearray()
+    index = 0
+    for start in range(0, len(samples), samples_per_block):
+        block = samples[start:start + samples_per_block]
+        predictor = block[0]
+        encoded += struct.pack('<hBB', predictor, index, 0)
+        nibbles = []
+        for sample in block[1:]:
+            step = STEP_TABLE[index]
+            diff = sample - predictor
+            nibble = 8 if diff < 0 else 0
+            diff = abs(diff)
+            vpdiff = step >> 3
+            mask = 4
+            while mask:
+                if diff >= step:
+                    nibble |= mask
+                    diff -= step
+                    vpdiff += step
+                step >>= 1
+                mask >>= 1
+            predictor = predictor - vpdiff if nibble & 8 else predictor + vpdiff
+            predictor = max(-32768, min(32767, predictor))
+            index = max(0, min(88, index + INDEX_TABLE[nibble]))
+            nibbles.append(nibble)
+        if len(nibbles) % 2:
+            nibbles.append(0)
+        encoded += bytes(low | (high << 4) for low, high in zip(nibbles[0::2], nibbles[1::2]))
+    return bytes(encoded)
+
+def reference_ima_adpcm_decode(adpcm_data, block_align):
+    """Scalar IMA ADPCM decoder, the behaviour the vectorized decoder must reproduce."""
+    samples = []
+    for start in range(0, len(adpcm_data), block_align):
+        block = adpcm_data[start:start + block_align]
+        predictor, index, _ = struct.unpack('<hBB', block[:4])
+        samples.append(predictor)
+        for byte in block[4:]:
+            for nibble in (byte & 0x0F, byte >> 4):
+                step = STEP_TABLE[index]
+                diff = step >> 3
+                if nibble & 1:
+                    diff += step >> 2
+                if nibble & 2:
+                    diff += step >> 1
+                if nibble & 4:
+                    diff += step
+                predictor = predictor - diff if nibble & 8 else predictor + diff
+                predictor = max(-32768, min(32767, predictor))
+                index = max(0, min(88, index + INDEX_TABLE[nibble]))
+                samples.append(predictor)
+    return struct.pack(f'<{len(samples)}h', *samples)
+
+def test_mulaw_matches_g711_reference():
+    audioop = pytest.importorskip("audioop")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        pcm = load_pcm("normal_audio_with_transcription")
+        mulaw = audioop.lin2ulaw(pcm, 2)
+        assert decode_mulaw(bytes(range(256))) == audioop.ulaw2lin(bytes(range(256)), 2)
+        assert decode_mulaw(mulaw) == audioop.ulaw2lin(mulaw, 2)
+
+@pytest.mark.parametrize("block_align", [256, 512, 1024])
+def test_ima_adpcm_matches_scalar_reference(block_align):
+    pcm = load_pcm("normal_audio_with_transcription")
+    samples = list(struct.unpack(f'<{len(pcm) // 2}h', pcm))
+    adpcm = reference_ima_adpcm_encode(samples, block_align)
+
+    decoded = decode_ima_adpcm(adpcm, block_align=block_align)
+    assert decoded == reference_ima_adpcm_decode(adpcm, block_align)
+
+def test_ima_adpcm_round_trip_is_close_to_the_original():
+    pcm = load_pcm("normal_audio_with_transcription")
+    samples = np.frombuffer(pcm, dtype='<i2')
+    adpcm = reference_ima_adpcm_encode(samples.tolist(), 256)
+    assert len(adpcm) <= len(pcm) / 4 + 4 * (len(pcm) // 1010 + 1)
+
+    decoded = np.frombuffer(decode_ima_adpcm(adpcm, block_align=256), dtype='<i2')[:len(samples)]
+    error = decoded.astype(np.float64) - samples
+    signal = samples.astype(np.float64)
+    snr = 10 * np.log10(np.sum(signal ** 2) / np.sum(error ** 2))
+    assert snr > 20
+
+def test_ima_adpcm_matches_audioop_within_a_block():
+    audioop = pytest.importorskip("audioop")
+    samples = (np.sin(np.arange(1001) / 10) * 8000).astype('<i2')
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        # audioop uses a headerless stream with the high nibble first
+        encoded, _ = audioop.lin2adpcm(samples[1:].tobytes(), 2, (int(samples[0]), 0))
+        expected, _ = audioop.adpcm2lin(encoded, 2, (int(samples[0]), 0))
+    block = struct.pack('<hBB', int(samples[0]), 0, 0) + bytes((b >> 4) | ((b & 0x0F) << 4) for b in encoded)
+
+    assert decode_ima_adpcm(block, block_align=len(block))[2:] == expected
+
+def test_decode_upload_audio_dispatch():
+    assert decode_upload_audio(b"\x01\x02") == b"\x01\x02"
+    assert decode_upload_audio(b"\xff", codec="mulaw") == b"\x00\x00"
+    with pytest.raises(ValueError):
+        decode_upload_audio(b"", codec="opus")
+    for block_align in (0, -1, 4):
+        with pytest.raises(ValueError):
+            decode_upload_audio(b"\x00" * 16, codec="ima_adpcm", block_align=block_align)
+
+def sine_pcm(frequency, sample_rate, seconds=1.0, amplitude=10000):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (np.sin(2 * np.pi * frequency * t) * amplitude).astype('<i2').tobytes()
+
+@pytest.mark.parametrize("source_rate", [8000, 15000, 22050, 44100, 48000])
+def test_resample_keeps_in_band_tones(source_rate):
+    resampled = np.frombuffer(resample_pcm(sine_pcm(1000, source_rate), source_rate, 16000), dtype='<i2')
+    assert len(resampled) == 16000
+
+    expected = np.frombuffer(sine_pcm(1000, 16000), dtype='<i2').astype(np.float64)
+    # Skip the filter warm-up at both edges
+    error = resampled[200:-200] - expected[200:-200]
+    snr = 10 * np.log10(np.sum(expected[200:-200] ** 2) / max(np.sum(error ** 2), 1.0))
+    assert snr > 60
+
+def test_resample_removes_tones_above_the_target_nyquist():
+    resampled = np.frombuffer(resample_pcm(sine_pcm(10000, 44100), 44100, 16000), dtype='<i2')
+    rms = np.sqrt(np.mean(resampled[200:-200].astype(np.float64) ** 2))
+    assert rms < 10000 / np.sqrt(2) / 1000  # At least 60 dB down
+
+def test_resample_same_rate_is_a_no_op():
+    pcm = sine_pcm(1000, 16000)
+    assert resample_pcm(pcm, 16000, 16000) is pcm
+
+def test_to_mono_pcm16_bit_depths_and_channels():
+    samples = np.array([1000, -2000, 32767, -32768], dtype=np.int32)
+    pcm16 = samples.astype('<i2').tobytes()
+
+    pcm8 = ((samples >> 8) + 128).astype(np.uint8).tobytes()
+    assert to_mono_pcm16(pcm8, bits_per_sample=8) == ((samples >> 8) << 8).astype('<i2').tobytes()
+
+    pcm24 = b"".join(int(sample << 8).to_bytes(3, "little", signed=True) for sample in samples)
+    assert to_mono_pcm16(pcm24, bits_per_sample=24) == pcm16
+
+    pcm32 = (samples << 16).astype('<i4').tobytes()
+    assert to_mono_pcm16(pcm32, bits_per_sample=32) == pcm16
+
+    stereo = np.stack([samples, samples], axis=1).astype('<i2').tobytes()
+    assert to_mono_pcm16(stereo, num_channels=2) == pcm16
+
+    with pytest.raises(ValueError):
+        to_mono_pcm16(pcm16, bits_per_sample=12)
+
+def test_normalize_input_audio():
+    stereo_44k = np.repeat(np.frombuffer(sine_pcm(440, 44100), dtype='<i2'), 2).tobytes()
+    normalized = normalize_input_audio(stereo_44k, sample_rate=44100, num_channels=2, target_rate=16000)
+    assert len(normalized) == 16000 * 2
+
+    # Lower rates pass through, upsampling would only grow the STT payload
+    pcm_15k = sine_pcm(440, 15000)
+    assert normalize_input_audio(pcm_15k, sample_rate=15000, target_rate=16000) is pcm_15k
+
+    for sample_rate, num_channels in ((0, 1), (-16000, 1), (999983, 1), (16000, 0)):
+        with pytest.raises(ValueError):
+            normalize_input_audio(pcm_15k, sample_rate=sample_rate, num_channels=num_channels)
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import aiohttp
+import pytest
+from unittest.mock import patch
+from app.admission import provider_limit
+from app.circuit_breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN, HALF_OPEN, circuit_breaker, circuit_breakers
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeProvider:
+    """Provider call taking `latency` fake seconds and failing with `error` when set."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = 0
+        self.latency = 0.1
+        self.error = None
+
+    async def request(self):
+        self.calls += 1
+        self.clock.now += self.latency
+        if self.error is not None:
+            raise self.error
+        return "ok"
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def provider(clock):
+    return FakeProvider(clock)
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("azure_tts", failure_rate=0.5, window_seconds=30, min_calls=4, slow_call_seconds=5,
+                          open_seconds=15, half_open_probes=1, clock=clock)
+
+async def call_ignoring_errors(breaker, provider):
+    try:
+        return await breaker.call(provider.request)
+    except (CircuitOpen, RuntimeError, aiohttp.ClientResponseError):
+        return None
+
+def server_error(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+@pytest.mark.asyncio
+async def test_opens_on_failure_rate_and_fails_fast(breaker, provider):
+    await breaker.call(provider.request)
+    await breaker.call(provider.request)
+    provider.error = RuntimeError("connection reset")
+    await call_ignoring_errors(breaker, provider)
+    assert breaker.state == CLOSED  # 1 of 3 failed, below the minimum number of calls
+    await call_ignoring_errors(breaker, provider)
+    assert breaker.state == OPEN  # 2 of 4 failed
+
+    calls = provider.calls
+    with pytest.raises(CircuitOpen) as raised:
+        await breaker.call(provider.request)
+    assert provider.calls == calls
+    assert raised.value.provider == "azure_tts"
+    assert 0 < raised.value.retry_after <= 15
+    assert breaker.stats()["rejected"] == 1
+
+@pytest.mark.asyncio
+async def test_half_open_probe_closes_or_reopens(breaker, provider, clock):
+    provider.error = RuntimeError("down")
+    for _ in range(4):
+        await call_ignoring_errors(breaker, provider)
+    assert breaker.state == OPEN
+
+    clock.now += 16
+    await call_ignoring_errors(breaker, provider)
+    assert breaker.state == OPEN  # The probe failed
+    assert breaker.stats()["opened"] == 2
+
+    clock.now += 16
+    provider.error = None
+    assert await breaker.call(provider.request) == "ok"
+    assert breaker.state == CLOSED
+
+@pytest.mark.asyncio
+async def test_only_one_probe_at_a_time(breaker, provider, clock):
+    provider.error = RuntimeError("down")
+    for _ in range(4):
+        await call_ignoring_errors(breaker, provider)
+    clock.now += 16
+
+    release = asyncio.Event()
+    async def slow_request():
+        await release.wait()
+        return "ok"
+
+    probe = asyncio.ensure_future(breaker.call(slow_request))
+    await asyncio.sleep(0)
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        await breaker.call(provider.request)
+    release.set()
+    assert await probe == "ok"
+    assert breaker.state == CLOSED
+
+@pytest.mark.asyncio
+async def test_client_errors_do_not_count(breaker, provider):
+    provider.error = server_error(400)
+    for _ in range(6):
+        await call_ignoring_errors(breaker, provider)
+    assert breaker.state == CLOSED
+
+    provider.error = server_error(503)
+    for _ in range(6):
+        await call_ignoring_errors(breaker, provider)
+    assert breaker.state == OPEN
+
+@pytest.mark.asyncio
+async def test_slow_calls_count_as_failures(breaker, provider):
+    provider.latency = 6
+    for _ in range(4):
+        assert await call_ignoring_errors(breaker, provider) == "ok"
+    assert breaker.state == OPEN
+
+@pytest.mark.asyncio
+async def test_calls_abandoned_early_are_not_recorded(breaker):
+    async def hanging_request():
+        await asyncio.sleep(10)
+
+    for _ in range(5):
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(breaker.call(hanging_request), 0.01)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls_in_window"] == 0
+
+@pytest.mark.asyncio
+async def test_old_outcomes_leave_the_window(breaker, provider, clock):
+    provider.error = RuntimeError("blip")
+    for _ in range(3):
+        await call_ignoring_errors(breaker, provider)
+    clock.now += 60
+    provider.error = None
+    await breaker.call(provider.request)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls_in_window"] == 1
+
+@pytest.mark.asyncio
+async def test_waiting_for_a_provider_slot_is_not_timed():
+    # Stacked as on the provider request functions: the breaker only times the call itself
+    @provider_limit("saturated_provider")
+    @circuit_breaker("saturated_provider", slow_call_seconds=0.1)
+    async def request():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    try:
+        with patch.dict(os.environ, {"SATURATED_PROVIDER_MAX_CONCURRENCY": "1"}):
+            results = await asyncio.gather(*(request() for _ in range(10)))
+        assert results == ["ok"] * 10
+        assert circuit_breakers["saturated_provider"].state == CLOSED
+        assert circuit_breakers["saturated_provider"].opened == 0
+    finally:
+        circuit_breakers.pop("saturated_provider", None)
+
+if __name__ == '__main__':
+    pytest.main()
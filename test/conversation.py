@@ -0,0 +1,99 @@
+import pytest
+from app.conversation import Conversation, Message
+from app.core import append_message, limit_messages, is_rate_limit_reached
+
+def make_messages(count):
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"message {i}",
+            "timestamp": str(1730000000.5 + i)
+        }
+        for i in range(count)
+    ]
+
+def test_message_reads_like_a_dict():
+    message = Message.from_dict({"role": "user", "content": "Hello", "timestamp": "1730000000.5"})
+    assert message.timestamp == 1730000000.5
+    assert message["timestamp"] == "1730000000.5"
+    assert message.get("content") == "Hello"
+    assert message.get("missing", "default") == "default"
+    assert dict(message) == {"role": "user", "content": "Hello", "timestamp": "1730000000.5"}
+    with pytest.raises(KeyError):
+        message["missing"]
+
+def test_message_keeps_legacy_timestamps():
+    message = Message.from_dict({"role": "user", "content": "Hello", "timestamp": "2024-10-01T10:00:00"})
+    assert message.timestamp == "2024-10-01T10:00:00"
+    assert message.to_dict()["timestamp"] == "2024-10-01T10:00:00"
+
+def test_conversation_equals_the_dicts():
+    messages = make_messages(5)
+    conversation = Conversation(messages)
+    assert conversation == messages
+    assert messages == conversation
+    assert conversation.to_dicts() == messages
+    assert conversation != messages[:-1]
+
+def test_append_shares_the_history():
+    conversation = Conversation(make_messages(4))
+    first = conversation.appended(Message("user", "five", 1.0))
+    second = first.appended(Message("assistant", "six", 2.0))
+
+    assert len(conversation) == 4
+    assert len(first) == 5
+    assert [message["content"] for message in second[-2:]] == ["five", "six"]
+    assert second._items is conversation._items
+
+def test_append_to_an_older_view_forks():
+    conversation = Conversation(make_messages(2))
+    newer = conversation.appended(Message("user", "newer", 1.0))
+    forked = conversation.appended(Message("user", "forked", 2.0))
+
+    assert newer[-1]["content"] == "newer"
+    assert forked[-1]["content"] == "forked"
+    assert len(forked) == 3
+    assert forked._items is not conversation._items
+
+def test_append_of_the_same_message_reuses_the_history():
+    conversation = Conversation(make_messages(2))
+    message = Message("user", "shared", 1.0)
+    window = conversation.tail(1).appended(message)
+    full = conversation.appended(message)
+
+    assert full._items is conversation._items
+    assert [m["content"] for m in window] == ["message 1", "shared"]
+    assert len(full) == 3
+
+def test_slices_and_tails_are_views():
+    conversation = Conversation(make_messages(10))
+    tail = conversation.tail(4)
+    assert tail == make_messages(10)[-4:]
+    assert tail._items is conversation._items
+    assert conversation[2:5] == make_messages(10)[2:5]
+    assert conversation[-0:] == conversation
+    assert conversation[::2] == make_messages(10)[::2]
+    assert list(reversed(tail)) == list(reversed(make_messages(10)[-4:]))
+    with pytest.raises(IndexError):
+        tail[4]
+
+def test_core_helpers_use_views():
+    conversation = Conversation(make_messages(30))
+    limited = limit_messages(conversation, 5)
+    assert len(limited) == 10
+    assert limited._items is conversation._items
+
+    appended = append_message(conversation, "hello", "user", verbose=False, timestamp=5.0)
+    assert appended[-1] == {"role": "user", "content": "hello", "timestamp": "5.0"}
+    assert appended._items is conversation._items
+
+def test_rate_limit_reads_parsed_timestamps():
+    conversation = Conversation()
+    for i in range(4):
+        conversation = append_message(conversation, f"message {i}", "user", verbose=False)
+    assert is_rate_limit_reached(conversation, 2)
+    assert not is_rate_limit_reached(conversation, 3)
+    assert is_rate_limit_reached(conversation.to_dicts(), 2)
+
+if __name__ == '__main__':
+    pytest.main()
@@ -1,10 +1,28 @@
+import asyncio
 import pytest
 import pytest_asyncio
-from unittest.mock import patch, AsyncMock
+from unittest.mock import patch, AsyncMock, MagicMock
 import base64
 import json
+import numpy as np
 from app.core import process_audio_logic, limit_messages, DEFAULT_SYSTEM_PROMPT
-from app.audio_processing import amplify_pcm_audio, compress_to_mp3
+from app.audio_processing import amplify_pcm_audio, compress_to_mp3, decode_mp3_to_pcm
+from app.idempotency import idempotency_cache
+from app.background import drain_background_tasks
+from app.reply_cache import reply_cache
+from app.streaming import StreamedAudio
+from app.circuit_breaker import CircuitOpen
+from app.shadow import ShadowRunner
+from app.telemetry import latency_telemetry
+
+# The fixtures reuse the same recordings, so replies must not be replayed across tests
+@pytest.fixture(autouse=True)
+def clear_idempotency_cache():
+    idempotency_cache.clear()
+    reply_cache.clear()
+    yield
+    idempotency_cache.clear()
+    reply_cache.clear()
 
 # Load the test sound files as base64 encoded strings
 def load_sound_file(filename):
@@ -139,6 +157,390 @@ async def test_process_audio_logic_normal_audio_with_transcription(
     mock_send_gpt_request.assert_called_once()
     mock_send_azure_tts_request.assert_called_once()
 
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.get_user_summary')
+@patch('app.core.run_in_background')
+# A plain mock, an AsyncMock's coroutine would never be awaited by the mocked run_in_background
+@patch('app.core.compact_user_session', new_callable=MagicMock)
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_long_history_uses_summary(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_compact_user_session, mock_run_in_background, mock_get_user_summary,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription, mock_responses):
+
+    transcription_response, gpt_response, tts_response = mock_responses
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.return_value = gpt_response
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_summary.return_value = {"Summary": "user likes dinosaurs", "SummaryUntil": None}
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 2,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+    # 40 old messages, far more than the active window of 2 pairs
+    mock_get_user_session.return_value = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"old {i}", "timestamp": str(1000 + i)}
+        for i in range(40)
+    ]
+
+    result = await process_audio_logic(event_normal_audio_with_transcription)
+    assert result.status_code == 200
+
+    # System prompt, summary, 4 windowed messages and the new transcription
+    api_messages = mock_send_gpt_request.call_args[0][0]
+    assert len(api_messages) == 7
+    assert "user likes dinosaurs" in api_messages[1]["content"]
+    assert api_messages[-1]["content"] == "transcribed text"
+
+    # Older turns are summarized off the request path
+    mock_get_user_summary.assert_called_once_with('test_user')
+    mock_run_in_background.assert_called_once()
+    mock_compact_user_session.assert_called_once()
+
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.get_user_summary')
+@patch('app.core.request_compaction', new_callable=MagicMock)
+@patch('app.core.compact_user_session', new_callable=MagicMock)
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+@patch('app.core.SUMMARY_FUNCTION_NAME', 'buddy-dev-app')
+async def test_process_audio_logic_lambda_hands_compaction_to_another_invocation(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_compact_user_session, mock_request_compaction, mock_get_user_summary,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription, mock_responses):
+
+    transcription_response, gpt_response, tts_response = mock_responses
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.return_value = gpt_response
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_summary.return_value = {"Summary": None, "SummaryUntil": None}
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 2,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+    mock_get_user_session.return_value = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"old {i}", "timestamp": str(1000 + i)}
+        for i in range(40)
+    ]
+    mock_request_compaction.return_value = asyncio.sleep(0)
+
+    result = await process_audio_logic(event_normal_audio_with_transcription)
+    await drain_background_tasks()
+
+    assert result.status_code == 200
+    # Only the asynchronous invoke is waited for, never the summary's GPT call
+    mock_request_compaction.assert_called_once_with('test_user')
+    mock_compact_user_session.assert_not_called()
+    mock_send_gpt_request.assert_called_once()
+
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_retry_is_replayed(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription, mock_responses):
+
+    transcription_response, gpt_response, tts_response = mock_responses
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.return_value = gpt_response
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+
+    # The device re-POSTs the same recording after a Wi-Fi hiccup
+    first = await process_audio_logic(event_normal_audio_with_transcription)
+    retry = await process_audio_logic(event_normal_audio_with_transcription)
+
+    assert first.status_code == 200
+    assert retry.body == first.body
+
+    # The pipeline ran once and the turn was stored once
+    mock_send_azure_stt_request.assert_called_once()
+    mock_send_gpt_request.assert_called_once()
+    mock_send_azure_tts_request.assert_called_once()
+    mock_update_user_session.assert_called_once()
+
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_reply_carries_timing_headers(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription, mock_responses):
+
+    transcription_response, gpt_response, tts_response = mock_responses
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.return_value = gpt_response
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+
+    event = {**event_normal_audio_with_transcription, "headers": {"X-Request-Id": "req-42"}}
+    first = await process_audio_logic(event)
+    retry = await process_audio_logic({**event, "headers": {"X-Request-Id": "req-43"}})
+
+    assert first.headers["X-Request-Id"] == "req-42"
+    assert first.headers["Server-Timing"].startswith("total;dur=")
+    # The replayed reply is answered under the retry's own id
+    assert retry.headers["X-Request-Id"] == "req-43"
+
+    # The device's report of the turn is correlated with the server time
+    intervals = latency_telemetry.report({
+        "request_id": "req-42", "firmware_version": "1.4.0",
+        "record_end": 1000, "request_sent": 1200, "first_byte": 2900, "playback_start": 3000,
+    })
+    assert intervals["end_to_end"] == 2000
+    assert 0 < intervals["server"] < 1700
+    assert intervals["network"] == pytest.approx(1700 - intervals["server"])
+
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_mulaw_upload(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    mock_responses):
+
+    transcription_response, gpt_response, tts_response = mock_responses
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.return_value = gpt_response
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+
+    # One second of mu-law silence (0xFF) at 15 kHz, half the size of the PCM upload
+    event = {
+        "body": json.dumps({
+            "user_id": "test_user",
+            "audio_data": base64.b64encode(b"\xff" * 15000).decode("utf-8"),
+            "audio_codec": "mulaw"
+        })
+    }
+    result = await process_audio_logic(event)
+    assert result.status_code == 200
+
+    # STT receives the decoded 16-bit PCM at its own 15 kHz, nothing is upsampled
+    wav_data = mock_send_azure_stt_request.call_args[0][0]
+    assert int.from_bytes(wav_data[24:28], "little") == 15000
+    assert wav_data[44:] == b"\x00\x00" * 15000
+
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_accept_header_selects_reply_format(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription, mock_responses):
+
+    transcription_response, gpt_response, tts_response = mock_responses
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.return_value = gpt_response
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True,
+        "ResponseFormat": "audio/mpeg; rate=24000; bitrate=48k"
+    }
+
+    # The request header takes precedence over the per-user format
+    event = dict(event_normal_audio_with_transcription, headers={"Accept": "audio/mpeg; rate=16000; bitrate=16k"})
+    result = await process_audio_logic(event)
+
+    amplified_audio_data = amplify_pcm_audio(tts_response, factor=3)
+    expected_audio = compress_to_mp3(amplified_audio_data, sample_rate=24000, bitrate='16k', output_sample_rate=16000)
+
+    assert result.status_code == 200
+    assert result.body == expected_audio
+    assert result.headers['Content-Type'] == "audio/mpeg"
+
+@pytest.mark.asyncio
+@patch('app.core.SESSION_WRITE_MODE', 'write_behind')
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_write_behind_session(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription, mock_responses):
+
+    transcription_response, gpt_response, tts_response = mock_responses
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.return_value = gpt_response
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+
+    result = await process_audio_logic(event_normal_audio_with_transcription)
+    assert result.status_code == 200
+
+    # The session is persisted after the response, in the background
+    mock_update_user_session.assert_not_called()
+    await drain_background_tasks()
+    mock_update_user_session.assert_called_once()
+    user_id, messages = mock_update_user_session.call_args[0]
+    assert user_id == 'test_user'
+    assert [message['content'] for message in messages] == ["transcribed text", "gpt response"]
+
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_reply_cache_skips_gpt(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription, mock_responses):
+
+    transcription_response, _, tts_response = mock_responses
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.side_effect = ["reply one", "reply two", "reply three"]
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True,
+        "ReplyCache": "shared"
+    }
+
+    # The first turns collect the reply variants, then the utterance is answered without GPT
+    for request_id in range(4):
+        body = json.loads(event_normal_audio_with_transcription["body"])
+        body["request_id"] = str(request_id)
+        result = await process_audio_logic({"body": json.dumps(body)})
+        assert result.status_code == 200
+
+    assert mock_send_gpt_request.call_count == 3
+    assert reply_cache.stats()["hits"] == 1
+    assistant_reply = mock_update_user_session.call_args[0][1][-1]["content"]
+    assert assistant_reply in ("reply one", "reply two", "reply three")
+
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_long_reply_fans_out_tts(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription, mock_responses):
+
+    transcription_response, _, tts_response = mock_responses
+    long_reply = ("วันนี้บั้ดดี้ไปเที่ยวสวนสัตว์มาแล้วสนุกมากเลย เห็นช้างตัวใหญ่กำลังกินกล้วยอยู่ "
+                  "แล้วก็มีลิงน้อยห้อยโหนอยู่บนต้นไม้ด้วยนะ หนูชอบสัตว์อะไรที่สุดเหรอ")
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.return_value = long_reply
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+
+    result = await process_audio_logic(event_normal_audio_with_transcription)
+    assert result.status_code == 200
+
+    # One TTS request per chunk, together they cover the whole reply
+    assert mock_send_azure_tts_request.call_count > 1
+    synthesized = [call[0][0] for call in mock_send_azure_tts_request.call_args_list]
+    assert " ".join(synthesized) == long_reply
+
+@pytest.mark.asyncio
+async def test_process_audio_logic_unsupported_codec():
+    event = {
+        "body": json.dumps({
+            "user_id": "test_user",
+            "audio_data": base64.b64encode(b"\x00" * 100).decode("utf-8"),
+            "audio_codec": "opus"
+        })
+    }
+    result = await process_audio_logic(event)
+    assert result.status_code == 400
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("params", [
+    {"audio_codec": "ima_adpcm", "adpcm_block_align": 0},
+    {"audio_codec": "ima_adpcm", "adpcm_block_align": "large"},
+    {"sample_rate": 0},
+    {"sample_rate": -15000},
+    {"channels": 0},
+])
+async def test_process_audio_logic_invalid_codec_parameters(params):
+    event = {
+        "body": json.dumps({
+            "user_id": "test_user",
+            "audio_data": base64.b64encode(b"\x00" * 100).decode("utf-8"),
+            **params
+        })
+    }
+    result = await process_audio_logic(event)
+    assert result.status_code == 400
+
 @pytest.mark.asyncio
 @patch('app.core.get_user_session')
 @patch('app.core.update_user_session')
@@ -178,22 +580,27 @@ async def test_process_audio_logic_normal_audio_without_transcription(
 @patch('app.core.get_user_session')
 @patch('app.core.update_user_session')
 @patch('app.core.get_user_system_prompt')
+@patch('app.core.get_user_summary')
 @patch('app.core.send_azure_stt_request')
 @patch('app.core.send_gpt_request')
 @patch('app.core.send_azure_tts_request')
 async def test_process_audio_logic_not_whitelisted(
-    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request, mock_get_user_summary,
     mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
     event_normal_audio_with_transcription):
     
     # Mock user not being whitelisted
     mock_get_user_system_prompt.return_value = {
         "SystemPrompt": None,
-        "ActiveMessageLimit": 10,
+        "ActiveMessageLimit": 2,
         "DailyRateLimit": 100,
         "Whitelist": False  # User not whitelisted
     }
-    mock_get_user_session.return_value = []
+    # A history past the active window, which would have a summary
+    mock_get_user_session.return_value = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"old {i}", "timestamp": str(1000 + i)}
+        for i in range(40)
+    ]
 
     # Call the function being tested
     result = await process_audio_logic(event_normal_audio_with_transcription)
@@ -208,3 +615,151 @@ async def test_process_audio_logic_not_whitelisted(
     mock_send_azure_stt_request.assert_not_called()
     mock_send_gpt_request.assert_not_called()
     mock_send_azure_tts_request.assert_not_called()
+    mock_get_user_summary.assert_not_called()
+
+@pytest.mark.asyncio
+@patch('app.core.PROFILING_ENABLED', True)
+@patch('app.profiling.PROFILE_HEADER_ENABLED', True)
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_profile_header_writes_a_profile(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_get_user_system_prompt,
+    mock_update_user_session, mock_get_user_session, event_very_short_audio, mock_responses, tmp_path):
+
+    _, gpt_response, tts_response = mock_responses
+    mock_send_gpt_request.return_value = gpt_response
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": None,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+    event = {**event_very_short_audio, "headers": {"X-Buddy-Profile": "1", "X-Request-Id": "slow-turn"}}
+
+    with patch('app.profiling.PROFILE_DIR', str(tmp_path)):
+        result = await process_audio_logic(event)
+
+    assert result.status_code == 200
+    written = sorted(path.name.split("-", 1)[1] for path in tmp_path.iterdir())
+    assert written == ["slow-turn.collapsed", "slow-turn.memory.txt", "slow-turn.speedscope.json"]
+
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_streams_the_reply(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription, mock_responses):
+
+    transcription_response, _, _ = mock_responses
+    long_reply = ("วันนี้บั้ดดี้ไปเที่ยวสวนสัตว์มาแล้วสนุกมากเลย เห็นช้างตัวใหญ่กำลังกินกล้วยอยู่ "
+                  "แล้วก็มีลิงน้อยห้อยโหนอยู่บนต้นไม้ด้วยนะ หนูชอบสัตว์อะไรที่สุดเหรอ")
+    tone = (np.sin(2 * np.pi * 220 * np.arange(12000) / 24000) * 8000).astype('<i2').tobytes()
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.return_value = long_reply
+    mock_send_azure_tts_request.return_value = tone
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+
+    result = await process_audio_logic(event_normal_audio_with_transcription, stream=True)
+    assert result.status_code == 200
+    assert isinstance(result.body, StreamedAudio)
+    assert result.headers['Content-Type'] == 'audio/mpeg'
+
+    # The session is saved with the full reply text before the audio is complete
+    mock_update_user_session.assert_called_once()
+    mp3_data = await result.body.read()
+    chunks = mock_send_azure_tts_request.call_count
+    assert chunks > 1
+    decoded_seconds = len(decode_mp3_to_pcm(mp3_data)) / 2 / 24000
+    assert decoded_seconds > chunks * 0.5
+
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_open_circuit_serves_busy_clip(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription):
+
+    mock_send_azure_stt_request.side_effect = CircuitOpen("azure_stt", 11.2)
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+
+    result = await process_audio_logic(event_normal_audio_with_transcription)
+
+    # A playable clip instead of a 500, and no turn recorded
+    assert result.status_code == 200
+    assert result.body[:3] == b"ID3"
+    assert result.headers["X-Buddy-Degraded"] == "azure_stt_unavailable"
+    assert result.headers["Retry-After"] == "12"
+    mock_send_gpt_request.assert_not_called()
+    mock_update_user_session.assert_not_called()
+
+@pytest.mark.asyncio
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+async def test_process_audio_logic_mirrors_shadow_traffic(
+    mock_send_azure_tts_request, mock_send_gpt_request, mock_send_azure_stt_request,
+    mock_get_user_system_prompt, mock_update_user_session, mock_get_user_session,
+    event_normal_audio_with_transcription, mock_responses):
+
+    transcription_response, gpt_response, tts_response = mock_responses
+    mock_send_azure_stt_request.return_value = transcription_response
+    mock_send_gpt_request.return_value = gpt_response
+    mock_send_azure_tts_request.return_value = tts_response
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+    candidate_stt = AsyncMock(return_value={"text": "transcribed text"})
+    candidate_llm = AsyncMock(return_value="another response")
+    candidate_tts = AsyncMock(return_value=tts_response)
+    shadow = ShadowRunner(
+        candidates={"stt": {"deepgram_stt": candidate_stt}, "llm": {"groq": candidate_llm}, "tts": {"openai_tts": candidate_tts}},
+        sample_rate=1.0, records_path=""
+    )
+
+    with patch('app.shadow.shadow_runner', shadow):
+        result = await process_audio_logic(event_normal_audio_with_transcription)
+        await drain_background_tasks()
+
+    assert result.status_code == 200
+    # The candidates got the primary calls' inputs
+    assert candidate_stt.call_args[0][0] == mock_send_azure_stt_request.call_args[0][0]
+    assert candidate_llm.call_args[0][0] == mock_send_gpt_request.call_args[0][0]
+    candidate_tts.assert_called_once_with("gpt response")
+    records = {record["stage"]: record for record in shadow.records}
+    assert set(records) == {"stt", "llm", "tts"}
+    assert records["stt"]["cer"] == 0.0
+    assert "error" not in records["tts"]
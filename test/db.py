@@ -4,6 +4,7 @@ import pytest
 import datetime
 from botocore.exceptions import ClientError
 from app.db import get_user_session, update_user_session, get_user_system_prompt, update_user_system_prompt, dynamodb
+from app.session_codec import decode_messages, CODEC_VERSION
 
 @pytest.fixture(scope='module')
 def dynamodb_client():
@@ -115,10 +116,16 @@ def test_update_user_session(dynamodb_client):
     update_user_session(user_id, messages)
 
     response = messages_table.get_item(Key={'UserID': user_id})
-    stored_messages = response.get('Item', {}).get('Messages', [])
+    item = response.get('Item', {})
+    assert 'Messages' not in item
+    assert item['Codec'] == CODEC_VERSION
+    stored_messages = decode_messages(item['MessagesBlob'])
     assert len(stored_messages) == 1
     assert stored_messages[0]['content'] == 'Updated message'
 
+    # Reading back goes through the codec transparently
+    assert get_user_session(user_id) == stored_messages
+
 def test_get_user_system_prompt(dynamodb_client):
     _, prompts_table = dynamodb_client
 
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import pytest
+import pytest_asyncio
+from unittest.mock import patch
+from app.deadline import Deadline, StageTimeout, run_stage
+from app.core import process_audio_logic, SAY_AGAIN_REPLY
+from app.idempotency import idempotency_cache
+
+def load_sound_file(filename):
+    with open(f'test/sounds/{filename}.txt', 'r') as file:
+        return file.read()
+
+@pytest.fixture
+def event_normal_audio_with_transcription():
+    return {
+        "body": json.dumps({
+            "user_id": "test_user",
+            "audio_data": load_sound_file("normal_audio_with_transcription")
+        })
+    }
+
+@pytest.fixture(autouse=True)
+def clear_idempotency_cache():
+    idempotency_cache.clear()
+    yield
+    idempotency_cache.clear()
+
+class FakeLambdaContext:
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+def test_deadline_from_lambda_context_keeps_a_margin():
+    deadline = Deadline.from_lambda_context(FakeLambdaContext(), margin=2)
+    assert 27.9 < deadline.remaining() <= 28
+
+@patch.dict('app.deadline.STAGE_TIMEOUTS', {"gpt": 12.0})
+@patch.dict('app.deadline.STAGE_RESERVES', {"gpt": 3.0})
+def test_stage_timeout_is_bounded_by_reserve_and_stage_limit():
+    assert 11.9 < Deadline(25).stage_timeout("gpt") <= 12.0
+    assert 1.9 < Deadline(5).stage_timeout("gpt") <= 2.0
+    assert Deadline(2).stage_timeout("gpt") == 0.0
+
+@pytest.mark.asyncio
+async def test_run_stage_without_deadline_is_unbounded():
+    async def stage():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    assert await run_stage("gpt", stage()) == "done"
+
+@pytest.mark.asyncio
+@patch.dict('app.deadline.STAGE_RESERVES', {"gpt": 0.0})
+async def test_run_stage_records_the_fallback():
+    deadline = Deadline(0.05)
+
+    with pytest.raises(StageTimeout):
+        await run_stage("gpt", asyncio.sleep(1), deadline)
+    assert deadline.fallbacks == ["gpt_timeout"]
+
+@pytest.mark.asyncio
+@patch.dict('app.deadline.STAGE_RESERVES', {"queue": 0.0, "stt": 0.0, "gpt": 0.0, "tts": 0.0})
+@patch('app.core.get_user_session')
+@patch('app.core.update_user_session')
+@patch('app.core.get_user_system_prompt')
+@patch('app.core.send_azure_stt_request')
+@patch('app.core.send_gpt_request')
+@patch('app.core.send_azure_tts_request')
+@patch('app.core.serve_audio_from_file')
+async def test_slow_gpt_falls_back_to_canned_reply(
+    mock_serve_audio_from_file, mock_send_azure_tts_request, mock_send_gpt_request,
+    mock_send_azure_stt_request, mock_get_user_system_prompt, mock_update_user_session,
+    mock_get_user_session, event_normal_audio_with_transcription):
+
+    async def slow_gpt(messages):
+        await asyncio.sleep(1)
+        return "too late"
+
+    mock_send_azure_stt_request.return_value = {"text": "transcribed text"}
+    mock_send_gpt_request.side_effect = slow_gpt
+    mock_serve_audio_from_file.return_value = b'pre_recorded_audio_data'
+    mock_get_user_session.return_value = []
+    mock_get_user_system_prompt.return_value = {
+        "SystemPrompt": None,
+        "ActiveMessageLimit": 10,
+        "DailyRateLimit": 100,
+        "Whitelist": True
+    }
+
+    result = await process_audio_logic(event_normal_audio_with_transcription, Deadline(0.2))
+
+    assert result.status_code == 200
+    assert result.body == b'pre_recorded_audio_data'
+    assert result.headers["X-Buddy-Degraded"] == "gpt_timeout"
+    mock_send_azure_tts_request.assert_not_called()
+
+    # The transcription is kept in the history together with the canned reply
+    stored_messages = mock_update_user_session.call_args[0][1]
+    assert [m["content"] for m in stored_messages] == ["transcribed text", SAY_AGAIN_REPLY]
+
+if __name__ == '__main__':
+    pytest.main()
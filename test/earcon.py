@@ -0,0 +1,94 @@
+import pytest
+import pytest_asyncio
+import asyncio
+import time
+from unittest.mock import patch
+from app.core import Response
+from app.earcon import stream_with_earcon, strip_id3v2, earcon_audio, keepalive_audio, wants_earcon
+from app.audio_processing import encode_reply_audio, decode_mp3_to_pcm, IMA_ADPCM_CODEC
+from app.response_format import DEFAULT_RESPONSE_FORMAT, ResponseFormat
+
+# One second of 24 kHz PCM
+REPLY_PCM = b"\x00\x10" * 24000
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+async def reply_after(seconds, response):
+    await asyncio.sleep(seconds)
+    return response
+
+def test_strip_id3v2():
+    mp3_data = encode_reply_audio(REPLY_PCM)
+    assert mp3_data[:3] == b"ID3"
+    stripped = strip_id3v2(mp3_data)
+    # An MP3 frame sync word follows the tag
+    assert stripped[0] == 0xFF and stripped[1] & 0xE0 == 0xE0
+    assert strip_id3v2(stripped) == stripped
+
+def test_wants_earcon_only_for_mp3():
+    assert wants_earcon({"x-buddy-earcon": "1"}, DEFAULT_RESPONSE_FORMAT)
+    assert not wants_earcon({}, DEFAULT_RESPONSE_FORMAT)
+    assert not wants_earcon({"x-buddy-earcon": "1"}, ResponseFormat(IMA_ADPCM_CODEC, 16000))
+
+@pytest.mark.asyncio
+async def test_earcon_comes_first_and_the_stream_decodes_as_one_mp3():
+    reply = Response(status_code=200, body=encode_reply_audio(REPLY_PCM, amplify=False))
+    chunks = await collect(stream_with_earcon(reply_after(0.01, reply), DEFAULT_RESPONSE_FORMAT))
+
+    assert chunks[0] == earcon_audio(DEFAULT_RESPONSE_FORMAT)
+    assert len(chunks) == 2
+
+    # The earcon and the one second reply play back to back
+    pcm = decode_mp3_to_pcm(b"".join(chunks))
+    earcon_seconds = len(decode_mp3_to_pcm(chunks[0])) / 48000
+    assert abs(len(pcm) / 48000 - earcon_seconds - 1.0) < 0.1
+
+@pytest.mark.asyncio
+async def test_keepalive_frames_while_the_reply_is_not_ready():
+    reply = Response(status_code=200, body=encode_reply_audio(REPLY_PCM, amplify=False))
+    chunks = await collect(stream_with_earcon(reply_after(0.25, reply), DEFAULT_RESPONSE_FORMAT, keepalive_seconds=0.1))
+
+    assert chunks[1:3] == [keepalive_audio(DEFAULT_RESPONSE_FORMAT)] * 2
+    assert chunks[-1] == strip_id3v2(reply.body)
+
+@pytest.mark.asyncio
+async def test_failed_reply_ends_with_the_fallback_clip():
+    reply = Response(status_code=500, body="Internal server error")
+    chunks = await collect(stream_with_earcon(reply_after(0, reply), DEFAULT_RESPONSE_FORMAT, fallback_audio=b"say again"))
+    assert chunks == [earcon_audio(DEFAULT_RESPONSE_FORMAT), b"say again"]
+
+@pytest.mark.asyncio
+async def test_closing_the_stream_cancels_the_pipeline():
+    pipeline = asyncio.ensure_future(asyncio.sleep(10))
+    stream = stream_with_earcon(pipeline, DEFAULT_RESPONSE_FORMAT)
+    assert await stream.__anext__() == earcon_audio(DEFAULT_RESPONSE_FORMAT)
+    await stream.aclose()
+    await asyncio.sleep(0)
+    assert pipeline.cancelled()
+
+@pytest.mark.asyncio
+async def test_encoding_a_new_format_does_not_block_the_loop():
+    def slow_encode(pcm_data, **kwargs):
+        time.sleep(0.2)
+        return b"mp3"
+
+    ticks = 0
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    response_format = ResponseFormat(DEFAULT_RESPONSE_FORMAT.codec, 16000, "16k")
+    ticking = asyncio.ensure_future(ticker())
+    with patch("app.earcon.encode_pcm_audio", slow_encode):
+        stream = stream_with_earcon(asyncio.sleep(10), response_format)
+        assert await stream.__anext__() == b"mp3"
+        await stream.aclose()
+    ticking.cancel()
+    earcon_audio.cache_clear()
+    assert ticks >= 5
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from app.core import Response
+from app.background import drain_background_tasks
+from app.idempotency import IdempotencyCache, request_key
+from app.streaming import StreamedAudio
+
+def test_request_key_prefers_client_request_id():
+    assert request_key({"request_id": "abc"}, "user", b"audio") == "user:abc"
+
+def test_request_key_hashes_user_and_audio():
+    key = request_key({}, "user", b"audio")
+    assert key == request_key({}, "user", b"audio")
+    assert key != request_key({}, "other_user", b"audio")
+    assert key != request_key({}, "user", b"other audio")
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_share_one_run():
+    cache = IdempotencyCache()
+    calls = 0
+
+    async def pipeline():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return Response(status_code=200, body=b"mp3")
+
+    responses = await asyncio.gather(*[cache.run("key", pipeline) for _ in range(5)])
+
+    assert calls == 1
+    assert all(response.body == b"mp3" for response in responses)
+
+@pytest.mark.asyncio
+async def test_finished_response_is_replayed_until_ttl():
+    cache = IdempotencyCache(ttl_seconds=0.05)
+    calls = 0
+
+    async def pipeline():
+        nonlocal calls
+        calls += 1
+        return Response(status_code=200, body=b"mp3")
+
+    await cache.run("key", pipeline)
+    await cache.run("key", pipeline)
+    assert calls == 1
+
+    await asyncio.sleep(0.06)
+    await cache.run("key", pipeline)
+    assert calls == 2
+
+@pytest.mark.asyncio
+async def test_errors_are_not_cached():
+    cache = IdempotencyCache()
+    calls = 0
+
+    async def failing_pipeline():
+        nonlocal calls
+        calls += 1
+        return Response(status_code=500, body="Error")
+
+    async def raising_pipeline():
+        raise RuntimeError("boom")
+
+    await cache.run("key", failing_pipeline)
+    await cache.run("key", failing_pipeline)
+    assert calls == 2
+
+    with pytest.raises(RuntimeError):
+        await cache.run("other_key", raising_pipeline)
+
+@pytest.mark.asyncio
+async def test_cache_is_bounded():
+    cache = IdempotencyCache(max_entries=2)
+
+    async def pipeline():
+        return Response(status_code=200, body=b"mp3")
+
+    for key in ("a", "b", "c"):
+        await cache.run(key, pipeline)
+    assert list(cache._results) == ["b", "c"]
+
+@pytest.mark.asyncio
+async def test_failed_stream_is_recomputed_on_retry():
+    cache = IdempotencyCache()
+    calls = 0
+
+    async def chunks(fail):
+        yield b"a"
+        if fail:
+            raise RuntimeError("tts failed")
+        yield b"b"
+
+    async def pipeline():
+        nonlocal calls
+        calls += 1
+        return Response(status_code=200, body=StreamedAudio(chunks(fail=calls == 1)))
+
+    response = await cache.run("key", pipeline)
+    with pytest.raises(RuntimeError):
+        await response.body.read()
+
+    retry = await cache.run("key", pipeline)
+    assert calls == 2
+    assert await retry.body.read() == b"ab"
+    # The complete stream is replayed
+    assert await cache.run("key", pipeline) is retry
+    assert calls == 2
+    await drain_background_tasks()
+
+if __name__ == '__main__':
+    pytest.main()
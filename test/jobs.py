@@ -0,0 +1,136 @@
+import asyncio
+import importlib
+import os
+import pytest
+import pytest_asyncio
+from unittest.mock import patch
+from app import jobs
+from app.admission import Overloaded
+from app.core import Response
+from app.job_store import JobStore, MemoryJobStore, SQLiteJobStore, QUEUED, RUNNING, DONE, FAILED
+from app.jobs import JobQueue
+
+class FakePipeline:
+    """Stand-in for process_audio_logic, holding every run until `release` is set when there is one."""
+
+    def __init__(self):
+        self.deadlines = []
+        self.release = None
+
+    async def process(self, event, deadline):
+        self.deadlines.append(deadline.remaining())
+        if self.release is not None:
+            await self.release.wait()
+        if event.get("fail"):
+            raise RuntimeError("TTS exploded")
+        return Response(status_code=200, body=b"mp3:" + event["text"].encode(), headers={"Content-Type": "audio/mpeg"})
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteJobStore(str(tmp_path / "jobs.db"))
+    return MemoryJobStore()
+
+@pytest.fixture
+def pipeline():
+    return FakePipeline()
+
+@pytest_asyncio.fixture
+async def queue(store, pipeline):
+    job_queue = JobQueue(pipeline.process, store=store, workers=2, max_queued=2, deadline_seconds=60)
+    yield job_queue
+    await job_queue.stop(timeout=1)
+
+@pytest.mark.asyncio
+async def test_submitted_job_is_fetched_when_done(queue, pipeline):
+    job_id = await queue.submit({"text": "hello"})
+    job = await queue.wait(job_id, timeout=5)
+
+    assert job.status == DONE
+    assert job.status_code == 200
+    assert bytes(job.body) == b"mp3:hello"
+    assert job.headers["Content-Type"] == "audio/mpeg"
+    # Jobs get their own, longer budget than a request
+    assert pipeline.deadlines[0] > 30
+    assert queue.stats()["completed"] == 1
+
+@pytest.mark.asyncio
+async def test_long_poll_returns_the_status_until_the_job_finished(queue, pipeline):
+    pipeline.release = asyncio.Event()
+    job_id = await queue.submit({"text": "slow"})
+
+    job = await queue.wait(job_id, timeout=0.05)
+    assert not job.finished
+
+    waiter = asyncio.ensure_future(queue.wait(job_id, timeout=5))
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+    pipeline.release.set()
+    job = await waiter
+    assert job.status == DONE
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_submissions(queue, pipeline):
+    pipeline.release = asyncio.Event()
+    for i in range(4):
+        await queue.submit({"text": str(i)})
+    await asyncio.sleep(0.05)  # Two jobs running, two queued
+
+    with pytest.raises(Overloaded):
+        await queue.submit({"text": "one too many"})
+    assert queue.stats()["rejected"] == 1
+    pipeline.release.set()
+
+@pytest.mark.asyncio
+async def test_failed_job_is_reported(queue):
+    job_id = await queue.submit({"text": "x", "fail": True})
+    job = await queue.wait(job_id, timeout=5)
+
+    assert job.status == FAILED
+    assert job.status_code == 500
+    assert queue.stats()["failed"] == 1
+
+@pytest.mark.asyncio
+async def test_unknown_and_expired_jobs_are_not_found(queue, store):
+    assert await queue.wait("nope") is None
+
+    store.create("old", ttl_seconds=-1)
+    assert store.get("old") is None
+    assert store.purge_expired() == 1
+
+@pytest.mark.asyncio
+async def test_job_run_by_another_process_is_polled(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    pipeline = FakePipeline()
+    worker = JobQueue(pipeline.process, store=SQLiteJobStore(path))
+    poller = JobQueue(pipeline.process, store=SQLiteJobStore(path))
+    pipeline.release = asyncio.Event()
+
+    job_id = await worker.submit({"text": "shared"})
+    assert (await poller.wait(job_id)).status in (QUEUED, RUNNING)
+
+    asyncio.get_running_loop().call_later(0.1, pipeline.release.set)
+    job = await poller.wait(job_id, timeout=5)
+    assert bytes(job.body) == b"mp3:shared"
+    await worker.stop(timeout=1)
+
+def test_incomplete_job_store_fails_when_created():
+    class WriteOnlyStore(JobStore):
+        def create(self, job_id, ttl_seconds=60):
+            return None
+
+    with pytest.raises(TypeError):
+        WriteOnlyStore()
+
+def test_jobs_are_disabled_in_lambda():
+    try:
+        with patch.dict(os.environ, {"AWS_LAMBDA_FUNCTION_NAME": "buddy-dev-stream"}):
+            assert importlib.reload(jobs).JOBS_ENABLED is False
+        with patch.dict(os.environ):
+            os.environ.pop("AWS_LAMBDA_FUNCTION_NAME", None)
+            assert importlib.reload(jobs).JOBS_ENABLED is True
+    finally:
+        importlib.reload(jobs)
+
+if __name__ == '__main__':
+    pytest.main()
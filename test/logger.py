@@ -0,0 +1,87 @@
+import io
+import json
+import logging
+import queue
+import pytest
+from app import logger as app_logger
+from app.logger import (
+    configure_logging, flush_logs, log_request, log_conversation, log_stats, DroppingQueueHandler, JsonFormatter
+)
+
+@pytest.fixture
+def output():
+    stream = io.StringIO()
+    configure_logging(level="INFO", stream=stream)
+    yield stream
+    flush_logs()
+    app_logger._listener.stop()
+    app_logger._listener = None
+    root = logging.getLogger()
+    root.removeHandler(app_logger._queue_handler)
+    root.setLevel(logging.WARNING)
+
+def records(stream):
+    flush_logs()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+def test_records_are_json_lines_with_the_request_id(output):
+    with log_request("req-1", sample_rate=1.0):
+        logging.getLogger("app.core").info("%s: %.3f seconds", "STT transcription", 0.25, extra={"seconds": 0.25})
+
+    [record] = records(output)
+    assert record["message"] == "STT transcription: 0.250 seconds"
+    assert record["level"] == "INFO"
+    assert record["logger"] == "app.core"
+    assert record["request_id"] == "req-1"
+    assert record["seconds"] == 0.25
+
+def test_unsampled_requests_only_log_warnings(output):
+    sampled_out = log_stats()["sampled_out"]
+    with log_request("req-2", sample_rate=0.0):
+        logging.getLogger("app.core").info("timing")
+        logging.getLogger("app.core").warning("fallback")
+
+    assert [record["message"] for record in records(output)] == ["fallback"]
+    assert log_stats()["sampled_out"] == sampled_out + 1
+
+def test_exceptions_are_formatted(output):
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.getLogger("app.db").exception("write failed")
+
+    [record] = records(output)
+    assert "ValueError: boom" in record["exception"]
+
+@pytest.mark.parametrize("mode, expected", [
+    ("off", None),
+    ("redacted", {"role": "user", "chars": 5}),
+    ("full", {"role": "user", "chars": 5, "content": "hello"}),
+])
+def test_conversation_content_is_redacted(output, mode, expected):
+    with log_request("req-3", sample_rate=1.0):
+        log_conversation("user", "hello", mode=mode)
+
+    logged = records(output)
+    if expected is None:
+        assert logged == []
+        return
+    [record] = logged
+    for key, value in expected.items():
+        assert record[key] == value
+    assert ("digest" in record) == (mode == "redacted")
+    assert "hello" not in json.dumps(record) or mode == "full"
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    record = logging.makeLogRecord({"msg": "one"})
+    handler.emit(record)
+    handler.emit(record)
+    assert handler.dropped == 1
+
+def test_formatter_keeps_unicode():
+    record = logging.makeLogRecord({"msg": "สวัสดี", "levelname": "INFO", "name": "app"})
+    assert "สวัสดี" in JsonFormatter().format(record)
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,167 @@
+import asyncio
+import contextvars
+import os
+import time
+import pytest
+from unittest.mock import patch
+from app.pipeline import Pipeline, Stage, PipelineError, PipelineExit, LOOP, THREAD, PROCESS
+from app.reply_cache import ReplyCache
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+def square(x):
+    return x * x, os.getpid()
+
+async def sleep_and_return(value, seconds=0.1):
+    await asyncio.sleep(seconds)
+    return value
+
+@pytest.mark.asyncio
+async def test_independent_stages_run_concurrently():
+    def blocking_read(user_id):
+        time.sleep(0.1)
+        return f"session of {user_id}"
+
+    pipeline = Pipeline("test", [
+        Stage("session", blocking_read, inputs=("user_id",), outputs=("session",), executor=THREAD),
+        Stage("stt", lambda audio: sleep_and_return(audio.upper()), inputs=("audio",), outputs=("text",)),
+        Stage("reply", lambda session, text: f"{text} for {session}", inputs=("session", "text"), outputs=("reply",)),
+    ])
+    assert pipeline.inputs == {"user_id", "audio"}
+
+    start = time.perf_counter()
+    values = await pipeline.run(user_id="u1", audio="hello")
+    assert time.perf_counter() - start < 0.18
+    assert values["reply"] == "HELLO for session of u1"
+    assert pipeline.stats()["reply"]["runs"] == 1
+
+@pytest.mark.asyncio
+async def test_stages_wait_for_their_inputs():
+    order = []
+
+    def stage(name, result):
+        async def run(**inputs):
+            order.append(name)
+            return result
+        return run
+
+    pipeline = Pipeline("test", [
+        Stage("c", stage("c", 3), inputs=("a", "b"), outputs=("c",)),
+        Stage("b", stage("b", (2, "extra")), inputs=("a",), outputs=("b", "extra")),
+        Stage("a", stage("a", 1), inputs=("start",), outputs=("a",)),
+    ])
+    values = await pipeline.run(start=0)
+    assert order == ["a", "b", "c"]
+    assert values["extra"] == "extra"
+    assert values["c"] == 3
+
+def test_invalid_graphs_are_rejected():
+    with pytest.raises(PipelineError):
+        Pipeline("test", [
+            Stage("a", lambda b: b, inputs=("b",), outputs=("a",)),
+            Stage("b", lambda a: a, inputs=("a",), outputs=("b",)),
+        ])
+    with pytest.raises(PipelineError):
+        Pipeline("test", [
+            Stage("a", lambda x: x, inputs=("x",), outputs=("a",)),
+            Stage("b", lambda x: x, inputs=("x",), outputs=("a",)),
+        ])
+    with pytest.raises(PipelineError):
+        Stage("a", sleep_and_return, inputs=("value",), outputs=("a",), executor=THREAD)
+
+@pytest.mark.asyncio
+async def test_missing_inputs_are_rejected():
+    pipeline = Pipeline("test", [Stage("a", lambda x: x, inputs=("x",), outputs=("a",))])
+    with pytest.raises(PipelineError):
+        await pipeline.run(y=1)
+
+@pytest.mark.asyncio
+async def test_thread_stages_keep_the_context():
+    pipeline = Pipeline("test", [
+        Stage("read", lambda x: (x, request_id.get()), inputs=("x",), outputs=("result",), executor=THREAD),
+    ])
+    request_id.set("req-1")
+    values = await pipeline.run(x=1)
+    assert values["result"] == (1, "req-1")
+
+@pytest.mark.asyncio
+async def test_process_stages_run_in_another_process():
+    pipeline = Pipeline("test", [Stage("square", square, inputs=("x",), outputs=("y", "pid"), executor=PROCESS)])
+    values = await pipeline.run(x=7)
+    assert values["y"] == 49
+    assert values["pid"] != os.getpid()
+
+def test_environment_overrides_the_executor():
+    with patch.dict(os.environ, {"PIPELINE_EXECUTOR_ENCODE": PROCESS}):
+        assert Stage("encode", square, inputs=("x",), outputs=("y", "pid")).executor == PROCESS
+    assert Stage("encode", square, inputs=("x",), outputs=("y", "pid")).executor == LOOP
+    with patch.dict(os.environ, {"PIPELINE_EXECUTOR_ENCODE": "gpu"}):
+        with pytest.raises(PipelineError):
+            Stage("encode", square, inputs=("x",), outputs=("y", "pid"))
+
+@pytest.mark.asyncio
+async def test_cached_stages_skip_the_call():
+    calls = []
+
+    async def generate(text):
+        calls.append(text)
+        return None if text == "uncacheable" else f"reply to {text}"
+
+    cache = ReplyCache(variants=1)
+    pipeline = Pipeline("test", [
+        Stage("reply", generate, inputs=("text",), outputs=("reply",),
+              cache=cache, cache_key=lambda user_id, text: f"{user_id}:{text}", cache_inputs=("user_id", "text")),
+    ])
+    assert (await pipeline.run(user_id="u1", text="hi"))["reply"] == "reply to hi"
+    assert (await pipeline.run(user_id="u1", text="hi"))["reply"] == "reply to hi"
+    await pipeline.run(user_id="u1", text="uncacheable")
+    await pipeline.run(user_id="u1", text="uncacheable")
+    assert calls == ["hi", "uncacheable", "uncacheable"]
+    assert pipeline.stats()["reply"]["cache_hits"] == 1
+
+@pytest.mark.asyncio
+async def test_stages_wait_for_their_after_values():
+    order = []
+
+    def stage(name, result):
+        async def run(**inputs):
+            await asyncio.sleep(0.01 if name == "check" else 0)
+            order.append(name)
+            return result
+        return run
+
+    pipeline = Pipeline("test", [
+        Stage("check", stage("check", True), inputs=("user_id",), outputs=("allowed",)),
+        Stage("read", stage("read", "summary"), inputs=("user_id",), outputs=("summary",), after=("allowed",)),
+    ])
+    assert pipeline.inputs == {"user_id"}
+    values = await pipeline.run(user_id="u1")
+    assert order == ["check", "read"]
+    assert values["summary"] == "summary"
+
+@pytest.mark.asyncio
+async def test_early_exit_cancels_running_stages():
+    cancelled = asyncio.Event()
+
+    async def slow_stt(audio):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def check(user_id):
+        await asyncio.sleep(0.01)
+        raise PipelineExit("Not whitelisted.")
+
+    pipeline = Pipeline("test", [
+        Stage("stt", slow_stt, inputs=("audio",), outputs=("text",)),
+        Stage("check", check, inputs=("user_id",), outputs=("allowed",)),
+    ])
+    with pytest.raises(PipelineExit) as raised:
+        await pipeline.run(audio=b"", user_id="u1")
+    assert raised.value.result == "Not whitelisted."
+    assert cancelled.is_set()
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+import tracemalloc
+import pytest
+from unittest.mock import patch
+from app import profiling
+from app.profiling import profile_request, wants_profile, collapsed_stacks, StackSampler
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+def busy_until(done, timeout=5.0):
+    """Burn CPU until done() is true, the timeout only guards against a broken sampler."""
+    end = time.perf_counter() + timeout
+    total = 0
+    while not done() and time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+def sampled(sampler, thread_name):
+    return any(name == thread_name for (name, _), _ in sampler.samples)
+
+def test_profile_captures_stacks_and_memory(tmp_path):
+    with profile_request("turn", directory=str(tmp_path), interval=0.001) as sampler:
+        # The worker runs until the sampler caught it, however the GIL is scheduled
+        worker = threading.Thread(target=busy_until, args=(lambda: sampled(sampler, "worker"),), name="worker")
+        worker.start()
+        worker.join()
+        blob = bytearray(2 * 1024 * 1024)
+        del blob
+
+    collapsed = (tmp_path / "turn.collapsed").read_text().splitlines()
+    assert any(line.startswith("worker;") and "busy_until (profiling.py:" in line for line in collapsed)
+    for line in collapsed:
+        stack, weight = line.rsplit(" ", 1)
+        assert int(weight) > 0
+
+    speedscope = json.loads((tmp_path / "turn.speedscope.json").read_text())
+    worker_profile = next(profile for profile in speedscope["profiles"] if profile["name"] == "worker")
+    assert len(worker_profile["samples"]) == len(worker_profile["weights"]) >= 1
+    names = {frame["name"] for frame in speedscope["shared"]["frames"]}
+    assert "busy_until" in names
+
+    memory = (tmp_path / "turn.memory.txt").read_text()
+    peak = int(memory.split("tracemalloc peak: ")[1].split(" ")[0])
+    assert peak >= 2 * 1024 * 1024
+    assert not tracemalloc.is_tracing()
+
+def test_concurrent_profile_runs_unprofiled(tmp_path):
+    with profile_request("outer", directory=str(tmp_path), interval=0.001):
+        with profile_request("inner", directory=str(tmp_path), interval=0.001) as sampler:
+            assert sampler is None
+            busy_loop(0.01)
+    assert (tmp_path / "outer.collapsed").exists()
+    assert not (tmp_path / "inner.collapsed").exists()
+
+def test_profile_names_stay_in_the_directory(tmp_path):
+    with profile_request("1700000000-../../etc/x y", directory=str(tmp_path / "profiles"), interval=0.001):
+        pass
+    assert sorted(path.name for path in (tmp_path / "profiles").iterdir()) == [
+        "1700000000-______etc_x_y.collapsed", "1700000000-______etc_x_y.memory.txt",
+        "1700000000-______etc_x_y.speedscope.json",
+    ]
+    assert [path.name for path in tmp_path.iterdir()] == ["profiles"]
+
+def test_collapsed_stacks_are_sorted_by_weight():
+    sampler = StackSampler()
+    sampler.stacks = {
+        ("MainThread", (("a", "/x/a.py", 1),)): 0.001,
+        ("MainThread", (("a", "/x/a.py", 1), ("b", "/x/b.py", 5))): 0.004,
+    }
+    assert collapsed_stacks(sampler) == "MainThread;a (a.py:1);b (b.py:5) 4000\nMainThread;a (a.py:1) 1000\n"
+
+def test_header_only_counts_when_enabled():
+    with patch.object(profiling, "PROFILE_SAMPLE_RATE", 0.0):
+        with patch.object(profiling, "PROFILE_HEADER_ENABLED", False):
+            assert not wants_profile({"x-buddy-profile": "1"})
+        with patch.object(profiling, "PROFILE_HEADER_ENABLED", True):
+            assert wants_profile({"x-buddy-profile": "1"})
+            assert not wants_profile({})
+
+if __name__ == '__main__':
+    pytest.main()
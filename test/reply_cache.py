@@ -0,0 +1,67 @@
+import pytest
+from unittest.mock import patch
+from app.reply_cache import ReplyCache, reply_cache_key, normalize_utterance, reply_cache_mode
+
+GREETING_HISTORY = [
+    {"role": "user", "content": "hi", "timestamp": "1"},
+    {"role": "assistant", "content": "อยากฟังนิทานไหม", "timestamp": "2"},
+]
+
+def test_normalize_utterance_drops_particles_and_punctuation():
+    assert normalize_utterance("สวัสดีครับ!") == "สวัสดี"
+    assert normalize_utterance(" สวัสดี  ค่ะ ") == "สวัสดี"
+    assert normalize_utterance("What's your NAME?") == "what s your name"
+
+def test_key_depends_on_prompt_context_and_scope():
+    shared = reply_cache_key("alice", "สวัสดีครับ", "prompt", [], "shared")
+    assert shared == reply_cache_key("bob", "สวัสดีค่ะ", "prompt", [], "shared")
+    assert shared != reply_cache_key("alice", "สวัสดีครับ", "other prompt", [], "shared")
+    assert shared != reply_cache_key("alice", "สวัสดีครับ", "prompt", GREETING_HISTORY, "shared")
+
+    personal = reply_cache_key("alice", "สวัสดีครับ", "prompt", [], "personal")
+    assert personal != reply_cache_key("bob", "สวัสดีครับ", "prompt", [], "personal")
+
+def test_key_is_none_when_the_turn_is_not_cacheable():
+    assert reply_cache_key("alice", "สวัสดี", "prompt", [], "off") is None
+    assert reply_cache_key("alice", "?!", "prompt", [], "shared") is None
+    assert reply_cache_key("alice", "เล่า" * 30, "prompt", [], "shared") is None
+
+def test_reply_cache_mode_falls_back_to_the_default():
+    assert reply_cache_mode("personal") == "personal"
+    assert reply_cache_mode(None) == "off"
+    assert reply_cache_mode("bogus") == "off"
+
+def test_lookup_serves_a_random_pick_once_enough_variants_exist():
+    cache = ReplyCache(variants=2)
+    cache.store("hello", "สวัสดีจ้า", llm_seconds=2.0)
+    assert cache.lookup("hello") is None
+
+    cache.store("hello", "หวัดดี", llm_seconds=2.0)
+    picks = {cache.lookup("hello") for _ in range(50)}
+    assert picks == {"สวัสดีจ้า", "หวัดดี"}
+
+    stats = cache.stats()
+    assert stats["hits"] == 50
+    assert stats["misses"] == 1
+    assert stats["saved_seconds"] == 100.0
+
+def test_replies_expire():
+    cache = ReplyCache(ttl=10, variants=1)
+    with patch('app.reply_cache.time.time', return_value=1000):
+        cache.store("hello", "สวัสดีจ้า")
+    with patch('app.reply_cache.time.time', return_value=1005):
+        assert cache.lookup("hello") == "สวัสดีจ้า"
+    with patch('app.reply_cache.time.time', return_value=1011):
+        assert cache.lookup("hello") is None
+
+def test_only_the_newest_variants_are_kept():
+    cache = ReplyCache(variants=2)
+    with patch('app.reply_cache.time.time', side_effect=[1, 2, 3]):
+        cache.store("hello", "one")
+        cache.store("hello", "two")
+        cache.store("hello", "three")
+    with patch('app.reply_cache.time.time', return_value=4):
+        assert {cache.lookup("hello") for _ in range(30)} == {"two", "three"}
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,70 @@
+import pytest
+import pytest_asyncio
+from unittest.mock import patch
+import numpy as np
+from app.response_format import (
+    ResponseFormat, parse_response_format, transcode_canned_audio, DEFAULT_RESPONSE_FORMAT, _canned_variants
+)
+from app.audio_processing import decode_ima_adpcm, encode_reply_audio, IMA_ADPCM_CODEC, MP3_CODEC
+
+def make_tone(seconds=0.5, sample_rate=24000, frequency=440):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (np.sin(2 * np.pi * frequency * t) * 8000).astype('<i2').tobytes()
+
+def test_parse_response_format_defaults_missing_parameters():
+    assert parse_response_format("audio/mpeg") == DEFAULT_RESPONSE_FORMAT
+    assert parse_response_format("audio/mpeg; rate=16000; bitrate=16K") == ResponseFormat(MP3_CODEC, 16000, '16k')
+
+def test_parse_response_format_picks_first_supported_entry():
+    value = "audio/opus, audio/x-ima-adpcm; rate=44100, audio/x-ima-adpcm; rate=16000"
+    assert parse_response_format(value) == ResponseFormat(IMA_ADPCM_CODEC, 16000, '32k')
+
+def test_parse_response_format_without_supported_entry():
+    assert parse_response_format(None) is None
+    assert parse_response_format("*/*") is None
+    assert parse_response_format("audio/mpeg; rate=fast") is None
+
+def test_ima_adpcm_reply_decodes_back_to_the_tone():
+    tone = make_tone()
+    response_format = ResponseFormat(IMA_ADPCM_CODEC, 16000)
+    encoded = response_format.encode(tone, amplify=False)
+
+    # 4 bits per sample plus block headers, about a quarter of the 16 kHz PCM
+    decoded = np.frombuffer(decode_ima_adpcm(encoded), dtype='<i2').astype(np.float64)
+    assert len(encoded) < len(tone) * 16000 // 24000 // 3
+    reference = np.frombuffer(make_tone(sample_rate=16000), dtype='<i2').astype(np.float64)
+    length = min(len(decoded), len(reference))
+    error = decoded[100:length - 100] - reference[100:length - 100]
+    snr = 10 * np.log10(np.sum(reference[100:length - 100] ** 2) / np.sum(error ** 2))
+    assert snr > 20
+
+def test_content_type_describes_adpcm_layout():
+    assert DEFAULT_RESPONSE_FORMAT.content_type == "audio/mpeg"
+    assert ResponseFormat(IMA_ADPCM_CODEC, 16000).content_type == "audio/x-ima-adpcm; rate=16000; block-align=256"
+
+@pytest.mark.asyncio
+async def test_transcode_canned_audio_is_cached_per_variant():
+    _canned_variants.clear()
+    mp3_data = encode_reply_audio(make_tone(), amplify=False)
+    small_format = ResponseFormat(MP3_CODEC, 16000, '16k')
+
+    assert await transcode_canned_audio("tone.mp3", mp3_data, DEFAULT_RESPONSE_FORMAT) is mp3_data
+
+    with patch('app.response_format._transcode', wraps=lambda data, fmt: b"transcoded") as mock_transcode:
+        first = await transcode_canned_audio("tone.mp3", mp3_data, small_format)
+        second = await transcode_canned_audio("tone.mp3", mp3_data, small_format)
+    assert first == second == b"transcoded"
+    assert mock_transcode.call_count == 1
+    _canned_variants.clear()
+
+@pytest.mark.asyncio
+async def test_transcode_canned_audio_to_adpcm():
+    _canned_variants.clear()
+    mp3_data = encode_reply_audio(make_tone(), amplify=False)
+    adpcm_data = await transcode_canned_audio("tone.mp3", mp3_data, ResponseFormat(IMA_ADPCM_CODEC, 8000))
+    assert 0 < len(adpcm_data) < len(mp3_data) * 2
+    assert len(decode_ima_adpcm(adpcm_data)) > 0
+    _canned_variants.clear()
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,103 @@
+import pytest
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+from app.session_cache import SessionCache, merge_sessions, session_size
+from app.db import update_user_session, get_user_session
+from app.session_codec import encode_messages, decode_messages
+from app.dynamodb_storage import DynamoDBStorage
+
+def message(content, timestamp, role="user"):
+    return {"role": role, "content": content, "timestamp": str(timestamp)}
+
+class FakeMessagesTable:
+    """The subset of the DynamoDB table API used by the session functions, with conditional writes."""
+
+    def __init__(self):
+        self.items = {}
+        self.reads = 0
+
+    def get_item(self, Key, **kwargs):
+        self.reads += 1
+        item = self.items.get(Key['UserID'])
+        return {'Item': dict(item)} if item else {}
+
+    def update_item(self, Key, ExpressionAttributeValues, ConditionExpression=None, **kwargs):
+        item = self.items.setdefault(Key['UserID'], {})
+        version = item.get('Version')
+        if ConditionExpression == 'attribute_not_exists(Version)' and version is not None:
+            raise self._conflict()
+        if ConditionExpression == 'Version = :expected' and version != ExpressionAttributeValues[':expected']:
+            raise self._conflict()
+        item['MessagesBlob'] = ExpressionAttributeValues[':blob']
+        item['Version'] = (version or 0) + 1
+        return {'Attributes': {'Version': item['Version']}}
+
+    def _conflict(self):
+        return ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'conflict'}}, 'UpdateItem')
+
+@pytest.fixture
+def table():
+    fake_table = FakeMessagesTable()
+    storage = DynamoDBStorage(messages_table=fake_table, prompts_table=fake_table)
+    with patch('app.db.storage', storage), patch('app.db.session_cache', SessionCache(max_bytes=1024 * 1024)):
+        yield fake_table
+
+def test_lru_eviction_by_bytes():
+    first = [message("a" * 300, 1)]
+    cache = SessionCache(max_bytes=session_size(first) * 2)
+    cache.put("alice", first, 1)
+    cache.put("bob", first, 1)
+    assert cache.get("alice") == first  # alice is now the most recently used
+
+    cache.put("carol", first, 1)
+    assert cache.get("bob") is None
+    assert cache.get("alice") == first
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == session_size(first) * 2
+    # The version of an evicted session is still known for conditional writes
+    assert cache.version("bob") == 1
+
+def test_hit_ratio():
+    cache = SessionCache(max_bytes=1024)
+    cache.put("alice", [], 3)
+    cache.get("alice")
+    cache.get("bob")
+    assert cache.stats()["hit_ratio"] == 0.5
+
+def test_merge_appends_our_new_turns_after_the_stored_ones():
+    base = [message("hi", 1)]
+    stored = base + [message("from worker a", 2)]
+    ours = base + [message("from worker b", 3)]
+    assert merge_sessions(stored, ours) == base + [message("from worker a", 2), message("from worker b", 3)]
+
+def test_reads_are_served_from_memory_after_the_first(table):
+    table.items["alice"] = {'MessagesBlob': encode_messages([message("hi", 1)]), 'Version': 4}
+
+    assert get_user_session("alice") == [message("hi", 1.0)]
+    assert get_user_session("alice") == [message("hi", 1.0)]
+    assert table.reads == 1
+
+    # Writes go through to the table and refresh the cached copy
+    update_user_session("alice", [message("hi", 1.0), message("again", 2.0)])
+    assert table.items["alice"]['Version'] == 5
+    assert get_user_session("alice") == [message("hi", 1.0), message("again", 2.0)]
+    assert table.reads == 1
+
+def test_concurrent_write_is_merged_instead_of_clobbered(table):
+    table.items["alice"] = {'MessagesBlob': encode_messages([message("hi", 1)]), 'Version': 1}
+    messages = get_user_session("alice")
+
+    # Another instance adds a turn after our read
+    table.items["alice"] = {
+        'MessagesBlob': encode_messages(messages + [message("other device", 2)]),
+        'Version': 2,
+    }
+
+    update_user_session("alice", messages + [message("this device", 3)])
+
+    stored = decode_messages(table.items["alice"]['MessagesBlob'])
+    assert [m["content"] for m in stored] == ["hi", "other device", "this device"]
+    assert table.items["alice"]['Version'] == 3
+
+if __name__ == '__main__':
+    pytest.main()
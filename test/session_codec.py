@@ -0,0 +1,40 @@
+import zlib
+import pytest
+from app.session_codec import encode_messages, decode_messages, CODEC_VERSION
+
+def make_messages(count):
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"สวัสดี บั้ดดี้ {i}",
+            "timestamp": str(1730000000.123456 + i)
+        }
+        for i in range(count)
+    ]
+
+def test_round_trip():
+    messages = make_messages(50)
+    assert decode_messages(encode_messages(messages)) == messages
+
+def test_round_trip_keeps_legacy_timestamps():
+    messages = [{"role": "user", "content": "Hello", "timestamp": "2024-10-01T10:00:00"}]
+    assert decode_messages(encode_messages(messages)) == messages
+
+def test_empty_history():
+    assert decode_messages(encode_messages([])) == []
+    assert decode_messages(b"") == []
+
+def test_blob_is_versioned_and_compressed():
+    messages = make_messages(200)
+    blob = encode_messages(messages)
+    assert blob[0] == CODEC_VERSION
+    zlib.decompress(blob[1:])
+    assert len(blob) < len(str(messages).encode("utf-8")) / 4
+
+def test_unknown_version_is_rejected():
+    blob = bytes([CODEC_VERSION + 1]) + encode_messages(make_messages(1))[1:]
+    with pytest.raises(ValueError):
+        decode_messages(blob)
+
+if __name__ == '__main__':
+    pytest.main()
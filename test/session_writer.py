@@ -0,0 +1,80 @@
+import pytest
+import pytest_asyncio
+import asyncio
+import threading
+import time
+from app.session_writer import SessionWriter
+from app.background import drain_background_tasks
+
+class RecordingStore:
+    """Stand-in for update_user_session that records the order writes land in."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.writes = []
+        self.lock = threading.Lock()
+
+    def write(self, user_id, messages):
+        time.sleep(self.delay)
+        with self.lock:
+            self.writes.append((user_id, [message["content"] for message in messages]))
+
+def turn(*contents):
+    return [{"role": "user", "content": content} for content in contents]
+
+@pytest.mark.asyncio
+async def test_writes_land_in_submission_order_and_coalesce():
+    writer = SessionWriter()
+    store = RecordingStore(delay=0.05)
+
+    writer.submit("alice", turn("1"), store.write)
+    await asyncio.sleep(0.01)  # The first write is now in flight
+    writer.submit("alice", turn("1", "2"), store.write)
+    writer.submit("alice", turn("1", "2", "3"), store.write)
+    await drain_background_tasks()
+
+    # The queued snapshot "1, 2" was replaced by the newer one before it was written
+    assert store.writes == [("alice", ["1"]), ("alice", ["1", "2", "3"])]
+    assert writer.stats()["coalesced"] == 1
+    assert writer.stats()["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_pending_session_is_visible_until_written():
+    writer = SessionWriter()
+    store = RecordingStore(delay=0.05)
+
+    writer.submit("alice", turn("hello"), store.write)
+    assert writer.pending_session("alice") == turn("hello")
+    assert writer.pending_session("bob") is None
+
+    await drain_background_tasks()
+    assert writer.pending_session("alice") is None
+    assert store.writes == [("alice", ["hello"])]
+
+@pytest.mark.asyncio
+async def test_users_are_written_independently():
+    writer = SessionWriter()
+    store = RecordingStore(delay=0.05)
+
+    start = time.monotonic()
+    for user_id in ("alice", "bob", "carol"):
+        writer.submit(user_id, turn(user_id), store.write)
+    await drain_background_tasks()
+
+    assert sorted(store.writes) == [("alice", ["alice"]), ("bob", ["bob"]), ("carol", ["carol"])]
+    assert time.monotonic() - start < 0.15
+
+@pytest.mark.asyncio
+async def test_failed_write_is_counted():
+    writer = SessionWriter()
+
+    def failing_write(user_id, messages):
+        raise RuntimeError("throttled")
+
+    writer.submit("alice", turn("hello"), failing_write)
+    await drain_background_tasks()
+    assert writer.stats()["failed"] == 1
+    assert writer.pending_session("alice") is None
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import time
+import pytest
+from app.background import drain_background_tasks
+from app.shadow import ShadowRunner, shadow_report, character_error_rate, configured_candidates, main
+
+class FakeBackend:
+    """Local stand-in for a candidate provider, answering after `delay` seconds."""
+
+    def __init__(self, output, delay=0.0, error=None):
+        self.output = output
+        self.delay = delay
+        self.error = error
+        self.requests = []
+
+    async def __call__(self, request):
+        self.requests.append(request)
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.output
+
+def runner(candidates, tmp_path=None, **kwargs):
+    records_path = str(tmp_path / "shadow.jsonl") if tmp_path is not None else ""
+    return ShadowRunner(candidates=candidates, sample_rate=1.0, records_path=records_path, **kwargs)
+
+@pytest.mark.asyncio
+async def test_mirrored_calls_never_wait_for_the_candidates(tmp_path):
+    slow = FakeBackend({"text": "สวัสดีครับ"}, delay=0.2)
+    shadow = runner({"stt": {"deepgram_stt": slow}}, tmp_path)
+
+    start = time.perf_counter()
+    shadow.mirror("stt", "azure_stt", b"wav", {"text": "สวัสดีค่ะ"}, 0.5)
+    assert time.perf_counter() - start < 0.01
+    assert shadow.in_flight == 1
+
+    await drain_background_tasks()
+    [record] = shadow.records
+    assert slow.requests == [b"wav"]
+    assert record["backend"] == "deepgram_stt"
+    assert record["primary"] == "azure_stt"
+    assert record["primary_seconds"] == 0.5
+    assert 0.2 <= record["seconds"] < 0.5
+    assert record["cer"] == pytest.approx(3 / 9, abs=1e-3)  # Two marks replaced, one added
+    # Transcriptions are personal, only kept with LOG_CONVERSATION=full
+    assert "output" not in record
+
+    [line] = (tmp_path / "shadow.jsonl").read_text(encoding="utf-8").splitlines()
+    assert json.loads(line) == record
+
+@pytest.mark.asyncio
+async def test_unsampled_and_excess_calls_are_not_mirrored():
+    backend = FakeBackend("reply", delay=0.05)
+    shadow = ShadowRunner(candidates={"llm": {"groq": backend}}, sample_rate=0.0, records_path="")
+    shadow.mirror("llm", "openai", [], "reply", 1.0)
+    assert shadow.mirrored == 0
+
+    shadow = runner({"llm": {"groq": backend}}, max_in_flight=1)
+    shadow.mirror("llm", "openai", [], "reply", 1.0)
+    shadow.mirror("llm", "openai", [], "reply", 1.0)
+    assert shadow.stats()["skipped"] == 1
+    # Stages without candidates are ignored
+    shadow.mirror("tts", "azure_tts", "text", b"", 1.0)
+    await drain_background_tasks()
+    assert len(backend.requests) == 1
+
+@pytest.mark.asyncio
+async def test_candidate_errors_and_timeouts_are_recorded():
+    shadow = runner({
+        "tts": {
+            "openai_tts": FakeBackend(b"", error=RuntimeError("quota")),
+            "hanging": FakeBackend(b"", delay=10),
+            "working": FakeBackend(b"\0" * 48000),
+        }
+    }, timeout=0.05)
+    shadow.mirror("tts", "azure_tts", "สวัสดี", b"\0" * 96000, 0.8)
+    await drain_background_tasks()
+
+    records = {record["backend"]: record for record in shadow.records}
+    assert records["openai_tts"]["error"] == "RuntimeError"
+    assert records["hanging"]["error"] == "TimeoutError"
+    assert records["working"]["audio_seconds"] == 1.0
+    assert records["working"]["primary_audio_seconds"] == 2.0
+
+def test_report_compares_with_the_primary():
+    records = [
+        {"stage": "stt", "backend": "deepgram_stt", "primary": "azure_stt", "seconds": seconds,
+         "primary_seconds": 1.0, "cer": cer}
+        for seconds, cer in [(0.5, 0.0), (0.7, 0.1), (1.5, 0.2), (0.6, 0.1)]
+    ]
+    records.append({"stage": "stt", "backend": "deepgram_stt", "primary": "azure_stt", "seconds": 30,
+                    "primary_seconds": 1.0, "error": "TimeoutError"})
+
+    summary = shadow_report(records)["stt"]["deepgram_stt"]
+    assert summary["calls"] == 5
+    assert summary["errors"] == 1
+    assert summary["p50_seconds"] == 0.7
+    assert summary["p95_seconds"] == 1.5
+    assert summary["primary_p50_seconds"] == 1.0
+    assert summary["faster_share"] == 0.75
+    assert summary["mean_cer"] == 0.1
+
+def test_report_cli_reads_the_records_file(tmp_path, capsys):
+    path = tmp_path / "shadow.jsonl"
+    path.write_text(json.dumps({"stage": "llm", "backend": "groq", "primary": "openai", "seconds": 0.4,
+                                "primary_seconds": 1.2, "chars": 10, "primary_chars": 12}) + "\n")
+    assert main([str(path), "--json"]) == 0
+    assert json.loads(capsys.readouterr().out)["llm"]["groq"]["faster_share"] == 1.0
+    assert main([str(path)]) == 0
+    assert "groq" in capsys.readouterr().out
+
+def test_character_error_rate():
+    assert character_error_rate("สวัสดี", "สวัสดี") == 0.0
+    assert character_error_rate("abcd", "abed") == 0.25
+    assert character_error_rate("", "") == 0.0
+    assert character_error_rate("ab", "") == 1.0
+
+def test_configured_candidates():
+    candidates = configured_candidates({"stt": "openai_stt, deepgram_stt", "llm": "", "tts": "openai_tts"})
+    assert set(candidates) == {"stt", "tts"}
+    assert set(candidates["stt"]) == {"openai_stt", "deepgram_stt"}
+    with pytest.raises(ValueError):
+        configured_candidates({"stt": "float16", "llm": "", "tts": ""})
+
+if __name__ == '__main__':
+    pytest.main()
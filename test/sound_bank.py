@@ -0,0 +1,78 @@
+import pytest
+import pytest_asyncio
+from unittest.mock import patch, AsyncMock
+from app.sound_bank import SoundBank
+from app.prerender import prerender_phrases, mine_frequent_replies
+from app.audio_processing import encode_reply_audio
+from app.tts_fanout import split_for_tts, join_pcm_segments
+
+# 0.1 s of 24 kHz 16-bit PCM
+TTS_PCM = b"\x10\x00" * 2400
+
+@pytest.fixture
+def bank(tmp_path):
+    return SoundBank(str(tmp_path))
+
+def test_empty_bank_has_no_audio(bank):
+    assert bank.lookup("สวัสดี") is None
+
+@pytest.mark.asyncio
+@patch('app.prerender.send_azure_tts_request', new_callable=AsyncMock)
+async def test_prerender_stores_phrases_rendered_by_the_reply_pipeline(mock_send_azure_tts_request, bank):
+    mock_send_azure_tts_request.return_value = TTS_PCM
+
+    stats = await prerender_phrases(["สวัสดี", "ฝันดีนะ", "สวัสดี"], bank=bank, concurrency=2)
+
+    assert stats == {"rendered": 2, "skipped": 0, "failed": 0}
+    assert mock_send_azure_tts_request.call_count == 2
+    assert bank.lookup("สวัสดี") == encode_reply_audio(TTS_PCM)
+
+    # A fresh bank reads the saved manifest back, spacing differences do not matter
+    assert SoundBank(bank.directory).lookup(" สวัสดี ") == encode_reply_audio(TTS_PCM)
+
+@pytest.mark.asyncio
+@patch('app.prerender.send_azure_tts_request', new_callable=AsyncMock)
+async def test_long_phrases_are_rendered_like_a_live_reply(mock_send_azure_tts_request, bank):
+    mock_send_azure_tts_request.return_value = TTS_PCM
+    phrase = ("วันนี้บั้ดดี้ไปเที่ยวสวนสัตว์มาแล้วสนุกมากเลย เห็นช้างตัวใหญ่กำลังกินกล้วยอยู่ "
+              "แล้วก็มีลิงน้อยห้อยโหนอยู่บนต้นไม้ด้วยนะ หนูชอบสัตว์อะไรที่สุดเหรอ")
+    chunks = split_for_tts(phrase)
+    assert len(chunks) > 1
+
+    await prerender_phrases([phrase], bank=bank)
+    assert mock_send_azure_tts_request.call_count == len(chunks)
+    assert bank.lookup(phrase) == encode_reply_audio(join_pcm_segments([TTS_PCM] * len(chunks)))
+
+@pytest.mark.asyncio
+@patch('app.prerender.send_azure_tts_request', new_callable=AsyncMock)
+async def test_prerender_is_incremental(mock_send_azure_tts_request, bank):
+    mock_send_azure_tts_request.return_value = TTS_PCM
+    await prerender_phrases(["สวัสดี"], bank=bank)
+
+    stats = await prerender_phrases(["สวัสดี", "ฝันดีนะ"], bank=bank)
+    assert stats == {"rendered": 1, "skipped": 1, "failed": 0}
+    assert mock_send_azure_tts_request.call_count == 2
+
+@pytest.mark.asyncio
+@patch('app.prerender.send_azure_tts_request', new_callable=AsyncMock)
+async def test_voice_change_invalidates_the_bank(mock_send_azure_tts_request, bank):
+    mock_send_azure_tts_request.return_value = TTS_PCM
+    await prerender_phrases(["สวัสดี"], bank=bank)
+
+    with patch('app.sound_bank.azure_tts_voice_settings', return_value={"voice": "other"}):
+        assert bank.lookup("สวัสดี") is None
+        stats = await prerender_phrases(["สวัสดี"], bank=bank)
+    assert stats["rendered"] == 1
+
+@patch('app.prerender.scan_user_sessions')
+def test_mine_frequent_replies(mock_scan_user_sessions):
+    mock_scan_user_sessions.return_value = [
+        ("user_a", [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "สวัสดี"}]),
+        ("user_b", [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "สวัสดี "}]),
+        ("user_c", [{"role": "assistant", "content": "ฝันดีนะ"}, {"role": "assistant", "content": ""}]),
+    ]
+    assert mine_frequent_replies(10) == ["สวัสดี"]
+    assert mine_frequent_replies(10, min_count=1) == ["สวัสดี", "ฝันดีนะ"]
+
+if __name__ == '__main__':
+    pytest.main()
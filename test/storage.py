@@ -0,0 +1,126 @@
+import pytest
+import threading
+from unittest.mock import patch
+from app.db import (
+    get_user_session, update_user_session, get_user_summary, update_user_summary,
+    get_user_system_prompt, update_user_system_prompt, scan_user_sessions
+)
+from app.session_cache import SessionCache
+from app.storage import Storage, MemoryStorage, SessionConflict
+from app.sqlite_storage import SQLiteStorage
+
+def message(content, timestamp, role="user"):
+    return {"role": role, "content": content, "timestamp": str(timestamp)}
+
+@pytest.fixture(params=["memory", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        backend = SQLiteStorage(str(tmp_path / "buddy.db"))
+    else:
+        backend = MemoryStorage()
+    # No session cache, every call reaches the backend
+    with patch('app.db.storage', backend), patch('app.db.session_cache', SessionCache(max_bytes=0)):
+        yield backend
+
+def test_session_round_trip(storage):
+    assert get_user_session("alice") == []
+
+    messages = [message("สวัสดี", 1700000000.25), message("Hi there!", 1700000001.5, "assistant")]
+    update_user_session("alice", messages)
+    assert get_user_session("alice") == messages
+    assert storage.read_session("alice")[1] == 1
+
+    update_user_session("alice", messages + [message("again", 1700000002.0)])
+    assert [m["content"] for m in get_user_session("alice")] == ["สวัสดี", "Hi there!", "again"]
+    assert list(scan_user_sessions()) == [("alice", get_user_session("alice"))]
+
+def test_legacy_iso_timestamps_are_kept(storage):
+    messages = [message("Hello", "2024-05-01T10:00:00")]
+    update_user_session("alice", messages)
+    assert get_user_session("alice") == messages
+
+def test_conditional_write_rejects_a_stale_version(storage):
+    storage.write_session("alice", [message("first", 1)], expected_version=0)
+    with pytest.raises(SessionConflict):
+        storage.write_session("alice", [message("stale", 2)], expected_version=0)
+    assert storage.write_session("alice", [message("first", 1), message("second", 2)], expected_version=1) == 2
+
+def test_concurrent_turns_are_merged(storage):
+    get_user_session("alice")
+    # Another worker writes after our read
+    storage.write_session("alice", [message("other device", 1)])
+
+    update_user_session("alice", [message("this device", 2)])
+    assert [m["content"] for m in get_user_session("alice")] == ["other device", "this device"]
+
+def test_incomplete_backend_fails_when_created():
+    class SessionsOnly(Storage):
+        def read_session(self, user_id):
+            return [], 0
+
+    with pytest.raises(TypeError):
+        SessionsOnly()
+
+def test_summary_round_trip(storage):
+    assert get_user_summary("alice") == {"Summary": None, "SummaryUntil": None}
+    update_user_summary("alice", "likes dinosaurs", 1700000000.5)
+    assert get_user_summary("alice") == {"Summary": "likes dinosaurs", "SummaryUntil": 1700000000.5}
+
+    # The summary survives session writes and the reverse
+    update_user_session("alice", [message("hi", 1.0)])
+    assert get_user_summary("alice")["Summary"] == "likes dinosaurs"
+    assert get_user_session("alice") == [message("hi", 1.0)]
+
+def test_system_prompt_round_trip(storage):
+    assert get_user_system_prompt("alice")["SystemPrompt"] is None
+
+    update_user_system_prompt("alice", "You are a playful teddy bear.", 20, 10000, True)
+    prompt = get_user_system_prompt("alice")
+    assert prompt["SystemPrompt"] == "You are a playful teddy bear."
+    assert prompt["ActiveMessageLimit"] == 20
+    assert prompt["DailyRateLimit"] == 10000
+    assert prompt["Whitelist"] is True
+    assert prompt["ResponseFormat"] is None
+
+def test_sqlite_writers_in_threads_do_not_lose_turns(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "buddy.db"))
+
+    def add_turns(user_id):
+        for turn in range(20):
+            while True:
+                messages, version = storage.read_session(user_id)
+                try:
+                    storage.write_session(user_id, messages + [message(f"{user_id} {turn}", turn)], version)
+                    break
+                except SessionConflict:
+                    continue
+
+    threads = [threading.Thread(target=add_turns, args=("alice",)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    messages, version = storage.read_session("alice")
+    assert len(messages) == 80
+    assert version == 80
+
+def test_sqlite_appends_only_the_new_messages(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "buddy.db"))
+    messages = [message(f"turn {turn}", turn) for turn in range(10)]
+    storage.write_session("alice", messages, expected_version=0)
+
+    statements = []
+    storage._connection().set_trace_callback(statements.append)
+    storage.write_session("alice", messages + [message("new", 10), message("reply", 11, "assistant")], 1)
+    storage._connection().set_trace_callback(None)
+    assert not [statement for statement in statements if statement.startswith(("DELETE", "UPDATE messages"))]
+    assert len([statement for statement in statements if statement.startswith("INSERT INTO messages")]) == 2
+    assert [m["content"] for m in storage.read_session("alice")[0]][-3:] == ["turn 9", "new", "reply"]
+
+    # A history that does not extend the stored one is rewritten
+    storage.write_session("alice", [message("replaced", 20)], 2)
+    assert [m["content"] for m in storage.read_session("alice")[0]] == ["replaced"]
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import time
+import numpy as np
+import pytest
+from app.audio_processing import decode_mp3_to_pcm, join_pcm_segments
+from app.background import drain_background_tasks
+from app.streaming import StreamedAudio, encode_mp3_stream
+from app.tts_fanout import synthesize_segments, split_for_tts
+
+LONG_REPLY = ("วันนี้บั้ดดี้ไปเที่ยวสวนสัตว์มาแล้วสนุกมากเลย เห็นช้างตัวใหญ่กำลังกินกล้วยอยู่ "
+              "แล้วก็มีลิงน้อยห้อยโหนอยู่บนต้นไม้ด้วยนะ หนูชอบสัตว์อะไรที่สุดเหรอ")
+
+def tone(seconds, amplitude=8000, sample_rate=24000):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (np.sin(2 * np.pi * 220 * t) * amplitude).astype('<i2').tobytes()
+
+async def chunks_of(*items, delay=0.0):
+    for item in items:
+        await asyncio.sleep(delay)
+        yield item
+
+@pytest.mark.asyncio
+async def test_every_reader_gets_the_whole_stream():
+    streamed = StreamedAudio(chunks_of(b"a", b"b", b"c", delay=0.01))
+    first = asyncio.ensure_future(streamed.read())
+    await asyncio.sleep(0.015)
+    # A reader joining late still starts from the first chunk
+    assert await streamed.read() == b"abc"
+    assert await first == b"abc"
+    assert [chunk async for chunk in streamed] == [b"a", b"b", b"c"]
+
+@pytest.mark.asyncio
+async def test_stream_failure_reaches_the_reader():
+    async def failing():
+        yield b"a"
+        raise RuntimeError("tts failed")
+
+    streamed = StreamedAudio(failing())
+    received = []
+    with pytest.raises(RuntimeError):
+        async for chunk in streamed:
+            received.append(chunk)
+    assert received == [b"a"]
+    await drain_background_tasks()
+
+@pytest.mark.asyncio
+async def test_mp3_bytes_leave_before_the_last_segment_is_ready():
+    fed = []
+
+    async def segments():
+        for _ in range(3):
+            fed.append(time.perf_counter())
+            yield tone(1.0)
+            await asyncio.sleep(0.3)
+
+    arrivals = []
+    mp3_data = b""
+    async for chunk in encode_mp3_stream(segments(), sample_rate=24000, bitrate="32k", amplify=False):
+        arrivals.append(time.perf_counter())
+        mp3_data += chunk
+
+    assert arrivals[0] < fed[-1]
+    # One continuous stream, about as long as the three segments
+    decoded_seconds = len(decode_mp3_to_pcm(mp3_data)) / 2 / 24000
+    assert 2.9 < decoded_seconds < 3.2
+
+@pytest.mark.asyncio
+async def test_segments_come_out_joined_like_the_whole_reply():
+    async def synthesize(text):
+        return tone(0.1 + len(text) / 1000)
+
+    segments = [segment async for segment in synthesize_segments(LONG_REPLY, synthesize)]
+    assert len(segments) > 1
+    whole = await synthesize_segments(LONG_REPLY, synthesize).__anext__()
+    assert whole == segments[0]
+
+    parts = [await synthesize(text) for text in split_for_tts(LONG_REPLY)]
+    assert b"".join(segments) == join_pcm_segments(parts)
+
+@pytest.mark.asyncio
+async def test_short_reply_is_one_segment():
+    async def synthesize(text):
+        return b"\x01\x00" * 10
+
+    assert [segment async for segment in synthesize_segments("สวัสดีจ้า", synthesize)] == [b"\x01\x00" * 10]
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,86 @@
+import pytest
+import pytest_asyncio
+import json
+from unittest.mock import patch, AsyncMock, MagicMock
+from app import summary
+from app.summary import (
+    messages_to_summarize, needs_compaction, compact_user_session, compact_stored_session, request_compaction,
+    SUMMARY_BATCH_MESSAGES,
+)
+
+def make_messages(count, start_timestamp=1000.0):
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"message {i}",
+            "timestamp": str(start_timestamp + i)
+        }
+        for i in range(count)
+    ]
+
+def test_messages_to_summarize_excludes_active_window():
+    messages = make_messages(30)
+    pending = messages_to_summarize(messages, active_message_limit=5, summary_until=None)
+    assert pending == messages[:20]
+
+def test_messages_to_summarize_skips_already_summarized():
+    messages = make_messages(30)
+    pending = messages_to_summarize(messages, active_message_limit=5, summary_until=1009.0)
+    assert pending == messages[10:20]
+
+def test_messages_to_summarize_unlimited_window():
+    assert messages_to_summarize(make_messages(30), active_message_limit=-1, summary_until=None) == []
+
+def test_needs_compaction_waits_for_a_full_batch():
+    window = 10
+    assert not needs_compaction(make_messages(window * 2 + SUMMARY_BATCH_MESSAGES - 1), window, None)
+    assert needs_compaction(make_messages(window * 2 + SUMMARY_BATCH_MESSAGES), window, None)
+
+@pytest.mark.asyncio
+@patch('app.summary.update_user_summary')
+@patch('app.summary.send_gpt_request', new_callable=AsyncMock)
+async def test_compact_user_session(mock_send_gpt_request, mock_update_user_summary):
+    mock_send_gpt_request.return_value = "new summary"
+    messages = make_messages(30)
+
+    await compact_user_session("test_user", messages, 5, {"Summary": "old summary", "SummaryUntil": 1009.0})
+
+    summary_request = mock_send_gpt_request.call_args[0][0]
+    assert "old summary" in summary_request[1]["content"]
+    assert "message 10" in summary_request[1]["content"]
+    assert "message 9\n" not in summary_request[1]["content"]
+    assert "message 20" not in summary_request[1]["content"]
+    mock_update_user_summary.assert_called_once_with("test_user", "new summary", 1019.0)
+
+@pytest.mark.asyncio
+async def test_request_compaction_invokes_the_function_asynchronously():
+    client = MagicMock()
+    with patch.object(summary, "_lambda_client", client), patch.object(summary, "SUMMARY_FUNCTION_NAME", "buddy-dev-app"):
+        await request_compaction("test_user")
+    kwargs = client.invoke.call_args.kwargs
+    assert kwargs["FunctionName"] == "buddy-dev-app"
+    assert kwargs["InvocationType"] == "Event"
+    assert json.loads(kwargs["Payload"]) == {"compact_user_id": "test_user"}
+
+@pytest.mark.asyncio
+@patch('app.summary.compact_user_session', new_callable=AsyncMock)
+@patch('app.summary.get_user_summary')
+@patch('app.summary.get_user_system_prompt')
+@patch('app.summary.get_user_session')
+async def test_compact_stored_session(mock_get_user_session, mock_get_user_system_prompt, mock_get_user_summary,
+                                      mock_compact_user_session):
+    messages = make_messages(10 + SUMMARY_BATCH_MESSAGES)
+    mock_get_user_session.return_value = messages
+    mock_get_user_system_prompt.return_value = {"ActiveMessageLimit": 5}
+    mock_get_user_summary.return_value = {"Summary": None, "SummaryUntil": None}
+
+    await compact_stored_session("test_user")
+    mock_compact_user_session.assert_awaited_once_with("test_user", messages, 5, {"Summary": None, "SummaryUntil": None})
+
+    # Another invocation already compacted these turns
+    mock_get_user_summary.return_value = {"Summary": "done", "SummaryUntil": float(messages[-11]["timestamp"])}
+    await compact_stored_session("test_user")
+    mock_compact_user_session.assert_awaited_once()
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,63 @@
+import pytest
+from app.telemetry import LatencyTelemetry, Histogram, timing_headers
+
+def report(request_id="req-1", firmware_version="1.2.0", **timestamps):
+    return {"request_id": request_id, "firmware_version": firmware_version, **timestamps}
+
+def test_intervals_and_correlation():
+    telemetry = LatencyTelemetry()
+    telemetry.record_turn("req-1", 1.25)
+
+    intervals = telemetry.report(report(record_end=10000, request_sent=10300, first_byte=12000, playback_start=12150))
+    assert intervals == {
+        "end_to_end": 2150, "prepare": 300, "first_byte": 1700, "playback": 150, "server": 1250.0, "network": 450.0,
+    }
+    assert telemetry.uncorrelated == 0
+
+    # Served by another instance: the device passes on the timing header it got
+    intervals = telemetry.report(report("req-2", request_sent=0, first_byte=900, server_ms=700))
+    assert intervals == {"first_byte": 900, "server": 700, "network": 200}
+    assert telemetry.uncorrelated == 1
+
+def test_malformed_reports_are_rejected():
+    telemetry = LatencyTelemetry()
+    with pytest.raises(ValueError):
+        telemetry.report(report(record_end=2000, playback_start=1000))
+    with pytest.raises(ValueError):
+        telemetry.report(report(record_end="soon", playback_start=1000))
+    with pytest.raises(ValueError):
+        telemetry.report(report(record_end=1000))
+    with pytest.raises(ValueError):
+        telemetry.report(["not", "a", "report"])
+    assert telemetry.reports == 0
+
+def test_histograms_per_firmware_version():
+    telemetry = LatencyTelemetry(max_firmware_versions=2, bounds=[500, 1000, 2000])
+    for end_to_end in (400, 800, 900, 1500, 5000):
+        telemetry.report(report(firmware_version="1.2.0", record_end=0, playback_start=end_to_end))
+    telemetry.report(report(firmware_version="1.3.0", record_end=0, playback_start=700))
+    telemetry.report(report(firmware_version="0.9.9", record_end=0, playback_start=700))
+
+    firmware = telemetry.stats()["firmware"]
+    assert set(firmware) == {"1.2.0", "1.3.0", "other"}
+    stats = firmware["1.2.0"]["end_to_end"]
+    assert stats["count"] == 5
+    assert stats["buckets"] == {"le_500": 1, "le_1000": 2, "le_2000": 1, "inf": 1}
+    assert stats["p50_ms"] == 1000
+    assert stats["p95_ms"] is None  # Above the last bound
+    assert stats["mean_ms"] == 1720.0
+
+def test_recent_turns_are_bounded():
+    telemetry = LatencyTelemetry(recent_turns=2)
+    for request_id in ("a", "b", "c"):
+        telemetry.record_turn(request_id, 1.0)
+    assert "server" not in telemetry.report(report("a", request_sent=0, first_byte=2000))
+    assert telemetry.report(report("c", request_sent=0, first_byte=2000))["network"] == 1000
+
+def test_timing_headers():
+    assert timing_headers("req-1", 0.8123) == {"X-Request-Id": "req-1", "Server-Timing": "total;dur=812.3"}
+    histogram = Histogram([100])
+    assert histogram.stats()["p50_ms"] is None
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,86 @@
+import pytest
+import pytest_asyncio
+import asyncio
+import numpy as np
+from app.tts_fanout import split_for_tts, synthesize_reply
+from app.audio_processing import join_pcm_segments, trim_silence
+
+LONG_REPLY = ("วันนี้บั้ดดี้ไปเที่ยวสวนสัตว์มาแล้วสนุกมากเลย เห็นช้างตัวใหญ่กำลังกินกล้วยอยู่ "
+              "แล้วก็มีลิงน้อยห้อยโหนอยู่บนต้นไม้ด้วยนะ หนูชอบสัตว์อะไรที่สุดเหรอ")
+
+def tone(seconds, amplitude=8000, sample_rate=24000, padding_seconds=0.2):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    speech = np.sin(2 * np.pi * 220 * t) * amplitude
+    padding = np.zeros(int(padding_seconds * sample_rate))
+    return np.concatenate([padding, speech, padding]).astype('<i2').tobytes()
+
+def test_short_reply_is_a_single_chunk():
+    assert split_for_tts("gpt response") == ["gpt response"]
+    assert split_for_tts("สวัสดีจ้า หนูชื่ออะไร") == ["สวัสดีจ้า หนูชื่ออะไร"]
+    assert split_for_tts("   ") == []
+
+def test_long_thai_reply_is_split_at_phrase_boundaries():
+    chunks = split_for_tts(LONG_REPLY, min_chars=40, max_chars=160)
+    assert len(chunks) > 1
+    assert " ".join(chunks) == " ".join(LONG_REPLY.split())
+    assert all(40 <= len(chunk) <= 160 for chunk in chunks)
+
+def test_english_words_are_not_split_apart():
+    text = "Buddy went to the zoo today and saw a very big elephant eating bananas with its trunk. Which animal would you like to see at the zoo?"
+    chunks = split_for_tts(text, min_chars=40, max_chars=160)
+    assert chunks == [
+        "Buddy went to the zoo today and saw a very big elephant eating bananas with its trunk.",
+        "Which animal would you like to see at the zoo?",
+    ]
+    # A short last sentence joins the one before it
+    assert len(split_for_tts("Buddy went to the zoo today and saw a very big elephant. Did you?", min_chars=40)) == 1
+
+def test_trim_silence_keeps_a_margin():
+    samples = np.frombuffer(tone(0.5), dtype='<i2')
+    trimmed = trim_silence(samples, margin_seconds=0.02)
+    assert abs(len(trimmed) - int((0.5 + 0.04) * 24000)) < 24
+
+def test_join_uses_a_fixed_pause_between_segments():
+    joined = np.frombuffer(join_pcm_segments([tone(0.5), tone(0.25)], pause_seconds=0.15), dtype='<i2')
+    # Each segment keeps 20 ms of margin on both sides, padding beyond that is gone
+    expected_seconds = (0.5 + 0.04) + 0.15 + (0.25 + 0.04)
+    assert abs(len(joined) / 24000 - expected_seconds) < 0.002
+    # The edges are faded, no segment starts at full amplitude
+    assert np.max(np.abs(np.diff(joined.astype(np.int32)))) < 2000
+
+@pytest.mark.asyncio
+async def test_synthesize_reply_runs_chunks_concurrently_and_keeps_order():
+    in_flight = 0
+    max_in_flight = 0
+    requested = []
+
+    async def fake_tts(text):
+        nonlocal in_flight, max_in_flight
+        requested.append(text)
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        # Later chunks finish first, the join must still follow the reply order
+        await asyncio.sleep(0.05 / len(requested))
+        in_flight -= 1
+        return tone(0.1 * len(text) / 10, amplitude=1000 * (len(requested)))
+
+    pcm = await synthesize_reply(LONG_REPLY, fake_tts, concurrency=2)
+
+    chunks = split_for_tts(LONG_REPLY)
+    assert requested == chunks
+    assert max_in_flight == 2
+    assert len(pcm) > 0
+
+@pytest.mark.asyncio
+async def test_synthesize_reply_sends_short_replies_as_is():
+    calls = []
+
+    async def fake_tts(text):
+        calls.append(text)
+        return b"pcm"
+
+    assert await synthesize_reply("gpt response", fake_tts) == b"pcm"
+    assert calls == ["gpt response"]
+
+if __name__ == '__main__':
+    pytest.main()